@@ -0,0 +1,204 @@
+# admision.py
+# Control de admisión delante de la cuota de Groq (peticiones y tokens por minuto).
+# Cada consulta que va a usar el LLM reserva una estimación de su consumo antes de
+# reescribir, buscar o generar; si la cuota no alcanza espera en una cola con prioridad
+# (las consultas interactivas pasan antes que los lotes, que reservan cada llamada por
+# separado para no acaparar la cuota) y, si la cola está llena o la
+# espera estimada supera el máximo, se rechaza de inmediato con un `Retry-After`.
+# Al terminar, la reserva se ajusta al consumo real registrado en la traza de la petición.
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+
+from metricas import ADMISSION_DECISIONS, ADMISSION_QUEUE, ADMISSION_WAIT_SECONDS, current_trace, note
+
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# Llamadas a Groq por pregunta: reescritura + respuesta
+LLM_CALLS_PER_QUERY = 2
+
+
+class AdmissionRejected(Exception):
+    """La petición no se admite; `retry_after` son los segundos sugeridos al cliente."""
+
+    def __init__(self, retry_after, reason):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class Budget:
+    """
+    Cubeta de fichas que se rellena a `per_minute` por minuto. Admite deuda: un pedido
+    mayor que la capacidad pasa con la cubeta llena y deja el nivel en negativo, lo que
+    retrasa a los siguientes. `per_minute` = 0 significa sin límite.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self):
+        return self.capacity <= 0
+
+    def refill(self, now):
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount, ahead=0.0):
+        """Segundos hasta poder gastar `amount` después de lo ya comprometido (`ahead`)."""
+        if self.unlimited:
+            return 0.0
+        return max(0.0, (min(amount, self.capacity) + ahead - self.level) / self.rate)
+
+    def spend(self, amount):
+        # Un `amount` negativo devuelve fichas (la reserva fue mayor que el consumo real)
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level - amount)
+
+
+class Ticket:
+    """Reserva de una petición admitida (o en cola)."""
+
+    def __init__(self, priority, requests, tokens):
+        self.priority = priority
+        self.requests = requests
+        self.tokens = tokens
+        self.future = None
+
+    def absorb(self, other):
+        """Suma a esta reserva la de `other` (las llamadas de un lote se ajustan juntas)."""
+        self.requests += other.requests
+        self.tokens += other.tokens
+
+
+class AdmissionController:
+    """
+    Presupuestos de peticiones y tokens por minuto con una cola de espera por prioridad.
+    Solo se usa desde el event loop (no es seguro entre hilos).
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0, tokens_per_query=4000,
+                 max_queue=100, max_wait=10.0, batch_max_wait=120.0):
+        self.requests = Budget(requests_per_minute)
+        self.tokens = Budget(tokens_per_minute)
+        self.tokens_per_query = tokens_per_query
+        self.max_queue = max_queue
+        self.max_wait = {INTERACTIVE: max_wait, BATCH: batch_max_wait}
+        self._queue = []                 # (prioridad, orden de llegada, Ticket)
+        self._order = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._pump_task = None
+
+    @property
+    def enabled(self):
+        return not (self.requests.unlimited and self.tokens.unlimited)
+
+    def _delay(self, requests, tokens, ahead_requests=0, ahead_tokens=0):
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        return max(self.requests.delay(requests, ahead_requests), self.tokens.delay(tokens, ahead_tokens))
+
+    def _grant(self, ticket):
+        self.requests.spend(ticket.requests)
+        self.tokens.spend(ticket.tokens)
+
+    def _estimated_wait(self, ticket):
+        """Espera si se atendiera después de todo lo encolado con prioridad igual o mayor."""
+        ahead = [t for _, _, t in self._queue if t.priority <= ticket.priority and not t.future.done()]
+        return self._delay(ticket.requests, ticket.tokens,
+                           sum(t.requests for t in ahead), sum(t.tokens for t in ahead))
+
+    async def acquire(self, priority=INTERACTIVE, queries=1, calls=None):
+        """
+        Reserva la cuota estimada para `queries` preguntas, o para `calls` llamadas sueltas
+        al LLM. Devuelve el Ticket cuando hay cuota, o lanza AdmissionRejected si la cola
+        está llena o la espera sería excesiva.
+        """
+        label = PRIORITY_NAMES[priority]
+        if calls is None:
+            calls = queries * LLM_CALLS_PER_QUERY
+        ticket = Ticket(priority, calls, calls * self.tokens_per_query / LLM_CALLS_PER_QUERY)
+        if not self._queue and self._delay(ticket.requests, ticket.tokens) <= 0:
+            self._grant(ticket)
+            ADMISSION_DECISIONS.labels(label, "admitted").inc()
+            return ticket
+
+        max_wait = self.max_wait[priority]
+        ticket.future = asyncio.get_running_loop().create_future()
+        wait = self._estimated_wait(ticket)
+        queued = sum(not t.future.done() for _, _, t in self._queue)
+        if queued >= self.max_queue or wait > max_wait:
+            ADMISSION_DECISIONS.labels(label, "rejected").inc()
+            reason = "cola llena" if queued >= self.max_queue else f"espera estimada {wait:.0f}s"
+            raise AdmissionRejected(max(1, math.ceil(wait)), reason)
+
+        heapq.heappush(self._queue, (priority, next(self._order), ticket))
+        ADMISSION_QUEUE.set(len(self._queue))
+        self._wakeup.set()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.ensure_future(self._pump())
+
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(ticket.future, timeout=max_wait)
+        except asyncio.TimeoutError:
+            # Llegaron consultas más prioritarias: la estimación inicial se quedó corta
+            ADMISSION_DECISIONS.labels(label, "timeout").inc()
+            raise AdmissionRejected(max(1, math.ceil(self._estimated_wait(ticket))), "tiempo de espera agotado")
+        waited = time.monotonic() - start
+        ADMISSION_DECISIONS.labels(label, "queued").inc()
+        ADMISSION_WAIT_SECONDS.labels(label).observe(waited)
+        note("admision", f"{waited * 1000:.0f}ms")
+        return ticket
+
+    async def _pump(self):
+        """Entrega la cuota a la cabeza de la cola en cuanto se repone."""
+        while self._queue:
+            _, _, ticket = self._queue[0]
+            if ticket.future.done():
+                # El cliente se desconectó o venció su plazo de espera
+                heapq.heappop(self._queue)
+                ADMISSION_QUEUE.set(len(self._queue))
+                continue
+            delay = self._delay(ticket.requests, ticket.tokens)
+            if delay <= 0:
+                heapq.heappop(self._queue)
+                ADMISSION_QUEUE.set(len(self._queue))
+                self._grant(ticket)
+                ticket.future.set_result(None)
+                continue
+            # Se despierta antes si llega algo más prioritario o se devuelve cuota
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def settle(self, ticket):
+        """
+        Ajusta la reserva al consumo real que registró la traza de la petición: llamadas a
+        Groq (con reintentos y hedging) y tokens informados. Sin tokens informados se usa la
+        estimación por llamada; sin llamadas (caché, coalescencia) se devuelve todo.
+        """
+        trace = current_trace.get()
+        if trace is None:
+            return
+        used_requests = trace.llm_calls
+        used_tokens = trace.llm_tokens or used_requests * self.tokens_per_query / LLM_CALLS_PER_QUERY
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        self.requests.spend(used_requests - ticket.requests)
+        self.tokens.spend(used_tokens - ticket.tokens)
+        self._wakeup.set()
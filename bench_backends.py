@@ -0,0 +1,89 @@
+# bench_backends.py
+# Compara, lado a lado, la latencia de búsqueda de ChromaDB y del backend NumPy (mmap)
+# sobre la misma base `tramites_chroma_db`, con las mismas consultas ya convertidas en
+# embeddings (el tiempo del modelo se excluye para medir solo la búsqueda).
+# Uso: python bench_backends.py --queries 300 --k 20
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from fragmentacion import PARENT_STORE_FILE
+from indice_numpy import NumpyVectorStore
+
+CHROMA_DB_PATH = "tramites_chroma_db"
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+
+def load_queries(n):
+    """Usa nombres de trámites (y su primera mitad, como consulta parcial) como consultas."""
+    with open(os.path.join(CHROMA_DB_PATH, PARENT_STORE_FILE), 'r', encoding='utf-8') as f:
+        names = [parent["Nombre_Tramite"] for parent in json.load(f).values()]
+    queries = []
+    for name in names:
+        words = name.split()
+        queries.append(name)
+        queries.append(" ".join(words[:max(2, len(words) // 2)]))
+    return queries[:n]
+
+
+def measure(search_fn, vectors, k, warmup=5):
+    for vector in vectors[:warmup]:
+        search_fn(vector, k)
+    latencies, results = [], []
+    for vector in vectors:
+        start = time.perf_counter()
+        docs = search_fn(vector, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([doc.metadata.get("chunk_id") or doc.metadata.get("source") for doc in docs])
+    return np.array(latencies), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latencia de búsqueda: ChromaDB vs. matriz NumPy con mmap.")
+    parser.add_argument("--queries", type=int, default=300, help="Número de consultas a medir.")
+    parser.add_argument("--k", type=int, default=20, help="Resultados por consulta.")
+    args = parser.parse_args()
+
+    embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+    queries = load_queries(args.queries)
+    print(f"Calculando embeddings de {len(queries)} consultas...")
+    vectors = embeddings.embed_documents(queries)
+
+    start = time.perf_counter()
+    chroma = Chroma(persist_directory=CHROMA_DB_PATH, embedding_function=embeddings)
+    chroma_load = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    numpy_store = NumpyVectorStore.load(CHROMA_DB_PATH, embeddings)
+    numpy_load = (time.perf_counter() - start) * 1000
+    if numpy_store is None:
+        print("No existe vectors.npy. Ejecuta primero la ingesta.")
+        return
+
+    backends = {
+        "chroma": (chroma_load, lambda v, k: chroma.similarity_search_by_vector(v, k=k)),
+        "numpy": (numpy_load, lambda v, k: numpy_store.similarity_search_by_vector(v, k=k)),
+    }
+    all_results = {}
+    print(f"\n{'backend':<8} {'carga ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'media ms':>9} {'consultas/s':>12}")
+    for name, (load_ms, search_fn) in backends.items():
+        latencies, results = measure(search_fn, vectors, args.k)
+        all_results[name] = results
+        print(f"{name:<8} {load_ms:>9.1f} {np.percentile(latencies, 50):>8.3f} {np.percentile(latencies, 95):>8.3f} "
+              f"{np.percentile(latencies, 99):>8.3f} {latencies.mean():>9.3f} {1000 / latencies.mean():>12.1f}")
+
+    # Chroma (HNSW) es aproximado: se mide cuánto coincide con la búsqueda exacta
+    overlap = np.mean([
+        len(set(a) & set(b)) / max(len(b), 1) for a, b in zip(all_results["chroma"], all_results["numpy"])
+    ])
+    print(f"\nCoincidencia de resultados chroma/numpy @k={args.k}: {overlap:.1%} "
+          f"({len(numpy_store)} vectores de dimensión {numpy_store.matrix.shape[1]})")
+
+
+if __name__ == "__main__":
+    main()
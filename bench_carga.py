@@ -0,0 +1,291 @@
+# bench_carga.py
+# Prueba de carga sin red ni cuota de Groq: levanta `main.app` en el mismo proceso, cambia
+# ChatGroq por un modelo simulado con latencia y velocidad de tokens configurables, y
+# reproduce consultas generadas a partir de tramites_extraidos_LISTA.json con la
+# concurrencia indicada. Informa rendimiento, percentiles p50/p95/p99 por etapa del
+# pipeline (las mismas trazas que /metrics) y memoria. El resultado se guarda en JSON con
+# el commit actual para comparar corridas entre versiones (--compare).
+# Uso: python bench_carga.py --queries 300 --concurrency 16 --llm-latency 0.4
+# Requiere la base `tramites_chroma_db` ya ingestada y el modelo de embeddings disponible.
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+import numpy as np
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from respuesta_simulada import simulated_words
+
+QUERIES_FILE = "tramites_extraidos_LISTA.json"
+RESULTS_DIR = "resultados_bench"
+
+QUERY_TEMPLATES = (
+    "{name}",
+    "requisitos para {lower}",
+    "¿Cuánto cuesta {lower}?",
+    "¿Cómo hago el trámite de {lower}?",
+    "{prefix}",
+)
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Sustituto determinista de ChatGroq. Espera `latency` segundos antes del primer token y
+    luego emite `tokens_per_second`. A la plantilla de reescritura responde con la misma
+    pregunta; al resto, con una respuesta fija de `answer_tokens` palabras.
+    """
+
+    latency: float = 0.3
+    tokens_per_second: float = 400.0
+    answer_tokens: int = 150
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+    def _reply(self, messages):
+        prompt = "\n".join(str(message.content) for message in messages)
+        words = simulated_words(prompt, self.answer_tokens)
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(words),
+                 "total_tokens": len(prompt) // 4 + len(words)}
+        return words, usage
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        words, usage = self._reply(messages)
+        time.sleep(self.latency + len(words) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=" ".join(words), usage_metadata=usage))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        words, usage = self._reply(messages)
+        await asyncio.sleep(self.latency + len(words) / self.tokens_per_second)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=" ".join(words), usage_metadata=usage))])
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        words, usage = self._reply(messages)
+        await asyncio.sleep(self.latency)
+        for i, word in enumerate(words):
+            await asyncio.sleep(1 / self.tokens_per_second)
+            last = i == len(words) - 1
+            yield ChatGenerationChunk(message=AIMessageChunk(
+                content=word if last else f"{word} ", usage_metadata=usage if last else None
+            ))
+
+
+def load_queries(n, seed):
+    """Consultas variadas (nombre exacto, requisitos, costo, procedimiento, nombre parcial)."""
+    with open(QUERIES_FILE, 'r', encoding='utf-8') as f:
+        names = [t["Nombre_Tramite"] for t in json.load(f) if t.get("Nombre_Tramite")]
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n):
+        name = rng.choice(names).strip()
+        words = name.split()
+        template = rng.choice(QUERY_TEMPLATES)
+        queries.append(template.format(name=name, lower=name[0].lower() + name[1:],
+                                       prefix=" ".join(words[:max(2, len(words) // 2)])))
+    return queries
+
+
+def rss_mb():
+    """Memoria residente actual del proceso (Linux); si no está disponible, el pico."""
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentiles(values_ms):
+    values = np.asarray(values_ms, dtype=float)
+    if not len(values):
+        return {"n": 0}
+    return {
+        "n": int(len(values)),
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p95": round(float(np.percentile(values, 95)), 2),
+        "p99": round(float(np.percentile(values, 99)), 2),
+        "mean": round(float(values.mean()), 2),
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocido"
+
+
+async def run_load(app, queries, concurrency, endpoint):
+    """Lanza las consultas con `concurrency` clientes simultáneos; devuelve latencias y errores."""
+    latencies, errors = [], 0
+    pending = iter(queries)
+    transport = httpx.ASGITransport(app=app)
+
+    async def worker(client):
+        nonlocal errors
+        for query in pending:
+            start = time.perf_counter()
+            response = await client.post(endpoint, json={"query_text": query})
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200 or "event: error" in response.text:
+                errors += 1
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        wall = time.perf_counter() - start
+    return latencies, errors, wall
+
+
+def print_report(results):
+    print(f"\nCommit {results['commit']} | {results['config']['queries']} consultas | "
+          f"concurrencia {results['config']['concurrency']} | {results['config']['endpoint']}")
+    print(f"Rendimiento: {results['throughput_rps']:.2f} consultas/s | errores: {results['errors']}")
+    print(f"\n{'etapa':<10} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'media ms':>9}")
+    rows = [("petición", results["latency_ms"])] + list(results["stages_ms"].items())
+    for name, stats in rows:
+        if stats.get("n"):
+            print(f"{name:<10} {stats['n']:>6} {stats['p50']:>9.1f} {stats['p95']:>9.1f} "
+                  f"{stats['p99']:>9.1f} {stats['mean']:>9.1f}")
+    memory = results["memory_mb"]
+    print(f"\nMemoria (MB): tras cargar {memory['after_load']:.0f} | tras la carga de trabajo "
+          f"{memory['after_run']:.0f} | pico {memory['peak']:.0f}")
+
+
+def print_comparison(results, baseline):
+    """Diferencias frente a una corrida anterior (mismo formato JSON)."""
+    print(f"\nComparación con {baseline['commit']} ({baseline['timestamp']}):")
+    if baseline["config"] != results["config"]:
+        print("  Aviso: la configuración de ambas corridas no coincide.")
+
+    def delta(name, new, old):
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"  {name:<22} {old:>9.1f} -> {new:>9.1f} ({change:+.1f}%)")
+
+    delta("consultas/s", results["throughput_rps"], baseline["throughput_rps"])
+    for pct in ("p50", "p95", "p99"):
+        delta(f"petición {pct} ms", results["latency_ms"][pct], baseline["latency_ms"][pct])
+    for name, stats in results["stages_ms"].items():
+        old = baseline["stages_ms"].get(name)
+        if old and old.get("n") and stats.get("n"):
+            delta(f"{name} p95 ms", stats["p95"], old["p95"])
+
+
+async def main_async(args, workdir):
+    # La configuración de main.py se lee al importarlo: se fija antes
+    os.environ.setdefault("STARTUP_MODE", "eager")
+    # Cachés persistentes en `workdir`, un directorio temporal que se borra al terminar: cada
+    # corrida empieza en frío y no hereda (ni deja) reescrituras o embeddings
+    os.environ["REWRITE_CACHE_PATH"] = os.path.join(workdir, "rewrite_cache.json")
+    os.environ["EMBEDDING_DISK_CACHE_PATH"] = os.path.join(workdir, "embeddings_cache.sqlite3")
+    if not args.response_cache:
+        os.environ["RESPONSE_CACHE_SIZE"] = "0"
+
+    import main
+    from metricas import TRACE_LISTENERS
+
+    stub = StubChatModel(latency=args.llm_latency, tokens_per_second=args.tokens_per_second,
+                         answer_tokens=args.answer_tokens)
+    main.ChatGroq = lambda **kwargs: stub
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    start = time.perf_counter()
+    with quiet:
+        await main.initialize()
+    load_seconds = time.perf_counter() - start
+    if not main.rag_pipeline:
+        print(f"No se pudo inicializar el pipeline: {main.startup_state['error']}")
+        return
+    memory_after_load = rss_mb()
+
+    stage_samples = {}
+    server_latencies = []
+
+    def collect(trace, status, elapsed):
+        server_latencies.append(elapsed * 1000)
+        for name, seconds in trace.stages.items():
+            stage_samples.setdefault(name, []).append(seconds * 1000)
+
+    TRACE_LISTENERS.append(collect)
+    queries = load_queries(args.queries, args.seed)
+    endpoint = "/chat/stream" if args.endpoint == "stream" else "/chat"
+    print(f"Pipeline cargado en {load_seconds:.1f}s. Lanzando {len(queries)} consultas "
+          f"({args.concurrency} concurrentes) contra {endpoint}...")
+    with quiet:
+        latencies, errors, wall = await run_load(main.app, queries, args.concurrency, endpoint)
+    TRACE_LISTENERS.remove(collect)
+    main.rag_pipeline.shutdown()
+
+    results = {
+        "commit": current_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "queries": args.queries, "concurrency": args.concurrency, "endpoint": args.endpoint,
+            "seed": args.seed, "llm_latency": args.llm_latency, "tokens_per_second": args.tokens_per_second,
+            "answer_tokens": args.answer_tokens, "response_cache": args.response_cache,
+            "vector_backend": main.VECTOR_BACKEND,
+        },
+        "load_seconds": round(load_seconds, 2),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else 0.0,
+        "errors": errors,
+        "latency_ms": percentiles(latencies),
+        "server_latency_ms": percentiles(server_latencies),
+        "stages_ms": {name: percentiles(samples) for name, samples in stage_samples.items()},
+        "memory_mb": {"after_load": round(memory_after_load, 1), "after_run": round(rss_mb(), 1),
+                      "peak": round(peak_rss_mb(), 1)},
+    }
+    print_report(results)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit']}_{args.endpoint}_c{args.concurrency}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nResultados guardados en '{output}'.")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print_comparison(results, json.load(f))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del asistente con un LLM simulado local.")
+    parser.add_argument("--queries", type=int, default=200, help="Número de consultas a lanzar.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Clientes simultáneos.")
+    parser.add_argument("--endpoint", choices=["chat", "stream"], default="chat", help="Endpoint a medir.")
+    parser.add_argument("--seed", type=int, default=42, help="Semilla del conjunto de consultas.")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Segundos hasta el primer token del LLM.")
+    parser.add_argument("--tokens-per-second", type=float, default=400.0, help="Velocidad de generación simulada.")
+    parser.add_argument("--answer-tokens", type=int, default=150, help="Tokens de cada respuesta simulada.")
+    parser.add_argument("--response-cache", action="store_true",
+                        help="Mantiene la caché de respuestas (por defecto se desactiva para medir el pipeline).")
+    parser.add_argument("--output", help=f"Archivo JSON de resultados (por defecto en {RESULTS_DIR}/).")
+    parser.add_argument("--compare", help="JSON de una corrida anterior para mostrar las diferencias.")
+    parser.add_argument("--verbose", action="store_true", help="Muestra los logs del servidor.")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        asyncio.run(main_async(args, workdir))
+
+
+if __name__ == "__main__":
+    main()
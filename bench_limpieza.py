@@ -0,0 +1,84 @@
+# bench_limpieza.py
+# Compara la limpieza de HTML de la ingesta: la implementación anterior (un árbol de
+# BeautifulSoup por campo) contra el extractor de limpieza_html.py, en un proceso y
+# repartido en un pool de procesos. Antes de medir verifica que las salidas sean idénticas.
+# Los scrapers actuales ya guardan texto plano, así que `--as-html` convierte cada línea en
+# un párrafo HTML para medir entradas que sí traen el HTML de gob.ec.
+# Uso: python bench_limpieza.py tramites_extraidos_LISTA.json --as-html --workers 4 --repeat 3
+
+import argparse
+import html
+import os
+import time
+
+from bs4 import BeautifulSoup
+
+from lectura_tramites import iter_tramites
+from limpieza_html import clean_all_fields, map_bounded
+
+
+def clean_html_bs4(html_content):
+    """La limpieza que usaban ingest_chroma.py e ingest_dinamico.py."""
+    if html_content and isinstance(html_content, str) and '<' in html_content:
+        soup = BeautifulSoup(html_content, "html.parser")
+        return soup.get_text(separator="\n", strip=True)
+    return str(html_content).strip() if html_content else "No disponible"
+
+
+def clean_all_fields_bs4(tramite):
+    return {k: clean_html_bs4(v) for k, v in tramite.items()}
+
+
+def as_html(tramite):
+    """El trámite con cada línea de texto como <p>, como lo publica gob.ec antes de limpiar."""
+    return {k: "".join(f"<p>{html.escape(line)}</p>" for line in v.split("\n")) if isinstance(v, str) and v else v
+            for k, v in tramite.items()}
+
+
+def measure(clean_fn, tramites, repeat):
+    """Mejor tiempo de `repeat` pasadas (segundos) y el resultado de la última."""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = clean_fn(tramites)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Limpieza de HTML: BeautifulSoup vs. extractor de una pasada.")
+    parser.add_argument("json_file", nargs="?", default="tramites_extraidos_LISTA.json",
+                        help="Archivo de trámites (JSON o JSONL).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos de la variante en paralelo.")
+    parser.add_argument("--repeat", type=int, default=3, help="Pasadas por variante (se informa la mejor).")
+    parser.add_argument("--as-html", action="store_true", help="Convierte los campos en HTML antes de medir.")
+    args = parser.parse_args()
+
+    tramites = list(iter_tramites(args.json_file))
+    if args.as_html:
+        tramites = [as_html(t) for t in tramites]
+    fields = sum(len(t) for t in tramites)
+    html_fields = sum(isinstance(v, str) and '<' in v for t in tramites for v in t.values())
+    print(f"{len(tramites)} trámites, {fields} campos ({html_fields} con HTML).")
+
+    variants = {
+        "bs4": lambda ts: [clean_all_fields_bs4(t) for t in ts],
+        "rápida": lambda ts: [clean_all_fields(t) for t in ts],
+        f"rápida x{args.workers}": lambda ts: list(map_bounded(clean_all_fields, ts, workers=args.workers)),
+    }
+    results = {}
+    print(f"\n{'variante':<12} {'segundos':>9} {'trámites/s':>11} {'campos/s':>10} {'aceleración':>12}")
+    baseline = None
+    for name, clean_fn in variants.items():
+        seconds, results[name] = measure(clean_fn, tramites, args.repeat)
+        baseline = baseline or seconds
+        print(f"{name:<12} {seconds:>9.3f} {len(tramites) / seconds:>11.1f} {fields / seconds:>10.0f} "
+              f"{baseline / seconds:>11.1f}x")
+
+    reference = results["bs4"]
+    identical = all(result == reference for result in results.values())
+    print(f"\nSalidas idénticas a BeautifulSoup: {'sí' if identical else 'NO'}")
+
+
+if __name__ == "__main__":
+    main()
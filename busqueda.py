@@ -0,0 +1,165 @@
+# busqueda.py
+# Búsqueda híbrida: combina los resultados semánticos de Chroma con los del índice BM25
+# mediante Reciprocal Rank Fusion (RRF). Así un `k` pequeño ya trae los trámites correctos
+# aunque el usuario use siglas o términos exactos que MiniLM no captura bien.
+# Si la base está fragmentada por secciones, los fragmentos ganadores se agrupan por
+# trámite padre (ParentStore) y el LLM recibe solo las secciones que coincidieron.
+# Los filtros de facetas (institución, gratuidad, fecha) se aplican antes de comparar
+# vectores: `filter=` en Chroma, máscara de filas en NumPy y filtro en BM25.
+# `search_tramites` expone el mismo ranking sin LLM (endpoint /search): trámites con su
+# puntaje, campos seleccionados y paginación.
+
+from facetas import matches_where, to_where
+from fragmentacion import SECTIONS
+from metricas import stage
+
+# Campos que /search puede devolver de cada trámite
+TRAMITE_FIELDS = ("Nombre_Tramite", "Institucion_Responsable", "URL_Fuente", "Fecha_Actualizacion")
+FACET_FIELDS = ("institucion", "gratuito")
+RESULT_FIELDS = TRAMITE_FIELDS + tuple(field for field, _ in SECTIONS) + FACET_FIELDS
+DEFAULT_RESULT_FIELDS = TRAMITE_FIELDS
+
+
+def document_key(doc):
+    """Identidad de un documento (o fragmento) para fusionar listas de resultados."""
+    return doc.metadata.get("chunk_id") or doc.metadata.get("source") or doc.page_content
+
+
+def rrf_scores(result_lists, rrf_k=60):
+    """[(Document, puntaje)] fusionados y ordenados: puntaje = suma de 1 / (rrf_k + posición)."""
+    scores = {}
+    docs = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            key = document_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [(docs[key], scores[key]) for key in ranked]
+
+
+def reciprocal_rank_fusion(result_lists, k, rrf_k=60):
+    """Fusiona varias listas ordenadas de Document y devuelve los `k` mejores."""
+    return [doc for doc, _ in rrf_scores(result_lists, rrf_k)[:k]]
+
+
+class HybridSearcher:
+    """
+    Búsqueda vectorial (Chroma) + léxica (BM25) fusionada con RRF.
+    Sin índice léxico se comporta como el retriever de Chroma con `k` resultados.
+    Con `parent_store`, `k` cuenta trámites padre y no fragmentos.
+    Todos los métodos son bloqueantes: se llaman desde el pool de hilos del pipeline.
+    """
+
+    def __init__(self, vector_store, lexical_index=None, k=3, candidates=20, rrf_k=60, parent_store=None):
+        self.vector_store = vector_store
+        self.lexical_index = lexical_index
+        self.parent_store = parent_store
+        self.k = k
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+
+    @property
+    def n_vector(self):
+        """Resultados a pedir a Chroma: con fusión o fragmentos se necesitan más candidatos."""
+        return self.candidates if self.lexical_index or self.parent_store else self.k
+
+    def vector_search(self, vector, where):
+        """Búsqueda vectorial por embedding ya calculado, acotada por `where`."""
+        kwargs = {"filter": where} if where else {}
+        return self.vector_store.similarity_search_by_vector(vector, k=self.n_vector, **kwargs)
+
+    def fuse(self, query, vector_docs, where=None):
+        # Con fragmentos se conservan todos los candidatos para agrupar después por trámite
+        n_fused = self.candidates if self.parent_store else self.k
+        if self.lexical_index:
+            accept = (lambda doc: matches_where(doc.metadata, where)) if where else None
+            lexical_docs = [doc for doc, _ in self.lexical_index.search(query, k=self.candidates, accept=accept)]
+            fused = reciprocal_rank_fusion([vector_docs, lexical_docs], k=n_fused, rrf_k=self.rrf_k)
+        else:
+            fused = vector_docs[:n_fused]
+        if self.parent_store:
+            return self.parent_store.assemble(fused, self.k)
+        return fused
+
+    def search(self, query, filters=None):
+        """`filters`: {"institucion", "gratuito", "actualizado_desde"} (ver facetas.to_where)."""
+        where = to_where(filters or {})
+        # El embedding se calcula aparte para medir por separado modelo y búsqueda
+        with stage("embed"):
+            vector = self.vector_store.embeddings.embed_query(query)
+        with stage("search"):
+            return self.fuse(query, self.vector_search(vector, where), where)
+
+    def scored_chunks(self, query, where, n):
+        """Fragmentos con su puntaje RRF (vectorial + BM25) usando `n` candidatos por lista."""
+        with stage("embed"):
+            vector = self.vector_store.embeddings.embed_query(query)
+        with stage("search"):
+            kwargs = {"filter": where} if where else {}
+            result_lists = [self.vector_store.similarity_search_by_vector(vector, k=n, **kwargs)]
+            if self.lexical_index:
+                accept = (lambda doc: matches_where(doc.metadata, where)) if where else None
+                result_lists.append([doc for doc, _ in self.lexical_index.search(query, k=n, accept=accept)])
+            return rrf_scores(result_lists, self.rrf_k)
+
+    def tramite_fields(self, url, doc, fields):
+        """Campos pedidos de un trámite: del trámite padre o, sin él, de la metadata del fragmento."""
+        parent = self.parent_store.parents.get(url) if self.parent_store else None
+        values = {}
+        for field in fields:
+            if field == "URL_Fuente":
+                values[field] = url
+            elif parent is None:
+                values[field] = doc.metadata.get(field.lower(), doc.metadata.get(field))
+            elif field in FACET_FIELDS:
+                values[field] = parent.get("facets", {}).get(field)
+            elif field in TRAMITE_FIELDS:
+                values[field] = parent.get(field)
+            else:
+                values[field] = parent["sections"].get(field)
+        return values
+
+    def search_tramites(self, query, filters=None, offset=0, limit=10, fields=DEFAULT_RESULT_FIELDS,
+                        max_results=100):
+        """
+        Ranking de trámites sin LLM para /search. Cada trámite toma el puntaje de su mejor
+        fragmento y lista las secciones que coincidieron. Devuelve {"total", "results"};
+        `total` cuenta los trámites del ranking, que llega hasta `max_results`.
+        """
+        where = to_where(filters or {})
+        # El número de candidatos no depende de la página: con otro tamaño cambiarían los
+        # puntajes RRF y el total, y al paginar se repetirían o saltarían trámites.
+        # Varios fragmentos por trámite: se piden más candidatos que trámites a devolver.
+        n = max(self.candidates, 3 * max_results)
+        tramites = {}
+        for doc, score in self.scored_chunks(query, where, n):
+            url = doc.metadata.get("source", "No disponible")
+            entry = tramites.setdefault(url, {"doc": doc, "score": score, "sections": []})
+            section = doc.metadata.get("section")
+            if section and section not in entry["sections"]:
+                entry["sections"].append(section)
+        ranking = list(tramites.items())[:max_results]
+        page = ranking[offset:offset + limit]
+        return {
+            "total": len(ranking),
+            "results": [
+                {"score": round(entry["score"], 6), "matched_sections": entry["sections"],
+                 **self.tramite_fields(url, entry["doc"], fields)}
+                for url, entry in page
+            ],
+        }
+
+    def search_many(self, queries, filters=None):
+        """
+        Varias consultas: un único `embed_documents` para todas y luego una búsqueda por
+        consulta. `filters` es una lista paralela a `queries` (o None).
+        """
+        wheres = [to_where(f or {}) for f in (filters or [None] * len(queries))]
+        with stage("embed"):
+            vectors = self.vector_store.embeddings.embed_documents(queries)
+        with stage("search"):
+            return [
+                self.fuse(query, self.vector_search(vector, where), where)
+                for query, vector, where in zip(queries, vectors, wheres)
+            ]
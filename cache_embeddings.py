@@ -0,0 +1,85 @@
+# cache_embeddings.py
+# Caché LRU en memoria para los embeddings de las consultas. Envuelve el modelo de
+# embeddings (interfaz `Embeddings` de LangChain), así que Chroma, la búsqueda híbrida y
+# la caché semántica de respuestas la usan sin cambios: una consulta repetida (o una
+# reescritura ya vista) no vuelve a pasar por MiniLM.
+
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def embedding_key(text):
+    """
+    Clave de caché: minúsculas y espacios colapsados. all-MiniLM-L6-v2 es un modelo
+    "uncased", así que dos textos con la misma clave producen el mismo embedding.
+    """
+    return " ".join(text.lower().split())
+
+
+class CachedEmbeddings(Embeddings):
+    """LRU acotada y segura entre hilos, con clave (modelo, texto normalizado)."""
+
+    def __init__(self, embeddings, model_name, max_entries=10000):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key):
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def _put(self, key, vector):
+        with self._lock:
+            self._cache[key] = vector
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def embed_query(self, text):
+        key = (self.model_name, embedding_key(text))
+        vector = self._get(key)
+        if vector is None:
+            vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+            self._put(key, vector)
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        """Busca cada texto en la caché y calcula los que falten en una sola llamada al modelo."""
+        keys = [(self.model_name, embedding_key(text)) for text in texts]
+        vectors = [self._get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                vectors[i] = np.asarray(vector, dtype=np.float32)
+                self._put(keys[i], vectors[i])
+        return [vector.tolist() for vector in vectors]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            vector_bytes = sum(vector.nbytes for vector in self._cache.values())
+            key_bytes = sum(sys.getsizeof(key[1]) for key in self._cache)
+            return {
+                "model": self.model_name,
+                "entries": len(self._cache),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "memory_bytes": vector_bytes + key_bytes,
+            }
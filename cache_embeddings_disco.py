@@ -0,0 +1,166 @@
+# cache_embeddings_disco.py
+# Caché persistente de embeddings en SQLite, compartida por la ingesta y el servidor.
+# La clave es el hash del texto exacto junto con el nombre del modelo, así que una sección
+# que no cambió entre dos ingestas (o una consulta ya vista tras reiniciar el servidor) no
+# vuelve a pasar por el modelo. Cuando el archivo supera su tamaño máximo se borran las
+# entradas usadas hace más tiempo.
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Al desalojar se baja hasta este porcentaje del máximo, para no desalojar en cada escritura
+EVICTION_LOW_WATER = 0.9
+# Variables por sentencia de SQLite (el límite por defecto ronda las 32 000)
+SQL_BATCH_SIZE = 500
+
+
+def cache_key(model_name, text):
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class DiskEmbeddingCache:
+    """
+    Vectores float32 por (modelo, texto) en una tabla SQLite con la fecha del último uso.
+    Segura entre hilos y entre procesos (modo WAL): varios workers y una ingesta pueden
+    compartir el archivo. Un error de SQLite se informa y se trata como fallo de caché.
+    """
+
+    def __init__(self, path, model_name, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.model_name = model_name
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._bytes = self._total_bytes()
+
+    def _total_bytes(self):
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, texts):
+        """Lista alineada con `texts`: el vector (np.float32) o None si no está en la caché."""
+        keys = [cache_key(self.model_name, text) for text in texts]
+        found = {}
+        try:
+            with self._lock:
+                for start in range(0, len(keys), SQL_BATCH_SIZE):
+                    batch = keys[start:start + SQL_BATCH_SIZE]
+                    marks = ",".join("?" * len(batch))
+                    found.update(self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", batch))
+                    if found:
+                        self._conn.execute(f"UPDATE embeddings SET last_used = ? WHERE key IN ({marks})",
+                                           [time.time(), *batch])
+                self._conn.commit()
+        except sqlite3.Error as e:
+            print(f"Aviso: caché de embeddings en disco no disponible ({e}).")
+            found = {}
+        vectors = [np.frombuffer(found[key], dtype=np.float32) if key in found else None for key in keys]
+        hits = sum(vector is not None for vector in vectors)
+        self.hits += hits
+        self.misses += len(vectors) - hits
+        return vectors
+
+    def put_many(self, texts, vectors):
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((cache_key(self.model_name, text), blob, len(blob), now))
+        try:
+            with self._lock:
+                before = self._conn.total_changes
+                self._conn.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+                self._conn.commit()
+                inserted = self._conn.total_changes - before
+                self._bytes += inserted * (rows[0][2] if rows else 0)
+                if self.max_bytes and self._bytes > self.max_bytes:
+                    # Otros procesos también escriben: se recalcula el total real antes de desalojar
+                    self._bytes = self._total_bytes()
+                    if self._bytes > self.max_bytes:
+                        self._evict()
+        except sqlite3.Error as e:
+            print(f"Aviso: no se pudo escribir en la caché de embeddings en disco ({e}).")
+
+    def _evict(self):
+        excess = self._bytes - int(self.max_bytes * EVICTION_LOW_WATER)
+        victims, freed = [], 0
+        for key, size in self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_used"):
+            if freed >= excess:
+                break
+            victims.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        self._conn.commit()
+        self._bytes -= freed
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "path": self.path,
+            "model": self.model_name,
+            "entries": entries,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_disk_cache(path, model_name, max_mb):
+    """La caché en `path` con `max_mb` megabytes como máximo, o None si está desactivada (0)."""
+    if not path or max_mb <= 0:
+        return None
+    cache = DiskEmbeddingCache(path, model_name, max_bytes=int(max_mb * 1024 * 1024))
+    print(f"Caché de embeddings en disco: '{path}' ({cache.stats()['entries']} vectores, máximo {max_mb} MB).")
+    return cache
+
+
+class DiskCachedEmbeddings(Embeddings):
+    """Envuelve un modelo de embeddings: consulta la caché en disco y calcula solo lo que falta."""
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        vectors = self.cache.get_many(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            self.cache.put_many([texts[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                vectors[i] = vector
+        return [np.asarray(vector, dtype=np.float32).tolist() for vector in vectors]
+
+    def embed_query(self, text):
+        vector = self.cache.get_many([text])[0]
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put_many([text], [vector])
+        return np.asarray(vector, dtype=np.float32).tolist()
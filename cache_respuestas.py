@@ -0,0 +1,219 @@
+# cache_respuestas.py
+# Caché de respuestas de /chat en dos niveles:
+#   1. Exacto: clave = pregunta normalizada (sin tildes, mayúsculas ni puntuación).
+#   2. Semántico: reutiliza una respuesta si el embedding de la pregunta está a una
+#      similitud coseno >= umbral de alguna pregunta ya respondida.
+# Expulsión LRU + TTL, tamaño máximo, contadores de aciertos y fallos, e invalidación
+# automática cuando los scripts de ingesta reconstruyen la base vectorial. El servidor no
+# recarga los índices en caliente: tras una reingesta la caché queda vacía y deja de guardar
+# respuestas (saldrían de los índices viejos) hasta que se reinicie el servicio.
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from normalizacion import normalize_text
+from version_indice import read_index_version
+
+
+class CachedResponse:
+    __slots__ = ("answer", "sources", "created_at", "embedding")
+
+    def __init__(self, answer, sources, embedding=None):
+        self.answer = answer
+        self.sources = sources
+        self.created_at = time.monotonic()
+        self.embedding = embedding
+
+
+class ResponseCache:
+    """
+    Caché LRU con TTL para respuestas completas del asistente.
+    `embed_fn` (texto -> vector) activa el nivel semántico; es bloqueante, así que
+    `lookup` debe llamarse desde un hilo del pool, no desde el event loop.
+    """
+
+    def __init__(self, max_entries=1000, ttl_seconds=6 * 3600, embed_fn=None,
+                 semantic_threshold=0.95, db_path=None, version_check_interval=2.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.embed_fn = embed_fn
+        # Un umbral >= 1 equivale a desactivar el nivel semántico
+        self.semantic_enabled = embed_fn is not None and semantic_threshold < 1
+        self.semantic_threshold = semantic_threshold
+        self.db_path = db_path
+        self.version_check_interval = version_check_interval
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._matrix = None      # embeddings apilados para el nivel semántico
+        self._matrix_keys = []
+        self._index_version = read_index_version(db_path) if db_path else None
+        self._last_version_check = time.monotonic()
+        # La base cambió después de arrancar: el servicio responde con índices viejos
+        self.index_stale = False
+
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    # --- Invalidación ---
+
+    def _check_index_version(self):
+        """
+        Vacía la caché si la base vectorial fue reconstruida desde la última consulta y, desde
+        entonces, no guarda respuestas nuevas: hasta reiniciar se generarían con los índices
+        cargados al arrancar, que ya no corresponden a la base (o fueron borrados).
+        """
+        if not self.db_path:
+            return
+        now = time.monotonic()
+        if now - self._last_version_check < self.version_check_interval:
+            return
+        self._last_version_check = now
+        version = read_index_version(self.db_path)
+        if version != self._index_version:
+            print(f"Índice reconstruido (versión {version}). Invalidando la caché de respuestas; "
+                  f"no se guardarán respuestas hasta reiniciar el servicio.")
+            self._index_version = version
+            self._clear_locked()
+            self.invalidations += 1
+            self.index_stale = True
+
+    def _clear_locked(self):
+        self._entries.clear()
+        self._matrix = None
+        self._matrix_keys = []
+
+    def clear(self):
+        with self._lock:
+            self._clear_locked()
+
+    # --- Lectura ---
+
+    def _is_expired(self, entry):
+        return time.monotonic() - entry.created_at > self.ttl_seconds
+
+    def _pop_locked(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry.embedding is not None:
+            self._matrix = None
+        return entry
+
+    def _semantic_match_locked(self, embedding):
+        if self._matrix is None:
+            self._matrix_keys = [k for k, e in self._entries.items() if e.embedding is not None]
+            if not self._matrix_keys:
+                return None
+            self._matrix = np.vstack([self._entries[k].embedding for k in self._matrix_keys])
+        scores = self._matrix @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < self.semantic_threshold:
+            return None
+        return self._matrix_keys[best]
+
+    def _lookup_exact_locked(self, key):
+        self._check_index_version()
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._is_expired(entry):
+            self._pop_locked(key)
+            return None
+        self._entries.move_to_end(key)
+        self.hits_exact += 1
+        return entry
+
+    def lookup_exact(self, question):
+        """Solo el nivel exacto (sin embedding). Seguro de llamar desde el event loop."""
+        with self._lock:
+            entry = self._lookup_exact_locked(normalize_text(question))
+            if entry is None:
+                self.misses += 1
+            return entry
+
+    def contains(self, question):
+        """¿Hay una respuesta exacta vigente? No cuenta como acierto ni cambia el orden LRU."""
+        with self._lock:
+            self._check_index_version()
+            entry = self._entries.get(normalize_text(question))
+            return entry is not None and not self._is_expired(entry)
+
+    def lookup(self, question):
+        """
+        Busca una respuesta para `question`. Devuelve (respuesta_cacheada | None, embedding).
+        El embedding calculado se devuelve para reutilizarlo en `store` y no repetirlo.
+        """
+        key = normalize_text(question)
+        with self._lock:
+            entry = self._lookup_exact_locked(key)
+            if entry is not None:
+                return entry, entry.embedding
+            if not self.semantic_enabled:
+                self.misses += 1
+                return None, None
+
+        embedding = self._normalize_vector(self.embed_fn(question))
+        with self._lock:
+            match_key = self._semantic_match_locked(embedding)
+            if match_key is not None:
+                entry = self._entries[match_key]
+                if self._is_expired(entry):
+                    self._pop_locked(match_key)
+                else:
+                    self._entries.move_to_end(match_key)
+                    self.hits_semantic += 1
+                    return entry, embedding
+            self.misses += 1
+        return None, embedding
+
+    # --- Escritura ---
+
+    @staticmethod
+    def _normalize_vector(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def store(self, question, answer, sources, embedding=None):
+        key = normalize_text(question)
+        if not key:
+            return
+        if embedding is not None:
+            embedding = self._normalize_vector(embedding)
+        with self._lock:
+            self._check_index_version()
+            if self.index_stale:
+                return
+            self._pop_locked(key)
+            self._entries[key] = CachedResponse(answer, sources, embedding)
+            if embedding is not None:
+                self._matrix = None
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                if evicted.embedding is not None:
+                    self._matrix = None
+                self.evictions += 1
+
+    # --- Estadísticas ---
+
+    def stats(self):
+        with self._lock:
+            hits = self.hits_exact + self.hits_semantic
+            total = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits_exact": self.hits_exact,
+                "hits_semantic": self.hits_semantic,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "index_version": self._index_version,
+                "index_stale": self.index_stale,
+            }
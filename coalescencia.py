@@ -0,0 +1,51 @@
+# coalescencia.py
+# Coalescencia de peticiones ("single-flight"): cuando llegan a la vez varias preguntas
+# iguales (una noticia dispara ráfagas de "nuevo requisito para pasaporte"), solo la
+# primera recorre la cadena; las demás esperan esa misma ejecución y comparten su resultado.
+
+import asyncio
+
+from metricas import COALESCED_REQUESTS, SINGLE_FLIGHT_EXECUTIONS, note
+
+
+class SingleFlight:
+    """Agrupa llamadas concurrentes con la misma clave en una sola ejecución."""
+
+    def __init__(self):
+        self._in_flight = {}   # clave -> asyncio.Task de la ejecución en curso
+        self.executions = 0
+        self.collapsed = 0
+
+    def __contains__(self, key):
+        """True si ya hay una ejecución en curso para `key` (una llamada a `run` se le uniría)."""
+        return key in self._in_flight
+
+    async def run(self, key, coro_fn, *args):
+        task = self._in_flight.get(key)
+        if task is None:
+            self.executions += 1
+            SINGLE_FLIGHT_EXECUTIONS.inc()
+            task = asyncio.ensure_future(coro_fn(*args))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.collapsed += 1
+            COALESCED_REQUESTS.inc()
+            note("coalescida", "si")
+        # shield: si un cliente se desconecta, la ejecución compartida sigue para los demás
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        self._in_flight.pop(key, None)
+        # Marca la excepción como leída aunque todos los que esperaban se hayan ido
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        total = self.executions + self.collapsed
+        return {
+            "in_flight": len(self._in_flight),
+            "executions": self.executions,
+            "collapsed": self.collapsed,
+            "collapse_rate": round(self.collapsed / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,158 @@
+# contexto.py
+# Armado del {context} del prompt de respuesta con un presupuesto de tokens:
+#   1. Separa cada documento recuperado en sus secciones (**Requisitos:**, **Costo:**...).
+#   2. Quita lo que no aporta: campos "No disponible", secciones repetidas entre documentos
+#      y URLs duplicadas.
+#   3. Ordena las secciones por relevancia frente a la pregunta y las empaqueta hasta agotar
+#      el presupuesto; la cabecera de cada trámite (nombre, institución, URL) siempre entra.
+
+import math
+import re
+
+from indice_lexico import tokenize
+from normalizacion import normalize_text
+
+SECTION_HEADER_RE = re.compile(r"^\*\*(.+?)\*\*\s*(.*)$")
+
+# Secciones de cabecera (siempre se incluyen) y de fuente (una sola vez por trámite)
+HEADER_TITLES = ("Trámite", "Institución Responsable")
+SOURCE_TITLE = "URL de la Fuente Oficial"
+EMPTY_VALUES = {"", "no disponible", "n/a"}
+
+# Las secciones que no caben completas se recortan si queda al menos este margen
+MIN_PARTIAL_TOKENS = 60
+
+
+class ContextPacker:
+    """
+    Construye el contexto del prompt a partir de los documentos recuperados respetando
+    `token_budget`. Los tokens se estiman por caracteres (Llama 3 ronda 3.5-4 caracteres
+    por token en español), que basta para no pasarse de la ventana de contexto.
+    """
+
+    def __init__(self, token_budget=3000, chars_per_token=3.5):
+        self.token_budget = token_budget
+        self.chars_per_token = chars_per_token
+
+    def estimate_tokens(self, text):
+        return math.ceil(len(text) / self.chars_per_token)
+
+    # --- 1. Separación en secciones ---
+
+    @staticmethod
+    def split_sections(page_content):
+        """Devuelve [(título, cuerpo)] a partir de los encabezados en negrita del documento."""
+        sections = []
+        title, lines = "", []
+        for line in page_content.splitlines():
+            match = SECTION_HEADER_RE.match(line.strip())
+            if match:
+                if title or any(l.strip() for l in lines):
+                    sections.append((title, "\n".join(lines).strip()))
+                title = match.group(1).strip().rstrip(":").strip()
+                lines = [match.group(2)] if match.group(2) else []
+            else:
+                lines.append(line)
+        if title or any(l.strip() for l in lines):
+            sections.append((title, "\n".join(lines).strip()))
+        return sections
+
+    # --- 2 y 3. Limpieza, ranking y empaquetado ---
+
+    def pack(self, question, docs):
+        """Devuelve (contexto, estadísticas) para `docs` ordenados por relevancia."""
+        raw_tokens = self.estimate_tokens(str(docs))
+        question_terms = set(tokenize(question))
+
+        seen_bodies = set()
+        tramites = []      # [{"header", "url", "sections"}] en orden de recuperación
+        by_url = {}
+        candidates = []    # (puntaje, índice_trámite, índice_sección)
+        for doc_rank, doc in enumerate(docs):
+            header, source, body_sections = [], None, []
+            for title, body in self.split_sections(doc.page_content):
+                if body.strip().lower() in EMPTY_VALUES:
+                    continue
+                if title in HEADER_TITLES:
+                    header.append(f"**{title}:** {body}")
+                elif title == SOURCE_TITLE:
+                    source = body
+                else:
+                    key = normalize_text(body)
+                    if key in seen_bodies:
+                        continue
+                    seen_bodies.add(key)
+                    body_sections.append((title, body))
+
+            url = source or doc.metadata.get("source")
+            if url in by_url:
+                # Mismo trámite recuperado dos veces: sus secciones nuevas se suman al primero
+                t_idx = by_url[url]
+            else:
+                t_idx = by_url[url] = len(tramites)
+                tramites.append({"header": header, "url": url, "sections": []})
+            for title, body in body_sections:
+                sections = tramites[t_idx]["sections"]
+                sections.append(f"{self.format_title(title)}\n{body}" if title else body)
+                candidates.append((self.relevance(question_terms, title, body, doc_rank), t_idx, len(sections) - 1))
+
+        # Cabeceras primero: cada trámite recuperado debe quedar identificado
+        used = 0
+        for tramite in tramites:
+            used += self.estimate_tokens("\n".join(tramite["header"]) + (tramite["url"] or "")) + 8
+
+        packed = {}
+        # A igual relevancia entran primero las secciones más cortas
+        ranked = sorted(candidates, key=lambda c: (-c[0], len(tramites[c[1]]["sections"][c[2]])))
+        for _, t_idx, s_idx in ranked:
+            text = tramites[t_idx]["sections"][s_idx]
+            remaining = self.token_budget - used
+            cost = self.estimate_tokens(text)
+            if cost <= remaining:
+                packed[(t_idx, s_idx)] = text
+                used += cost
+            elif remaining >= MIN_PARTIAL_TOKENS:
+                packed[(t_idx, s_idx)] = self.truncate(text, remaining)
+                used += remaining
+
+        blocks = []
+        for t_idx, tramite in enumerate(tramites):
+            parts = ["\n".join(tramite["header"])] if tramite["header"] else []
+            parts += [packed[(t_idx, s_idx)] for s_idx in range(len(tramite["sections"])) if (t_idx, s_idx) in packed]
+            if tramite["url"]:
+                parts.append(f"**{SOURCE_TITLE}:** {tramite['url']}")
+            blocks.append(f"--- Documento {t_idx + 1} ---\n" + "\n\n".join(parts))
+        context = "\n\n".join(blocks)
+
+        stats = {
+            "raw_tokens": raw_tokens,
+            "context_tokens": self.estimate_tokens(context),
+            "sections_total": len(candidates),
+            "sections_packed": len(packed),
+        }
+        stats["tokens_saved"] = max(stats["raw_tokens"] - stats["context_tokens"], 0)
+        return context, stats
+
+    @staticmethod
+    def format_title(title):
+        # Los títulos en forma de pregunta no llevan dos puntos
+        return f"**{title}**" if "?" in title else f"**{title}:**"
+
+    @staticmethod
+    def relevance(question_terms, title, body, doc_rank):
+        """
+        Proporción de términos de la pregunta presentes en la sección (título incluido),
+        más un pequeño premio por la posición del documento en la búsqueda.
+        """
+        if question_terms:
+            section_terms = set(tokenize(f"{title} {body}"))
+            overlap = len(question_terms & section_terms) / len(question_terms)
+        else:
+            overlap = 0.0
+        return overlap + 0.5 / (1 + doc_rank)
+
+    def truncate(self, text, max_tokens):
+        """Recorta `text` por líneas completas para que quepa en `max_tokens`."""
+        max_chars = int(max_tokens * self.chars_per_token) - 4
+        cut = text.rfind("\n", 0, max_chars)
+        return text[:cut if cut > 0 else max_chars].rstrip() + "\n(...)"
@@ -0,0 +1,225 @@
+# etapa_embeddings.py
+# Etapa de embeddings de la ingesta: calcula los vectores de los fragmentos por lotes de
+# tamaño configurable, reparte el trabajo entre varios núcleos (pool de procesos de
+# sentence-transformers o hilos para otros modelos), informa el avance con fragmentos/s y
+# tokens/s, y guarda puntos de control en disco para que una ejecución interrumpida
+# retome desde el último bloque terminado en lugar de empezar de cero. Con una caché en
+# disco (cache_embeddings_disco.py) las secciones ya vistas en otra ingesta no se recalculan.
+
+import glob
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+CHECKPOINT_META_FILE = "checkpoint.json"
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def checkpoint_dir_for(db_path):
+    """Junto a la base y no dentro, para que una reconstrucción completa no borre los puntos de control."""
+    return f"{os.path.normpath(db_path)}_checkpoint"
+
+
+class PrecomputedEmbeddings(Embeddings):
+    """Entrega a Chroma los vectores ya calculados por la etapa, sin volver a llamar al modelo."""
+
+    def __init__(self, vectors_by_text):
+        self.vectors_by_text = vectors_by_text
+
+    def embed_documents(self, texts):
+        return [self.vectors_by_text[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.vectors_by_text[text]
+
+
+class EmbeddingStage:
+    """
+    Calcula embeddings de fragmentos (Document) bloque a bloque: quien la usa le entrega
+    bloques de hasta `checkpoint_every` fragmentos a medida que los prepara. Cada bloque se
+    divide en lotes de `batch_size` que procesan `workers` procesos (si el modelo es de
+    sentence-transformers) o hilos; al terminar el bloque se guarda en `checkpoint_dir` y en
+    la caché `cache` (DiskEmbeddingCache), si la hay. El modelo se carga con
+    `embeddings_factory` solo si hay algo que calcular y se libera con `close()`.
+    """
+
+    def __init__(self, embeddings_factory, model_name, batch_size=64, workers=1,
+                 checkpoint_dir=None, checkpoint_every=2000, cache=None):
+        self.embeddings_factory = embeddings_factory
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.workers = max(1, workers)
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_every = max(checkpoint_every, batch_size)
+        self.cache = cache
+        self.model = None
+        self._pool = None
+        self._threads = None
+        self._saved = None
+        self._part = 0
+        self._start_time = None
+        self.stats = {"chunks": 0, "from_checkpoint": 0, "from_cache": 0, "tokens": 0, "seconds": 0.0}
+
+    # --- Modelo y paralelismo ---
+
+    def _sentence_transformer(self):
+        """El SentenceTransformer detrás de las clases de LangChain, si lo hay."""
+        client = getattr(self.model, "client", None)
+        return client if hasattr(client, "start_multi_process_pool") else None
+
+    def _start(self):
+        self.model = self.embeddings_factory()
+        client = self._sentence_transformer()
+        if self.workers > 1 and client is not None:
+            print(f"Iniciando {self.workers} procesos de embeddings (sentence-transformers)...")
+            self._pool = client.start_multi_process_pool(target_devices=["cpu"] * self.workers)
+        elif self.workers > 1:
+            self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="embeddings")
+
+    def _stop(self):
+        if self._pool is not None:
+            self._sentence_transformer().stop_multi_process_pool(self._pool)
+            self._pool = None
+        if self._threads is not None:
+            self._threads.shutdown()
+            self._threads = None
+
+    def _encode(self, texts):
+        client = self._sentence_transformer()
+        if client is not None:
+            kwargs = {**(getattr(self.model, "encode_kwargs", None) or {}), "batch_size": self.batch_size}
+            if self._pool is not None:
+                kwargs["pool"] = self._pool
+            return np.asarray(client.encode(texts, **kwargs), dtype=np.float32)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        mapper = self._threads.map if self._threads is not None else map
+        return np.asarray([v for vectors in mapper(self.model.embed_documents, batches) for v in vectors],
+                          dtype=np.float32)
+
+    def count_tokens(self, texts):
+        """Tokens reales si el modelo expone su tokenizador (con su truncado); si no, ~4 caracteres por token."""
+        client = self._sentence_transformer()
+        tokenizer = getattr(client, "tokenizer", None)
+        if tokenizer is None:
+            return sum(len(text) for text in texts) // 4
+        max_length = getattr(client, "max_seq_length", None)
+        encoded = tokenizer(texts, truncation=max_length is not None, max_length=max_length)
+        return sum(len(ids) for ids in encoded["input_ids"])
+
+    # --- Puntos de control ---
+
+    def load_checkpoint(self):
+        """chunk_id -> (hash del texto, vector) de las ejecuciones anteriores interrumpidas."""
+        if not self.checkpoint_dir or not os.path.isdir(self.checkpoint_dir):
+            return {}
+        meta_path = os.path.join(self.checkpoint_dir, CHECKPOINT_META_FILE)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            meta = {}
+        if meta.get("model") != self.model_name:
+            self.clear_checkpoint()
+            return {}
+        saved = {}
+        for path in sorted(glob.glob(os.path.join(self.checkpoint_dir, "part-*.npz"))):
+            with np.load(path) as part:
+                for chunk_id, digest, vector in zip(part["ids"], part["hashes"], part["vectors"]):
+                    saved[str(chunk_id)] = (str(digest), vector)
+        return saved
+
+    def save_checkpoint(self, part, chunk_ids, digests, vectors):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        with open(os.path.join(self.checkpoint_dir, CHECKPOINT_META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({"model": self.model_name}, f)
+        # Se escribe con otro nombre y se renombra: un corte a mitad no deja un bloque a medias
+        path = os.path.join(self.checkpoint_dir, f"part-{part:05d}.npz")
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, ids=np.asarray(chunk_ids), hashes=np.asarray(digests), vectors=vectors)
+        os.replace(tmp_path, path)
+
+    def clear_checkpoint(self):
+        if self.checkpoint_dir and os.path.isdir(self.checkpoint_dir):
+            shutil.rmtree(self.checkpoint_dir)
+
+    # --- Ejecución ---
+
+    def embed(self, chunks):
+        """
+        Vectores de un bloque de `chunks`, en el mismo orden (lista de listas de float). Los
+        que estaban en el punto de control o en la caché en disco no pasan por el modelo.
+        """
+        if self._saved is None:
+            self._saved = self.load_checkpoint()
+            self._part = len(glob.glob(os.path.join(self.checkpoint_dir, "part-*.npz"))) if self.checkpoint_dir else 0
+            if self._saved:
+                print(f"Punto de control: {len(self._saved)} fragmentos calculados en una ejecución anterior.")
+        vectors = [None] * len(chunks)
+        pending = []
+        for i, chunk in enumerate(chunks):
+            # pop: cada vector recuperado deja de ocupar memoria en el diccionario
+            entry = self._saved.pop(chunk.metadata["chunk_id"], None)
+            if entry and entry[0] == text_hash(chunk.page_content):
+                vectors[i] = entry[1]
+            else:
+                pending.append(i)
+        self.stats["from_checkpoint"] += len(chunks) - len(pending)
+        if self.cache is not None and pending:
+            cached = self.cache.get_many([chunks[i].page_content for i in pending])
+            for i, vector in zip(pending, cached):
+                if vector is not None:
+                    vectors[i] = vector
+            still_pending = [i for i, vector in zip(pending, cached) if vector is None]
+            self.stats["from_cache"] += len(pending) - len(still_pending)
+            pending = still_pending
+
+        if pending:
+            if self.model is None:
+                self._start_time = time.perf_counter()
+                self._start()
+            texts = [chunks[i].page_content for i in pending]
+            block_vectors = self._encode(texts)
+            for i, vector in zip(pending, block_vectors):
+                vectors[i] = vector
+            self.stats["chunks"] += len(pending)
+            self.stats["tokens"] += self.count_tokens(texts)
+            if self.checkpoint_dir:
+                self.save_checkpoint(self._part, [chunks[i].metadata["chunk_id"] for i in pending],
+                                     [text_hash(t) for t in texts], block_vectors)
+                self._part += 1
+            if self.cache is not None:
+                self.cache.put_many(texts, block_vectors)
+            elapsed = time.perf_counter() - self._start_time
+            print(f"  -> {self.stats['chunks']} fragmentos calculados ({self.stats['chunks'] / elapsed:.1f} fragmentos/s, "
+                  f"{self.stats['tokens'] / elapsed:.0f} tokens/s)")
+        return [np.asarray(v).tolist() for v in vectors]
+
+    def close(self):
+        """
+        Libera el modelo y sus procesos. Devuelve las estadísticas de la etapa: fragmentos
+        calculados, recuperados del punto de control o de la caché en disco, segundos y
+        rendimiento en fragmentos/s y tokens/s.
+        """
+        if self.model is not None:
+            self._stop()
+            self.model = None
+        stats = self.stats
+        if self.cache is not None:
+            print(f"Caché en disco: {stats['from_cache']} fragmentos ya tenían embedding.")
+        if stats["chunks"]:
+            stats["seconds"] = time.perf_counter() - self._start_time
+            stats["chunks_per_second"] = stats["chunks"] / stats["seconds"]
+            stats["tokens_per_second"] = stats["tokens"] / stats["seconds"]
+            print(f"Embeddings: {stats['chunks']} fragmentos en {stats['seconds']:.1f}s "
+                  f"({stats['chunks_per_second']:.1f} fragmentos/s, {stats['tokens_per_second']:.0f} tokens/s, "
+                  f"lotes de {self.batch_size}, {self.workers} workers).")
+        return stats
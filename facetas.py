@@ -0,0 +1,184 @@
+# facetas.py
+# Metadatos estructurados de cada trámite (institución normalizada, si es gratuito y la
+# fecha de actualización) e índice de facetas construido en la ingesta. Permiten acotar
+# la búsqueda antes de la similitud vectorial: "¿qué trámites del MAG son gratuitos?"
+# solo compara contra los fragmentos del MAG sin costo.
+
+import json
+import os
+import re
+from datetime import datetime
+
+from indice_lexico import SPANISH_STOPWORDS
+from normalizacion import normalize_text
+
+FACETS_FILE = "facetas.json"
+
+ACRONYM_RE = re.compile(r"\(([^()]+)\)\s*$")
+DATE_FORMATS = ("%Y/%m/%d", "%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y")
+
+# Frases del campo Costo que indican un trámite sin pago (ya normalizadas)
+FREE_COST_PHRASES = ("no tiene costo", "sin costo", "gratuito", "gratuita", "gratis", "no genera costo")
+# Frases de la pregunta que piden trámites gratuitos
+FREE_QUERY_PHRASES = ("gratis", "gratuito", "gratuita", "gratuitos", "gratuitas", "sin costo",
+                      "no tiene costo", "sin pagar", "no cuesta", "sin pago")
+
+# Nombres populares que no aparecen en el nombre oficial de la institución
+INSTITUTION_ALIASES = {
+    "agrocalidad": "arcfz",
+    "registro civil": "dgrcic",
+    "seguro social": "iess",
+    "rentas internas": "sri",
+    "transito": "ant",
+}
+
+
+def institution_key(name):
+    """'Ministerio de Agricultura y Ganadería (MAG)' -> 'mag'; sin sigla, el nombre normalizado."""
+    if not name or name in ("No disponible", "N/A"):
+        return ""
+    match = ACRONYM_RE.search(name)
+    return normalize_text(match.group(1) if match else name)
+
+
+def institution_full_name(name):
+    """Nombre sin la sigla final entre paréntesis, normalizado."""
+    return normalize_text(ACRONYM_RE.sub("", name or ""))
+
+
+def is_free(costo):
+    text = normalize_text(costo)
+    return any(phrase in text for phrase in FREE_COST_PHRASES)
+
+
+def parse_date(value):
+    """Fecha_Actualizacion -> entero AAAAMMDD (0 si no se puede interpretar)."""
+    for fmt in DATE_FORMATS:
+        try:
+            return int(datetime.strptime((value or "").strip(), fmt).strftime("%Y%m%d"))
+        except ValueError:
+            continue
+    return 0
+
+
+def facet_metadata(cleaned_text):
+    """Metadatos de facetas para Document.metadata (solo tipos admitidos por Chroma)."""
+    return {
+        "institucion": institution_key(cleaned_text.get("Institucion_Responsable")),
+        "gratuito": is_free(cleaned_text.get("Costo")),
+        "fecha_actualizacion": parse_date(cleaned_text.get("Fecha_Actualizacion")),
+    }
+
+
+# --- Filtros: formato "where" de Chroma, evaluable también en memoria ---
+
+def to_where(filters):
+    """
+    {"institucion": "mag", "gratuito": True, "actualizado_desde": 20250101} -> filtro `where`
+    de Chroma. Devuelve None si no hay filtros.
+    """
+    conditions = []
+    if filters.get("institucion"):
+        conditions.append({"institucion": {"$eq": filters["institucion"]}})
+    if filters.get("gratuito") is not None:
+        conditions.append({"gratuito": {"$eq": bool(filters["gratuito"])}})
+    if filters.get("actualizado_desde"):
+        conditions.append({"fecha_actualizacion": {"$gte": int(filters["actualizado_desde"])}})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def matches_where(metadata, where):
+    """Evalúa en memoria el subconjunto de `where` que genera `to_where`."""
+    if not where:
+        return True
+    if "$and" in where:
+        return all(matches_where(metadata, condition) for condition in where["$and"])
+    for field, condition in where.items():
+        value = metadata.get(field)
+        if "$eq" in condition and value != condition["$eq"]:
+            return False
+        if "$gte" in condition and (value is None or value < condition["$gte"]):
+            return False
+    return True
+
+
+class FacetIndex:
+    """
+    Índice de facetas: institución -> número de trámites y nombre, trámites gratuitos, y
+    alias para detectar la institución mencionada en una pregunta.
+    """
+
+    def __init__(self, institutions=None, free_count=0):
+        self.institutions = institutions or {}   # clave -> {"nombre", "tramites", "aliases"}
+        self.free_count = free_count
+        self._build_aliases()
+
+    def _build_aliases(self):
+        self.aliases = {}
+        for key, info in self.institutions.items():
+            for alias in info.get("aliases", []):
+                # Siglas muy cortas o que son palabras comunes ("una") darían falsos positivos
+                if len(alias) >= 3 and alias not in SPANISH_STOPWORDS:
+                    self.aliases.setdefault(alias, key)
+        for alias, key in INSTITUTION_ALIASES.items():
+            if key in self.institutions:
+                self.aliases.setdefault(alias, key)
+        # Alias largos primero para preferir la coincidencia más específica
+        self._aliases_by_length = sorted(self.aliases, key=len, reverse=True)
+
+    @classmethod
+    def from_parents(cls, parent_store):
+        institutions = {}
+        free_count = 0
+        for parent in parent_store.parents.values():
+            name = parent.get("Institucion_Responsable", "")
+            key = institution_key(name)
+            if key:
+                info = institutions.setdefault(key, {"nombre": name, "tramites": 0,
+                                                     "aliases": sorted({key, institution_full_name(name)})})
+                info["tramites"] += 1
+            free_count += bool(parent.get("facets", {}).get("gratuito"))
+        return cls(institutions, free_count)
+
+    def detect(self, question):
+        """Filtros implícitos en la pregunta: institución mencionada y/o pedido de gratuidad."""
+        text = f" {normalize_text(question)} "
+        filters = {}
+        for alias in self._aliases_by_length:
+            if f" {alias} " in text:
+                filters["institucion"] = self.aliases[alias]
+                break
+        if any(f" {phrase} " in text for phrase in FREE_QUERY_PHRASES):
+            filters["gratuito"] = True
+        return filters
+
+    def resolve_institution(self, value):
+        """
+        Clave de la institución que nombra `value` (sigla, nombre oficial con o sin sigla, o
+        un alias popular como "Agrocalidad"), o None si no corresponde a ninguna del índice.
+        """
+        key = institution_key(value)
+        if key in self.institutions:
+            return key
+        for alias in (normalize_text(value), institution_full_name(value)):
+            if alias in self.aliases:
+                return self.aliases[alias]
+        return None
+
+    # --- Persistencia ---
+
+    def save(self, db_path):
+        with open(os.path.join(db_path, FACETS_FILE), 'w', encoding='utf-8') as f:
+            json.dump({"instituciones": self.institutions, "gratuitos": self.free_count}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, db_path):
+        """Carga el índice de facetas de `db_path`; devuelve None si no existe."""
+        path = os.path.join(db_path, FACETS_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data.get("instituciones"), data.get("gratuitos", 0))
@@ -0,0 +1,168 @@
+# fragmentacion.py
+# Fragmentación por secciones de cada trámite (Requisitos, Procedimiento, Costo...) y
+# recuperación "parent document": se indexan fragmentos pequeños que caben en la ventana
+# de MiniLM (256 tokens) y, al buscar, cada fragmento encontrado se traduce de vuelta a
+# las secciones completas de su trámite padre, que son las que recibe el LLM.
+
+import json
+import os
+
+from langchain.docstore.document import Document
+
+from facetas import facet_metadata
+
+PARENT_STORE_FILE = "tramites_padre.json"
+
+# Secciones de un trámite en el orden en que se presentan al LLM: (campo JSON, título)
+SECTIONS = [
+    ("Descripcion", "Descripción General"),
+    ("A_Quien_Dirigido", "¿A quién está dirigido?"),
+    ("Que_Obtendre", "¿Qué obtendré si completo el trámite?"),
+    ("Requisitos", "Requisitos"),
+    ("Como_Hacer_Tramite", "¿Cómo hago el trámite? (Procedimiento)"),
+    ("Costo", "Costo"),
+    ("Canales_Atencion", "Canales de Atención"),
+    ("Ubicacion_Horarios", "Ubicación y Horarios de Atención"),
+    ("Base_Legal", "Base Legal"),
+]
+SECTION_TITLES = dict(SECTIONS)
+# Secciones que se envían cuando solo coincidió el nombre del trámite
+DEFAULT_SECTIONS = ("Descripcion", "Requisitos", "Costo")
+
+# Valores que indican que el campo no tiene información útil
+EMPTY_VALUES = {"", "No disponible", "N/A"}
+
+# ~800 caracteres en español quedan por debajo de los 256 tokens de all-MiniLM-L6-v2
+MAX_CHUNK_CHARS = 800
+
+
+def has_content(value):
+    return bool(value) and value.strip() not in EMPTY_VALUES
+
+
+def split_text(text, max_chars=MAX_CHUNK_CHARS):
+    """Divide un texto por líneas en piezas de como máximo `max_chars` caracteres."""
+    pieces, current = [], ""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        # Líneas más largas que el límite se cortan por el último espacio disponible
+        while len(line) > max_chars:
+            cut = line.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:cut].strip())
+            line = line[cut:].strip()
+        if current and len(current) + 1 + len(line) > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_tramite(cleaned_text, max_chars=MAX_CHUNK_CHARS):
+    """
+    Convierte un trámite (campos ya limpios de HTML) en fragmentos por sección.
+    Cada fragmento repite el nombre del trámite y la institución para que su embedding
+    tenga contexto, y guarda en su metadata la URL del padre y las facetas del trámite
+    (institución, gratuidad, fecha) para poder filtrar antes de la búsqueda vectorial.
+    """
+    url = cleaned_text.get("URL_Fuente", "No disponible")
+    nombre = cleaned_text.get("Nombre_Tramite", "No disponible")
+    institucion = cleaned_text.get("Institucion_Responsable", "No disponible")
+    header = f"**Trámite:** {nombre}\n**Institución Responsable:** {institucion}"
+    facets = facet_metadata(cleaned_text)
+
+    chunks = [Document(
+        page_content=header,
+        metadata={"source": url, "nombre_tramite": nombre, "section": "Nombre_Tramite",
+                  "chunk_id": f"{url}#Nombre_Tramite-0", **facets},
+    )]
+    for field, title in SECTIONS:
+        value = cleaned_text.get(field)
+        if not has_content(value):
+            continue
+        for n, piece in enumerate(split_text(value, max_chars)):
+            chunks.append(Document(
+                page_content=f"{header}\n**{title}:**\n{piece}",
+                metadata={"source": url, "nombre_tramite": nombre, "section": field,
+                          "chunk_id": f"{url}#{field}-{n}", **facets},
+            ))
+    return chunks
+
+
+class ParentStore:
+    """Secciones completas de cada trámite, indexadas por URL_Fuente."""
+
+    def __init__(self, parents=None):
+        self.parents = parents or {}
+
+    def add(self, cleaned_text):
+        url = cleaned_text.get("URL_Fuente", "No disponible")
+        self.parents[url] = {
+            "Nombre_Tramite": cleaned_text.get("Nombre_Tramite", "No disponible"),
+            "Institucion_Responsable": cleaned_text.get("Institucion_Responsable", "No disponible"),
+            "Fecha_Actualizacion": cleaned_text.get("Fecha_Actualizacion", "No disponible"),
+            "facets": facet_metadata(cleaned_text),
+            "sections": {field: cleaned_text[field] for field, _ in SECTIONS if has_content(cleaned_text.get(field))},
+        }
+
+    def __len__(self):
+        return len(self.parents)
+
+    def build_document(self, url, fields):
+        """Documento del trámite `url` con solo las secciones `fields` (en orden canónico)."""
+        parent = self.parents[url]
+        parts = [
+            f"**Trámite:** {parent['Nombre_Tramite']}",
+            f"**Institución Responsable:** {parent['Institucion_Responsable']}",
+        ]
+        if not fields & set(SECTION_TITLES):
+            fields = set(DEFAULT_SECTIONS)
+        selected = [field for field, _ in SECTIONS if field in fields and field in parent["sections"]]
+        for field in selected:
+            parts.append(f"\n**{SECTION_TITLES[field]}:**\n{parent['sections'][field]}")
+        parts.append(f"\n**URL de la Fuente Oficial:** {url}")
+        parts.append(f"**Fecha de Última Actualización de la Información:** {parent['Fecha_Actualizacion']}")
+        return Document(
+            page_content="\n".join(parts),
+            metadata={"source": url, "nombre_tramite": parent["Nombre_Tramite"], "sections": selected,
+                      **parent.get("facets", {})},
+        )
+
+    def assemble(self, chunks, k):
+        """
+        Agrupa los fragmentos encontrados (ya ordenados por relevancia) por trámite padre
+        y devuelve hasta `k` documentos con las secciones que coincidieron.
+        """
+        matched = {}
+        for chunk in chunks:
+            url = chunk.metadata.get("source")
+            if url not in self.parents:
+                continue
+            if url not in matched:
+                if len(matched) == k:
+                    continue
+                matched[url] = set()
+            matched[url].add(chunk.metadata.get("section"))
+        return [self.build_document(url, fields) for url, fields in matched.items()]
+
+    # --- Persistencia ---
+
+    def save(self, db_path):
+        with open(os.path.join(db_path, PARENT_STORE_FILE), 'w', encoding='utf-8') as f:
+            json.dump(self.parents, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, db_path):
+        """Carga los trámites padre guardados en `db_path`; devuelve None si no existen."""
+        path = os.path.join(db_path, PARENT_STORE_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
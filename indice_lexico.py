@@ -0,0 +1,126 @@
+# indice_lexico.py
+# Índice invertido BM25 sobre los trámites, construido por los scripts de ingesta y
+# guardado junto a `tramites_chroma_db`. Complementa la búsqueda semántica con
+# coincidencias exactas de términos (siglas como RUC o IESS, nombres de formularios...).
+# El texto se normaliza sin tildes y con un stemming ligero para español.
+
+import json
+import math
+import os
+from collections import Counter, defaultdict
+
+from langchain.docstore.document import Document
+
+from normalizacion import normalize_text
+
+LEXICAL_INDEX_FILE = "bm25_index.json"
+
+SPANISH_STOPWORDS = {
+    "a", "al", "ante", "con", "contra", "de", "del", "desde", "durante", "e", "el", "en", "entre",
+    "es", "esta", "este", "esto", "hacia", "hasta", "la", "las", "le", "les", "lo", "los", "mas",
+    "me", "mi", "mis", "muy", "ni", "no", "o", "os", "para", "pero", "por", "que", "se", "segun",
+    "si", "sin", "sobre", "su", "sus", "te", "tu", "tus", "u", "un", "una", "unas", "uno", "unos",
+    "y", "ya", "yo", "como", "cual", "cuales", "donde", "cuando", "cuanto", "quiero", "puedo",
+    "necesito", "hacer", "hago", "ser", "son", "fue", "hay", "otro", "otra", "tramite", "tramites",
+    "disponible",
+}
+
+# Sufijos derivativos y de plural, del más largo al más corto (ya sin tildes)
+SPANISH_SUFFIXES = (
+    "amientos", "imientos", "aciones", "uciones", "amiento", "imiento", "idades", "mente",
+    "acion", "ucion", "idad", "ables", "ibles", "istas", "able", "ible", "ista",
+    "ces", "es", "s",
+)
+
+
+def spanish_stem(token):
+    """Stemming ligero: recorta un sufijo frecuente y la vocal de género final."""
+    if len(token) <= 4 or token.isdigit():
+        return token
+    for suffix in SPANISH_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            token = token[:-len(suffix)] + ("z" if suffix == "ces" else "")
+            break
+    if len(token) > 4 and token[-1] in "aoe":
+        token = token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Texto -> lista de términos del índice (sin tildes, sin stopwords, con stemming)."""
+    return [spanish_stem(token) for token in normalize_text(text).split()
+            if token not in SPANISH_STOPWORDS and len(token) > 1]
+
+
+class BM25Index:
+    """Índice BM25 en memoria. Los documentos se guardan completos para devolverlos sin Chroma."""
+
+    def __init__(self, documents, postings, doc_lengths, k1=1.5, b=0.75):
+        self.documents = documents          # lista de Document
+        self.postings = postings            # término -> [[doc_idx, tf], ...]
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.avg_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+        n_docs = len(documents)
+        self.idf = {
+            term: math.log(1 + (n_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+            for term, entries in postings.items()
+        }
+
+    @staticmethod
+    def document_terms(doc):
+        # El nombre del trámite pesa más que el resto del contenido
+        title = doc.metadata.get("nombre_tramite", "")
+        return tokenize(f"{title} {title} {doc.page_content}")
+
+    @classmethod
+    def from_documents(cls, documents):
+        postings = defaultdict(list)
+        doc_lengths = []
+        for idx, doc in enumerate(documents):
+            terms = cls.document_terms(doc)
+            doc_lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                postings[term].append([idx, tf])
+        return cls(list(documents), dict(postings), doc_lengths)
+
+    def search(self, query, k=20, accept=None):
+        """
+        Devuelve [(Document, puntaje)] ordenados por relevancia BM25. Con `accept` (función
+        Document -> bool, p. ej. un filtro de facetas) solo entran los documentos aceptados.
+        """
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for idx, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[idx] / self.avg_length)
+                scores[idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+        if accept:
+            scores = {idx: score for idx, score in scores.items() if accept(self.documents[idx])}
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.documents[idx], score) for idx, score in ranked]
+
+    # --- Persistencia ---
+
+    def save(self, db_path):
+        data = {
+            "documents": [{"page_content": d.page_content, "metadata": d.metadata} for d in self.documents],
+            "postings": self.postings,
+            "doc_lengths": self.doc_lengths,
+        }
+        with open(os.path.join(db_path, LEXICAL_INDEX_FILE), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, db_path):
+        """Carga el índice guardado en `db_path`; devuelve None si no existe."""
+        path = os.path.join(db_path, LEXICAL_INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        documents = [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in data["documents"]]
+        return cls(documents, data["postings"], data["doc_lengths"])
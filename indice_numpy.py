@@ -0,0 +1,214 @@
+# indice_numpy.py
+# Backend vectorial alternativo a Chroma: búsqueda exacta por similitud coseno sobre una
+# matriz float32 normalizada (`vectors.npy`) más un archivo de metadatos.
+# Con unos pocos miles de fragmentos, un producto matriz-vector es más rápido y predecible
+# que HNSW + SQLite. La matriz se abre con mmap: todos los workers de uvicorn comparten
+# las mismas páginas del caché del sistema operativo en lugar de copiarla cada uno.
+
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+from langchain.docstore.document import Document
+
+VECTORS_FILE = "vectors.npy"
+VECTORS_META_FILE = "vectors_meta.json"
+# Fragmentos por página al copiar los embeddings desde Chroma
+EXPORT_PAGE_SIZE = 1000
+# Lecturas de la matriz y sus metadatos hasta encontrarlos de la misma exportación
+LOAD_ATTEMPTS = 5
+LOAD_RETRY_SECONDS = 0.5
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def write_vectors(db_path, rows, pages, model_name):
+    """
+    Escribe `rows` vectores que llegan por páginas (vectores, textos, metadatos): cada página
+    se normaliza y se copia a una matriz preasignada en disco (`open_memmap`) y sus
+    documentos se agregan al JSON de metadatos, así que la memoria no crece con el corpus.
+    Todo se escribe en archivos temporales que luego se renombran: los workers que ya tienen
+    la matriz abierta con mmap conservan el inodo anterior (reescribirlo en el sitio los
+    mataría con SIGBUS si la matriz nueva es más chica). Los dos renombres no son atómicos
+    en conjunto, así que los metadatos guardan el número de filas y el SHA-256 de la matriz
+    para que `NumpyVectorStore.load` descarte una pareja mezclada. Devuelve la forma.
+    """
+    vectors_path = os.path.join(db_path, VECTORS_FILE)
+    meta_path = os.path.join(db_path, VECTORS_META_FILE)
+    matrix, written, digest = None, 0, hashlib.sha256()
+    with open(meta_path + ".tmp", 'w', encoding='utf-8') as meta:
+        meta.write(f'{{"model": {json.dumps(model_name)}, "documents": [')
+        for vectors, texts, metadatas in pages:
+            block = np.asarray(vectors, dtype=np.float32)
+            if not len(block):
+                continue
+            if written + len(block) > rows:
+                raise ValueError(f"Se esperaban {rows} vectores y llegaron más")
+            if matrix is None:
+                matrix = np.lib.format.open_memmap(vectors_path + ".tmp", mode="w+", dtype=np.float32,
+                                                   shape=(rows, block.shape[1]))
+            block = normalize_rows(block)
+            matrix[written:written + len(block)] = block
+            digest.update(block.tobytes())
+            for text, metadata in zip(texts, metadatas):
+                meta.write(("," if written else "") +
+                           json.dumps({"page_content": text, "metadata": metadata or {}}, ensure_ascii=False))
+                written += 1
+        meta.write(f'], "rows": {written}, "sha256": "{digest.hexdigest()}"}}')
+    if written != rows:
+        raise ValueError(f"Se esperaban {rows} vectores y llegaron {written}")
+    if matrix is None:
+        # Base vacía: np.memmap no admite archivos de tamaño cero
+        matrix = np.zeros((0, 0), dtype=np.float32)
+        with open(vectors_path + ".tmp", 'wb') as f:
+            np.save(f, matrix)
+    else:
+        matrix.flush()
+    shape = matrix.shape
+    del matrix
+    os.replace(vectors_path + ".tmp", vectors_path)
+    os.replace(meta_path + ".tmp", meta_path)
+    return shape
+
+
+def save_vectors(db_path, vectors, texts, metadatas, model_name):
+    """Guarda una matriz ya en memoria y los metadatos que la acompañan (ver `write_vectors`)."""
+    return write_vectors(db_path, len(texts), [(vectors, texts, metadatas)], model_name)
+
+
+def export_from_chroma(vector_store, db_path, model_name, page_size=EXPORT_PAGE_SIZE):
+    """
+    Copia los embeddings ya calculados por Chroma al formato .npy (sin recalcular nada),
+    leyendo la colección por páginas de `page_size` fragmentos.
+    """
+    rows = vector_store._collection.count()
+
+    def pages():
+        for offset in range(0, rows, page_size):
+            data = vector_store.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+            yield data["embeddings"], data["documents"], data["metadatas"]
+
+    return write_vectors(db_path, rows, pages(), model_name)
+
+
+class NumpyVectorStore:
+    """
+    Búsqueda exacta por coseno con la misma interfaz que usa HybridSearcher de Chroma
+    (`similarity_search`, `similarity_search_by_vector`, `embeddings`, `get`).
+    El parámetro `filter` acepta el subconjunto de `where` de Chroma que genera
+    facetas.to_where; las filas que no lo cumplen ni siquiera se multiplican.
+    """
+
+    def __init__(self, matrix, documents, embeddings, model_name=None):
+        self.matrix = matrix
+        self.documents = documents
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self._columns = {}   # campo de metadata -> array con su valor por fila
+
+    @classmethod
+    def load(cls, db_path, embeddings, mmap=True):
+        """
+        Abre la matriz exportada por la ingesta; devuelve None si no existe. Si la matriz y
+        los metadatos no son de la misma exportación (se leyeron entre los dos renombres de
+        `write_vectors`) se vuelve a intentar, y si siguen sin coincidir lanza ValueError.
+        """
+        vectors_path = os.path.join(db_path, VECTORS_FILE)
+        if not os.path.exists(vectors_path):
+            return None
+        for attempt in range(LOAD_ATTEMPTS):
+            matrix = np.load(vectors_path, mmap_mode="r" if mmap else None)
+            with open(os.path.join(db_path, VECTORS_META_FILE), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if cls._matches(matrix, meta):
+                break
+            time.sleep(LOAD_RETRY_SECONDS)
+        else:
+            raise ValueError(f"{VECTORS_FILE} y {VECTORS_META_FILE} no corresponden a la misma exportación; "
+                             f"vuelve a ejecutar la ingesta.")
+        documents = [Document(page_content=d["page_content"], metadata=d["metadata"]) for d in meta["documents"]]
+        return cls(matrix, documents, embeddings, model_name=meta.get("model"))
+
+    @staticmethod
+    def _matches(matrix, meta):
+        """¿Son la matriz y los metadatos de la misma exportación? (filas y SHA-256)."""
+        if matrix.shape[0] != len(meta["documents"]) or meta.get("rows", matrix.shape[0]) != matrix.shape[0]:
+            return False
+        # Las exportaciones anteriores no guardaban el hash: basta con el número de filas
+        return "sha256" not in meta or hashlib.sha256(np.ascontiguousarray(matrix)).hexdigest() == meta["sha256"]
+
+    def __len__(self):
+        return len(self.documents)
+
+    # --- Filtros de facetas ---
+
+    def column(self, field):
+        """Valores de un campo de metadata por fila; se calculan una vez y se reutilizan."""
+        if field not in self._columns:
+            values = [doc.metadata.get(field) for doc in self.documents]
+            if all(isinstance(v, (int, float)) for v in values):
+                self._columns[field] = np.asarray(values)
+            else:
+                self._columns[field] = np.asarray(values, dtype=object)
+        return self._columns[field]
+
+    def where_mask(self, where):
+        """Máscara booleana de las filas que cumplen `where` ($and, $eq y $gte)."""
+        if "$and" in where:
+            return np.logical_and.reduce([self.where_mask(condition) for condition in where["$and"]])
+        mask = np.ones(len(self.documents), dtype=bool)
+        for field, condition in where.items():
+            values = self.column(field)
+            if "$eq" in condition:
+                mask &= values == condition["$eq"]
+            if "$gte" in condition:
+                if values.dtype == object:
+                    return np.zeros(len(self.documents), dtype=bool)
+                mask &= values >= condition["$gte"]
+        return mask
+
+    # --- Búsqueda ---
+
+    def top_k(self, vector, k, where=None):
+        """Índices y puntajes de los `k` vectores más similares (coseno) a `vector`."""
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        if where:
+            rows = np.flatnonzero(self.where_mask(where))
+            scores = self.matrix[rows] @ query
+        else:
+            rows = None
+            scores = self.matrix @ query
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+        # argpartition es O(n); solo los k ganadores se ordenan
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        order = candidates[np.argsort(-scores[candidates])]
+        return (order if rows is None else rows[order]), scores[order]
+
+    def similarity_search_by_vector_with_score(self, vector, k=4, filter=None):
+        indices, scores = self.top_k(vector, k, where=filter)
+        return [(self.documents[i], float(score)) for i, score in zip(indices, scores)]
+
+    def similarity_search_by_vector(self, vector, k=4, filter=None):
+        indices, _ = self.top_k(vector, k, where=filter)
+        return [self.documents[i] for i in indices]
+
+    def similarity_search(self, query, k=4, filter=None):
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k=k, filter=filter)
+
+    def get(self, include=None):
+        """Subconjunto de `Chroma.get` usado por el servidor (metadatos y textos)."""
+        return {
+            "metadatas": [doc.metadata for doc in self.documents],
+            "documents": [doc.page_content for doc in self.documents],
+        }
@@ -2,150 +2,95 @@
 # Lee el JSON, limpia CADA campo que pueda tener HTML y lo carga en ChromaDB
 # con un formato mucho más rico y estructurado.
 
-import json
-from bs4 import BeautifulSoup
-from langchain.docstore.document import Document
-from langchain_community.embeddings import SentenceTransformerEmbeddings
-from langchain_community.vectorstores import Chroma
+import itertools
 import os
-import shutil
+from langchain_community.embeddings import SentenceTransformerEmbeddings
+import argparse
+from fragmentacion import split_tramite, ParentStore
+from lectura_tramites import iter_unique_tramites
+from limpieza_html import clean_html, map_bounded
+from ingesta_incremental import ingest
+from cache_embeddings_disco import open_disk_cache
 
 # --- 1. Configuración ---
 JSON_FILE_PATH = "tramites_extraidos_COMPLETO.json"
 CHROMA_DB_PATH = "tramites_chroma_db"
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+# Caché de embeddings en disco compartida con el servidor (0 MB la desactiva)
+EMBEDDING_DISK_CACHE_PATH = os.getenv("EMBEDDING_DISK_CACHE_PATH", "embeddings_cache.sqlite3")
+EMBEDDING_DISK_CACHE_MB = int(os.getenv("EMBEDDING_DISK_CACHE_MB", "512"))
 
-def clean_html(html_content):
+def clean_tramite(tramite):
     """
-    Usa BeautifulSoup para limpiar etiquetas HTML de un texto.
-    Si el contenido no es HTML o está vacío, lo devuelve formateado.
+    Limpia individualmente cada campo que puede tener HTML o necesita formateo.
+    Es de nivel de módulo para poder ejecutarse en el pool de procesos de la limpieza.
     """
-    if html_content and isinstance(html_content, str) and '<' in html_content:
-        soup = BeautifulSoup(html_content, "html.parser")
-        # Utiliza separador para mantener saltos de línea lógicos y strip=True para limpiar espacios
-        return soup.get_text(separator="\n", strip=True)
-    # Si no es HTML, asegúrate de que sea una cadena de texto limpia
-    return str(html_content).strip() if html_content else "No disponible"
-
-def load_and_prepare_documents():
-    """Carga los trámites desde el JSON y los prepara como documentos de LangChain."""
-    try:
-        with open(JSON_FILE_PATH, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            if not data:
-                print(f"Advertencia: El archivo '{JSON_FILE_PATH}' está vacío.")
-                return []
-    except FileNotFoundError:
+    return {
+        "Nombre_Tramite": tramite.get("Nombre_Tramite", "No disponible"),
+        "Institucion_Responsable": tramite.get("Institucion_Responsable", "No disponible"),
+        "URL_Fuente": tramite.get("URL_Fuente", "No disponible"),
+        "Descripcion": clean_html(tramite.get("Descripcion")),
+        "A_Quien_Dirigido": clean_html(tramite.get("A_Quien_Dirigido")),
+        "Que_Obtendre": clean_html(tramite.get("Que_Obtendre")),
+        "Requisitos": clean_html(tramite.get("Requisitos")),
+        "Como_Hacer_Tramite": clean_html(tramite.get("Como_Hacer_Tramite")),
+        "Costo": clean_html(tramite.get("Costo")),
+        "Ubicacion_Horarios": clean_html(tramite.get("Ubicacion_Horarios")),
+        "Base_Legal": clean_html(tramite.get("Base_Legal")),
+        "Fecha_Actualizacion": tramite.get("Fecha_Actualizacion", "No disponible"),
+        "Canales_Atencion": clean_html(tramite.get("Canales_Atencion"))
+    }
+
+def load_and_prepare_documents(parent_store, clean_workers=1):
+    """
+    Lee los trámites del JSON en streaming (arreglo o JSONL) y genera sus fragmentos
+    (Document) por sección, trámite a trámite. Las secciones completas de cada trámite
+    se guardan en `parent_store`. Con `clean_workers` > 1 la limpieza de HTML se reparte
+    entre procesos.
+    """
+    if not os.path.exists(JSON_FILE_PATH):
         print(f"Error: No se encontró el archivo '{JSON_FILE_PATH}'. Asegúrate de haber ejecutado el scraper primero.")
-        return []
-    except json.JSONDecodeError:
-        print(f"Error: El archivo '{JSON_FILE_PATH}' no es un JSON válido.")
-        return []
-
-    documents = []
-    print(f"Procesando {len(data)} trámites desde el archivo JSON...")
-
-    for tramite in data:
-        # --- MODIFICADO: Limpieza individual y exhaustiva de cada campo ---
-        # Se limpian todos los campos que potencialmente contienen HTML o necesitan formateo.
-        
-        # Diccionario para almacenar los textos limpios y evitar repeticiones de .get()
-        cleaned_text = {
-            "Nombre_Tramite": tramite.get("Nombre_Tramite", "No disponible"),
-            "Institucion_Responsable": tramite.get("Institucion_Responsable", "No disponible"),
-            "URL_Fuente": tramite.get("URL_Fuente", "No disponible"),
-            "Descripcion": clean_html(tramite.get("Descripcion")),
-            "A_Quien_Dirigido": clean_html(tramite.get("A_Quien_Dirigido")),
-            "Que_Obtendre": clean_html(tramite.get("Que_Obtendre")),
-            "Requisitos": clean_html(tramite.get("Requisitos")),
-            "Como_Hacer_Tramite": clean_html(tramite.get("Como_Hacer_Tramite")),
-            "Costo": clean_html(tramite.get("Costo")),
-            "Ubicacion_Horarios": clean_html(tramite.get("Ubicacion_Horarios")),
-            "Base_Legal": clean_html(tramite.get("Base_Legal")),
-            "Fecha_Actualizacion": tramite.get("Fecha_Actualizacion", "No disponible"),
-            "Canales_Atencion": clean_html(tramite.get("Canales_Atencion"))
-        }
-
-        # --- MODIFICADO: Formato de `page_content` mucho más completo y legible ---
-        # Se estructura la información con títulos claros para que el LLM pueda entender
-        # el contexto de cada pieza de información.
-        page_content = f"""
-**Trámite:** {cleaned_text['Nombre_Tramite']}
-**Institución Responsable:** {cleaned_text['Institucion_Responsable']}
-
-**Descripción General:**
-{cleaned_text['Descripcion']}
-
-**¿A quién está dirigido?**
-{cleaned_text['A_Quien_Dirigido']}
-
-**¿Qué obtendré si completo el trámite?**
-{cleaned_text['Que_Obtendre']}
-
-**Requisitos:**
-{cleaned_text['Requisitos']}
-
-**¿Cómo hago el trámite? (Procedimiento):**
-{cleaned_text['Como_Hacer_Tramite']}
-
-**Costo:**
-{cleaned_text['Costo']}
-
-**Canales de Atención:**
-{cleaned_text['Canales_Atencion']}
-
-**Ubicación y Horarios de Atención:**
-{cleaned_text['Ubicacion_Horarios']}
-
-**Base Legal:**
-{cleaned_text['Base_Legal']}
-
-**URL de la Fuente Oficial:**
-{cleaned_text['URL_Fuente']}
-
-**Fecha de Última Actualización de la Información:**
-{cleaned_text['Fecha_Actualizacion']}
-        """.strip()
+        return
 
-        # Creamos el objeto Document de LangChain
-        doc = Document(
-            page_content=page_content,
-            metadata={
-                "source": cleaned_text['URL_Fuente'],
-                "nombre_tramite": cleaned_text['Nombre_Tramite']
-            }
-        )
-        documents.append(doc)
-    
-    print(f"Se han preparado {len(documents)} documentos para ser ingresados a la base de datos.")
-    return documents
+    for cleaned_text in map_bounded(clean_tramite, iter_unique_tramites([JSON_FILE_PATH]), workers=clean_workers):
+        # --- Fragmentación por secciones: un Document por sección (o pieza de sección) ---
+        # Cada fragmento cabe en la ventana de MiniLM y conserva la URL del trámite padre.
+        parent_store.add(cleaned_text)
+        yield from split_tramite(cleaned_text)
 
 def main():
     """Función principal que orquesta la creación de la base de datos vectorial."""
+    parser = argparse.ArgumentParser(description="Ingesta el JSON de trámites en ChromaDB.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Solo calcula embeddings de los trámites nuevos o modificados (manifiesto de hashes).")
+    parser.add_argument("--batch-size", type=int, default=64, help="Fragmentos por lote del modelo de embeddings.")
+    parser.add_argument("--workers", type=int, default=1, help="Procesos (o hilos) que calculan embeddings en paralelo.")
+    parser.add_argument("--checkpoint-every", type=int, default=2000,
+                        help="Fragmentos entre puntos de control; una ejecución interrumpida retoma desde el último.")
+    parser.add_argument("--clean-workers", type=int, default=1,
+                        help="Procesos que limpian el HTML de los trámites en paralelo.")
+    args = parser.parse_args()
     print("Iniciando la ingesta de datos en ChromaDB...")
 
-    if os.path.exists(CHROMA_DB_PATH):
-        print(f"Eliminando la base de datos antigua en '{CHROMA_DB_PATH}' para asegurar una carga limpia.")
-        shutil.rmtree(CHROMA_DB_PATH)
-    
     # 1. Cargar y preparar los documentos
-    documents = load_and_prepare_documents()
-    if not documents:
+    # Es un generador: los trámites se leen, limpian y embeben por bloques, sin cargar el JSON entero
+    parent_store = ParentStore()
+    documents = load_and_prepare_documents(parent_store, clean_workers=args.clean_workers)
+    first = next(documents, None)
+    if first is None:
         print("No hay documentos para procesar. Finalizando.")
         return
+    documents = itertools.chain([first], documents)
 
-    # 2. Crear los embeddings y almacenar en ChromaDB
-    print(f"Creando embeddings con el modelo '{EMBEDDING_MODEL}'...")
+    # 2. Crear los embeddings (solo de lo que cambió, con --incremental) y almacenar en ChromaDB
     print("Este proceso puede tardar varios minutos, por favor espera...")
-    embeddings = SentenceTransformerEmbeddings(model_name=EMBEDDING_MODEL)
-    
-    vector_store = Chroma.from_documents(
-        documents=documents, 
-        embedding=embeddings,
-        persist_directory=CHROMA_DB_PATH
-    )
-    
+    ingest(documents, parent_store, CHROMA_DB_PATH, EMBEDDING_MODEL,
+           lambda: SentenceTransformerEmbeddings(model_name=EMBEDDING_MODEL), incremental=args.incremental,
+           batch_size=args.batch_size, workers=args.workers, checkpoint_every=args.checkpoint_every,
+           cache=open_disk_cache(EMBEDDING_DISK_CACHE_PATH, EMBEDDING_MODEL, EMBEDDING_DISK_CACHE_MB))
+
+    print(f"Se procesaron {len(parent_store)} trámites.")
     print(f"¡Proceso completado! Se ha guardado la base de datos vectorial en '{CHROMA_DB_PATH}'.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
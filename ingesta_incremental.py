@@ -0,0 +1,199 @@
+# ingesta_incremental.py
+# Reingesta incremental de la base vectorial. Un manifiesto guarda, por URL_Fuente, el hash
+# de los fragmentos del trámite y los ids con que se guardaron en Chroma, junto con el
+# modelo de embeddings. En cada ejecución solo se calculan embeddings de los trámites nuevos
+# o modificados, se borran los que desaparecieron de los JSON y el resto no se toca.
+# Los embeddings los calcula la etapa por lotes y con puntos de control (etapa_embeddings.py).
+# Los fragmentos llegan como un iterable y se procesan en bloques acotados; los índices
+# derivados (NumPy, BM25, facetas, trámites padre) se reconstruyen desde Chroma y el
+# ParentStore, sin volver a pasar por el modelo. La matriz NumPy se copia por páginas.
+
+import hashlib
+import itertools
+import json
+import os
+import shutil
+
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+
+from etapa_embeddings import EmbeddingStage, PrecomputedEmbeddings, checkpoint_dir_for
+from facetas import FacetIndex
+from indice_lexico import BM25Index
+from indice_numpy import export_from_chroma
+from version_indice import read_index_version, write_index_version
+
+MANIFEST_FILE = "manifiesto_ingesta.json"
+# Fragmentos por llamada a Chroma (su límite por lote ronda los 5000)
+ADD_BATCH_SIZE = 1000
+
+
+def peak_memory_mb():
+    """Memoria residente máxima del proceso completo desde que arrancó (MB), o None si no se sabe."""
+    try:
+        import resource
+    except ImportError:
+        # Windows no tiene `resource`
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def content_hash(chunks):
+    """Hash de los fragmentos de un trámite: cambia si cambia el texto, la metadata o el corte."""
+    payload = json.dumps([[chunk.page_content, chunk.metadata] for chunk in chunks],
+                         sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def iter_tramite_chunks(documents):
+    """
+    Agrupa fragmentos consecutivos del mismo trámite (split_tramite los genera juntos) y
+    entrega (URL_Fuente, fragmentos). Una URL repetida en los JSON cuenta una vez.
+    """
+    seen = set()
+    for url, chunks in itertools.groupby(documents, key=lambda doc: doc.metadata["source"]):
+        if url in seen:
+            continue
+        seen.add(url)
+        yield url, list(chunks)
+
+
+def load_manifest(db_path):
+    path = os.path.join(db_path, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(db_path, model_name, entries):
+    with open(os.path.join(db_path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump({"model": model_name, "tramites": entries}, f, ensure_ascii=False)
+
+
+def sync_vector_store(documents, db_path, model_name, embedding_stage, incremental=True):
+    """
+    Lleva la colección de Chroma en `db_path` al estado de `documents` (un iterable, p. ej.
+    un generador). Devuelve (vector_store, resumen, entradas del manifiesto); el resumen
+    cuenta los trámites añadidos, actualizados, eliminados y sin cambios.
+    Los fragmentos nuevos se embeben y se escriben en bloques de `checkpoint_every` a medida
+    que llegan, así que en memoria solo hay un bloque a la vez.
+    Sin manifiesto compatible (primera ejecución, otro modelo o `incremental=False`) se
+    reconstruye la base desde cero.
+    """
+    manifest = load_manifest(db_path) if incremental else None
+    if manifest and manifest.get("model") != model_name:
+        print(f"El manifiesto usa el modelo '{manifest.get('model')}' y ahora se usa '{model_name}': reconstrucción completa.")
+        manifest = None
+    if manifest is None and os.path.exists(db_path):
+        # Sin manifiesto no se sabe qué ids tiene cada trámite: se parte de una base limpia
+        print(f"Eliminando la base de datos antigua en '{db_path}' para asegurar una carga limpia.")
+        shutil.rmtree(db_path)
+    os.makedirs(db_path, exist_ok=True)
+    previous = manifest["tramites"] if manifest else {}
+
+    embeddings = PrecomputedEmbeddings({})
+    vector_store = Chroma(persist_directory=db_path, embedding_function=embeddings)
+    summary = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "chunks_embedded": 0, "chunks_deleted": 0}
+    entries, to_add, to_delete = {}, [], []
+
+    def flush():
+        # Primero se borran los ids viejos: un trámite actualizado puede reutilizar algunos
+        if to_delete:
+            vector_store.delete(ids=to_delete)
+            summary["chunks_deleted"] += len(to_delete)
+            to_delete.clear()
+        if to_add:
+            vectors = embedding_stage.embed(to_add)
+            embeddings.vectors_by_text = {chunk.page_content: vector for chunk, vector in zip(to_add, vectors)}
+            for start in range(0, len(to_add), ADD_BATCH_SIZE):
+                batch = to_add[start:start + ADD_BATCH_SIZE]
+                # add_documents hace upsert: repetir un lote tras una interrupción no duplica nada
+                vector_store.add_documents(batch, ids=[chunk.metadata["chunk_id"] for chunk in batch])
+            summary["chunks_embedded"] += len(to_add)
+            embeddings.vectors_by_text = {}
+            to_add.clear()
+
+    print(f"Sincronizando la base con el modelo '{model_name}'...")
+    try:
+        for url, chunks in iter_tramite_chunks(documents):
+            digest = content_hash(chunks)
+            entries[url] = {"hash": digest, "chunks": [chunk.metadata["chunk_id"] for chunk in chunks]}
+            old = previous.get(url)
+            if old is None:
+                summary["added"] += 1
+                to_add.extend(chunks)
+            elif old["hash"] != digest:
+                summary["updated"] += 1
+                to_delete.extend(old["chunks"])
+                to_add.extend(chunks)
+            else:
+                summary["unchanged"] += 1
+            if len(to_add) >= embedding_stage.checkpoint_every:
+                flush()
+        for url in previous.keys() - entries.keys():
+            summary["removed"] += 1
+            to_delete.extend(previous[url]["chunks"])
+        flush()
+    finally:
+        summary["embedding"] = embedding_stage.close()
+    return vector_store, summary, entries
+
+
+def write_derived_indexes(vector_store, parent_store, db_path, model_name):
+    """
+    Índices que el servidor carga junto a Chroma; se reconstruyen sin calcular embeddings.
+    Los fragmentos se leen de Chroma, que ya tiene todos (también los de trámites sin cambios).
+    """
+    # Copia de los embeddings en una matriz .npy para el backend de búsqueda exacta (mmap)
+    shape = export_from_chroma(vector_store, db_path, model_name)
+    print(f"Matriz de embeddings exportada: {shape[0]} vectores de dimensión {shape[1]}.")
+
+    # Secciones completas de cada trámite para la recuperación "parent document"
+    parent_store.save(db_path)
+
+    # Índice de facetas (instituciones y trámites gratuitos) para filtrar las búsquedas
+    facet_index = FacetIndex.from_parents(parent_store)
+    facet_index.save(db_path)
+    print(f"Índice de facetas: {len(facet_index.institutions)} instituciones, {facet_index.free_count} trámites gratuitos.")
+
+    # Índice léxico BM25 junto a la base vectorial, para la búsqueda híbrida del servidor
+    print("Construyendo el índice léxico BM25...")
+    data = vector_store.get(include=["documents", "metadatas"])
+    BM25Index.from_documents([Document(page_content=text, metadata=metadata)
+                              for text, metadata in zip(data["documents"], data["metadatas"])]).save(db_path)
+
+    # Marca de versión: el servidor la detecta e invalida su caché de respuestas
+    write_index_version(db_path)
+
+
+def ingest(documents, parent_store, db_path, model_name, embeddings_factory, incremental=True,
+           batch_size=64, workers=1, checkpoint_every=2000, cache=None):
+    """
+    Sincroniza Chroma con `documents` (iterable de fragmentos agrupados por trámite) y, si
+    algo cambió, los índices derivados. `parent_store` debe estar completo cuando se termina
+    de recorrer `documents` (puede llenarlo el mismo generador). Devuelve el resumen.
+    `batch_size`, `workers`, `checkpoint_every` y `cache` (DiskEmbeddingCache) configuran
+    la etapa de embeddings.
+    """
+    stage = EmbeddingStage(embeddings_factory, model_name, batch_size=batch_size, workers=workers,
+                           checkpoint_dir=checkpoint_dir_for(db_path), checkpoint_every=checkpoint_every,
+                           cache=cache)
+    vector_store, summary, entries = sync_vector_store(documents, db_path, model_name, stage, incremental)
+    print(f"Trámites: {summary['added']} añadidos, {summary['updated']} actualizados, "
+          f"{summary['removed']} eliminados, {summary['unchanged']} sin cambios "
+          f"({summary['chunks_embedded']} fragmentos con embedding nuevo, {summary['chunks_deleted']} borrados).")
+    if summary["added"] or summary["updated"] or summary["removed"] or read_index_version(db_path) is None:
+        write_derived_indexes(vector_store, parent_store, db_path, model_name)
+    else:
+        # Sin cambios se conserva la versión del índice: las cachés del servidor siguen válidas
+        print("La base ya estaba al día; no se reescriben los índices.")
+    # El manifiesto se escribe al final: si el proceso se corta, la próxima ejecución repite el trabajo
+    save_manifest(db_path, model_name, entries)
+    # Todo quedó en Chroma: los vectores parciales ya no hacen falta
+    stage.clear_checkpoint()
+    # Pico de todo el proceso (lectura, embeddings, índices derivados), no solo de una fase
+    summary["peak_memory_mb"] = peak_memory_mb()
+    if summary["peak_memory_mb"] is not None:
+        print(f"Memoria pico del proceso: {summary['peak_memory_mb']:.0f} MB.")
+    return summary
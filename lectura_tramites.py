@@ -0,0 +1,110 @@
+# lectura_tramites.py
+# Lectura en streaming de los archivos de trámites. Los scrapers escriben arreglos JSON
+# con sangría y también se aceptan archivos JSONL (un trámite por línea); en ambos casos
+# los trámites se entregan de a uno, leyendo el archivo por bloques, así que la memoria
+# no crece con el tamaño del archivo ni con el número de archivos.
+
+import json
+
+# Caracteres leídos por bloque; si un trámite no cabe, el bloque se duplica
+READ_BLOCK_SIZE = 1 << 16
+_decoder = json.JSONDecoder()
+
+
+def _skip(buffer, pos, chars=" \t\r\n"):
+    while pos < len(buffer) and buffer[pos] in chars:
+        pos += 1
+    return pos
+
+
+def iter_json_array(f):
+    """Elementos de un arreglo JSON de nivel superior, decodificados uno a uno."""
+    buffer, pos, eof = "", 0, False
+    block = READ_BLOCK_SIZE
+
+    def fill():
+        nonlocal buffer, pos, eof, block
+        data = f.read(block)
+        eof = not data
+        # Se descarta lo ya decodificado para no acumular el archivo entero
+        buffer = buffer[pos:] + data
+        pos = 0
+
+    fill()
+    pos = _skip(buffer, pos)
+    if buffer[pos:pos + 1] != "[":
+        raise json.JSONDecodeError("Se esperaba un arreglo JSON", buffer, pos)
+    pos += 1
+    expect_value = True
+    while True:
+        pos = _skip(buffer, pos)
+        if pos >= len(buffer):
+            if eof:
+                raise json.JSONDecodeError("Arreglo JSON sin cerrar", buffer, pos)
+            fill()
+            continue
+        if buffer[pos] == "]":
+            return
+        if buffer[pos] == "," and not expect_value:
+            pos += 1
+            expect_value = True
+            continue
+        try:
+            value, end = _decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # Probablemente el trámite sigue en el próximo bloque
+            if eof:
+                raise
+            fill()
+            block *= 2
+            continue
+        if end == len(buffer) and not eof:
+            # Un número que llega justo al final del bloque puede seguir en el próximo
+            # ("123" de "12345"): solo se acepta un valor que termina antes del borde
+            fill()
+            continue
+        block = READ_BLOCK_SIZE
+        pos = end
+        expect_value = False
+        yield value
+
+
+def iter_json_lines(f):
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_tramites(path):
+    """Trámites de `path`: arreglo JSON si empieza con '[', si no JSONL."""
+    with open(path, 'r', encoding='utf-8') as f:
+        first = f.read(READ_BLOCK_SIZE)
+        f.seek(0)
+        if first.lstrip().startswith("["):
+            yield from iter_json_array(f)
+        else:
+            yield from iter_json_lines(f)
+
+
+def iter_unique_tramites(paths):
+    """
+    Trámites de varios archivos en orden, sin URL_Fuente repetidas (gana la primera).
+    Un archivo que no existe o con JSON inválido se informa y se salta (lo ya leído se conserva).
+    """
+    seen = set()
+    for path in paths:
+        print(f"-> Leyendo archivo: {path}")
+        try:
+            for tramite in iter_tramites(path):
+                if not isinstance(tramite, dict):
+                    print(f"  -> Advertencia: Elemento no válido (no es un diccionario) en {path}. Saltando.")
+                    continue
+                url = tramite.get("URL_Fuente")
+                if url and url not in seen:
+                    seen.add(url)
+                    yield tramite
+        except FileNotFoundError:
+            print(f"  -> Error: No se encontró el archivo '{path}'. Saltando.")
+        except json.JSONDecodeError:
+            print(f"  -> Error: El archivo '{path}' no es un JSON válido. Saltando el resto.")
+
@@ -0,0 +1,185 @@
+# limpieza_html.py
+# Limpieza rápida del HTML de los trámites para la ingesta. En lugar de construir un árbol
+# de BeautifulSoup por cada campo, un extractor sobre html.parser (el mismo tokenizador que
+# usa BeautifulSoup con "html.parser") recoge los textos en una sola pasada y replica
+# `get_text(separator="\n", strip=True)`: recibe los mismos eventos del tokenizador y lleva
+# la misma pila de etiquetas abiertas para saber qué textos BeautifulSoup no cuenta. Las
+# construcciones raras cuya semántica no se replica (CDATA, <template>, entidades
+# desconocidas, referencias numéricas fuera de rango) se delegan a BeautifulSoup. La
+# equivalencia se comprobó con el corpus y con entradas aleatorias, no está demostrada:
+# bench_limpieza.py vuelve a compararlas. La limpieza de varios trámites puede repartirse
+# entre procesos con `map_bounded`, sin leer por adelantado más de unos pocos lotes.
+
+import collections
+from concurrent.futures import ProcessPoolExecutor
+from html.entities import html5
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup
+
+# Su texto no cuenta para get_text (BeautifulSoup lo guarda como Script, Stylesheet,
+# RubyTextString o RubyParenthesisString), aunque esté dentro de otras etiquetas
+SKIPPED_TAGS = {"script", "style", "rt", "rp"}
+# Etiquetas vacías: BeautifulSoup las cierra al abrirlas (nunca quedan en la pila) e
+# ignora el primer </tag> que les sigue, sin cortar el texto
+VOID_TAGS = {"area", "base", "basefont", "bgsound", "br", "col", "command", "embed", "frame", "hr", "image",
+             "img", "input", "isindex", "keygen", "link", "menuitem", "meta", "nextid", "param", "source",
+             "spacer", "track", "wbr"}
+# BeautifulSoup trata su contenido de forma especial: se le delega el campo completo
+FALLBACK_TAGS = {"template"}
+
+
+class _Fallback(Exception):
+    """El campo usa algo que solo BeautifulSoup resuelve igual que antes."""
+
+
+class TextExtractor(HTMLParser):
+    """
+    Textos de un fragmento HTML en orden de documento. Como en BeautifulSoup, cada texto
+    termina en cualquier etiqueta, comentario o declaración; los que quedan vacíos tras
+    `strip()` o dentro de una etiqueta de SKIPPED_TAGS abierta se descartan.
+    """
+
+    def __init__(self):
+        # Las referencias se resuelven a mano, con las mismas reglas que BeautifulSoup
+        super().__init__(convert_charrefs=False)
+        self.texts = []
+        self._pieces = []
+        self._open = []      # etiquetas abiertas, como la pila de BeautifulSoup
+        self._skipped = 0    # cuántas de ellas están en SKIPPED_TAGS
+        self._closed_voids = []
+
+    def extract(self, markup):
+        self.reset()
+        self.texts, self._pieces, self._open, self._skipped, self._closed_voids = [], [], [], 0, []
+        self.feed(markup)
+        self.close()
+        self._flush()
+        return self.texts
+
+    def _flush(self):
+        if self._pieces:
+            text = "".join(self._pieces).strip()
+            self._pieces = []
+            if text and not self._skipped:
+                self.texts.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in FALLBACK_TAGS:
+            raise _Fallback(tag)
+        self._flush()
+        if tag in VOID_TAGS:
+            self._closed_voids.append(tag)
+        else:
+            self._open.append(tag)
+            self._skipped += tag in SKIPPED_TAGS
+
+    def handle_startendtag(self, tag, attrs):
+        # <tag/> se abre y se cierra en el acto: no cambia la pila
+        if tag in FALLBACK_TAGS:
+            raise _Fallback(tag)
+        self._flush()
+
+    def handle_endtag(self, tag):
+        if tag in self._closed_voids:
+            self._closed_voids.remove(tag)
+            return
+        self._flush()
+        # Como BeautifulSoup: cierra todo lo abierto desde la última `tag`; si no hay
+        # ninguna abierta, el cierre se ignora
+        if tag in self._open:
+            while True:
+                name = self._open.pop()
+                self._skipped -= name in SKIPPED_TAGS
+                if name == tag:
+                    break
+
+    def handle_data(self, data):
+        self._pieces.append(data)
+
+    def handle_entityref(self, name):
+        character = html5.get(name + ";")
+        if character is None:
+            raise _Fallback(name)
+        self._pieces.append(character)
+
+    def handle_charref(self, name):
+        try:
+            codepoint = int(name[1:], 16) if name[:1] in ("x", "X") else int(name)
+        except ValueError:
+            raise _Fallback(name)
+        # 0x80-0x9F son caracteres de Windows-1252 para BeautifulSoup; los inválidos, U+FFFD
+        if codepoint < 0x20 and codepoint not in (0x09, 0x0A, 0x0D) or 0x7F <= codepoint <= 0x9F \
+                or 0xD800 <= codepoint <= 0xDFFF or codepoint > 0x10FFFF:
+            raise _Fallback(name)
+        self._pieces.append(chr(codepoint))
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_decl(self, decl):
+        self._flush()
+
+    def handle_pi(self, data):
+        self._flush()
+
+    def unknown_decl(self, data):
+        raise _Fallback(data)
+
+
+_extractor = None
+
+
+def html_to_text(markup):
+    """Igual que BeautifulSoup(markup, "html.parser").get_text(separator="\\n", strip=True)."""
+    global _extractor
+    if _extractor is None:
+        # Uno por proceso: se reutiliza entre campos y trámites
+        _extractor = TextExtractor()
+    try:
+        return "\n".join(_extractor.extract(markup))
+    except _Fallback:
+        return BeautifulSoup(markup, "html.parser").get_text(separator="\n", strip=True)
+
+
+def clean_html(html_content):
+    """
+    Quita las etiquetas HTML de un campo. Si el contenido no es HTML lo devuelve sin
+    espacios en los extremos, y si está vacío devuelve "No disponible".
+    """
+    if html_content and isinstance(html_content, str) and '<' in html_content:
+        return html_to_text(html_content)
+    return str(html_content).strip() if html_content else "No disponible"
+
+
+def clean_all_fields(tramite):
+    """El trámite con todos sus campos limpios."""
+    return {k: clean_html(v) for k, v in tramite.items()}
+
+
+def _apply(func, batch):
+    return [func(item) for item in batch]
+
+
+def map_bounded(func, items, workers=1, batch_size=32):
+    """
+    `func` aplicado a cada elemento de `items`, en orden. Con `workers` > 1 los elementos se
+    envían en lotes de `batch_size` a un pool de procesos con a lo sumo `2 * workers` lotes
+    en vuelo, así que un generador de entrada no se consume por adelantado. `func` debe
+    poder serializarse (una función de nivel de módulo).
+    """
+    if workers <= 1:
+        yield from map(func, items)
+        return
+    iterator = iter(items)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = collections.deque()
+        while True:
+            while len(in_flight) < 2 * workers:
+                batch = [item for _, item in zip(range(batch_size), iterator)]
+                if not batch:
+                    break
+                in_flight.append(executor.submit(_apply, func, batch))
+            if not in_flight:
+                return
+            yield from in_flight.popleft().result()
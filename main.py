@@ -4,17 +4,39 @@
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from pydantic import BaseModel, Field, constr
+from typing import List, Optional
+from datetime import date
 from langchain_groq import ChatGroq
-from langchain.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
 # --- CAMBIO: Importaciones modernas para Chroma y Embeddings ---
 from langchain_chroma import Chroma
 from langchain_huggingface import HuggingFaceEmbeddings
 # --- Fin del Cambio ---
 import os
+import json
+import time
+import asyncio
+from contextlib import contextmanager
 from dotenv import load_dotenv
+from rag_pipeline import RagPipeline
+from cache_respuestas import ResponseCache
+from version_indice import read_index_version
+from reescritura import QueryRewriter
+from busqueda import DEFAULT_RESULT_FIELDS, RESULT_FIELDS, HybridSearcher
+from indice_lexico import BM25Index
+from fragmentacion import ParentStore
+from contexto import ContextPacker
+from cache_embeddings import CachedEmbeddings
+from cache_embeddings_disco import DiskCachedEmbeddings, open_disk_cache
+from indice_numpy import NumpyVectorStore
+from facetas import FacetIndex, institution_key
+from respuesta_directa import TitleIndex
+from metricas import PipelineCollector, RequestTracingMiddleware
+from resiliencia import ResilientChatModel
+from admision import BATCH, INTERACTIVE, AdmissionController, AdmissionRejected, Ticket
+from servicio_busqueda import RemoteEmbeddings, RemoteSearcher, SearchClient
+from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, generate_latest
 
 # Cargar las variables de entorno
 load_dotenv()
@@ -23,10 +45,127 @@ load_dotenv()
 CHROMA_DB_PATH = "tramites_chroma_db"
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
 GROQ_MODEL = "llama3-8b-8192"
+# Concurrencia: consultas /chat en vuelo por worker y hilos para embedding + Chroma
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "16"))
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "4"))
+# Coalescencia: preguntas idénticas simultáneas en /chat comparten una sola ejecución
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() == "true"
+# Caché de respuestas: tamaño máximo, vida en segundos y umbral coseno del nivel semántico
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "21600"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+# Caché en memoria de embeddings de consultas (entradas; 0 la desactiva)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+# Caché de embeddings en disco (SQLite) compartida con la ingesta; 0 MB la desactiva
+EMBEDDING_DISK_CACHE_PATH = os.getenv("EMBEDDING_DISK_CACHE_PATH", "embeddings_cache.sqlite3")
+EMBEDDING_DISK_CACHE_MB = int(os.getenv("EMBEDDING_DISK_CACHE_MB", "512"))
+# Backend vectorial: "chroma" (HNSW + SQLite) o "numpy" (búsqueda exacta sobre vectors.npy con mmap)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+# Búsqueda: documentos que llegan al prompt y candidatos por lista antes de la fusión RRF
+SEARCH_K = int(os.getenv("SEARCH_K", "3"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+# Presupuesto de tokens para el {context} del prompt (llama3-8b-8192 tiene 8192 en total)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Lote /chat/batch: máximo de preguntas por petición y llamadas al LLM simultáneas
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "500"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+# Caché persistente de reescrituras y longitud máxima de una consulta "de palabras clave"
+REWRITE_CACHE_PATH = os.getenv("REWRITE_CACHE_PATH", "rewrite_cache.json")
+REWRITE_CACHE_SIZE = int(os.getenv("REWRITE_CACHE_SIZE", "5000"))
+REWRITE_MAX_KEYWORDS = int(os.getenv("REWRITE_MAX_KEYWORDS", "4"))
+# Arranque: "eager" carga todo antes de aceptar tráfico; "background" acepta tráfico de
+# inmediato y carga en segundo plano (/health/ready responde 503 hasta terminar)
+STARTUP_MODE = os.getenv("STARTUP_MODE", "eager")
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+# Modelo de embeddings exportado localmente (ONNX/OpenVINO, p. ej. cuantizado) para arrancar
+# sin descargar pesos ni cargar PyTorch completo
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", "")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "")
+
+# Resiliencia del LLM: plazo por intento (reescritura y respuesta), reintentos con jitter,
+# hedging tras N segundos (0 lo desactiva) y modelo o endpoint de respaldo (compatible con Groq/OpenAI)
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "")
+LLM_REWRITE_TIMEOUT = float(os.getenv("LLM_REWRITE_TIMEOUT", "8"))
+LLM_RESPONSE_TIMEOUT = float(os.getenv("LLM_RESPONSE_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "")
+LLM_FALLBACK_BASE_URL = os.getenv("LLM_FALLBACK_BASE_URL", "")
+LLM_FALLBACK_API_KEY = os.getenv("LLM_FALLBACK_API_KEY", "")
+
+# Control de admisión ante la cuota de Groq: peticiones y tokens por minuto de la cuenta
+# (0 = sin límite), tokens estimados por pregunta, profundidad de la cola y espera máxima
+# antes de responder 429 (consultas interactivas y lotes)
+ADMISSION_REQUESTS_PER_MINUTE = int(os.getenv("ADMISSION_REQUESTS_PER_MINUTE", "0"))
+ADMISSION_TOKENS_PER_MINUTE = int(os.getenv("ADMISSION_TOKENS_PER_MINUTE", "0"))
+ADMISSION_TOKENS_PER_QUERY = int(os.getenv("ADMISSION_TOKENS_PER_QUERY", str(CONTEXT_TOKEN_BUDGET + 1000)))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "100"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "10"))
+ADMISSION_BATCH_MAX_WAIT = float(os.getenv("ADMISSION_BATCH_MAX_WAIT", "120"))
+
+# Varios workers: ruta del socket del servicio compartido de embeddings y búsqueda
+# (servicio_busqueda.py). Vacío = cada worker carga su propio modelo e índices
+SEARCH_SIDECAR_SOCKET = os.getenv("SEARCH_SIDECAR_SOCKET", "")
+SEARCH_SIDECAR_AUTHKEY = os.getenv("SEARCH_SIDECAR_AUTHKEY", "")
+
+# /search: tamaño máximo de página y posición máxima alcanzable paginando
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", "50"))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "100"))
+
+# Respuesta directa: similitud mínima (trigramas) entre la pregunta y el nombre de un trámite
+# para responder con plantilla sin pasar por la cadena RAG (0 lo desactiva)
+DIRECT_ANSWER_THRESHOLD = float(os.getenv("DIRECT_ANSWER_THRESHOLD", "0.9"))
 
 # --- 2. Modelo de Datos ---
 class ChatQuery(BaseModel):
     query_text: str
+    # Filtros opcionales: sigla o nombre de la institución, solo trámites gratuitos y
+    # fecha mínima de actualización
+    institucion: Optional[str] = None
+    gratuito: Optional[bool] = None
+    actualizado_desde: Optional[date] = None
+
+class SearchQuery(BaseModel):
+    query_text: str
+    page: int = Field(1, ge=1)
+    page_size: int = Field(10, ge=1)
+    # Campos de cada trámite a devolver (ver busqueda.RESULT_FIELDS)
+    fields: Optional[List[str]] = None
+    institucion: Optional[str] = None
+    gratuito: Optional[bool] = None
+    actualizado_desde: Optional[date] = None
+
+def query_filters(query):
+    """Filtros explícitos de la consulta en el formato de facetas.to_where (None si no hay)."""
+    filters = {}
+    if query.institucion:
+        filters["institucion"] = resolve_institution(query.institucion)
+    if query.gratuito is not None:
+        filters["gratuito"] = query.gratuito
+    if query.actualizado_desde:
+        filters["actualizado_desde"] = int(query.actualizado_desde.strftime("%Y%m%d"))
+    return filters or None
+
+def resolve_institution(value):
+    """
+    Clave de facetas de la institución pedida (sigla, nombre o alias). Si no corresponde a
+    ninguna responde 400 con las disponibles, en lugar de filtrar contra una clave inexistente.
+    """
+    facet_index = rag_pipeline.query_rewriter.facet_index if rag_pipeline else None
+    if not facet_index:
+        # Sin índice de facetas no hay con qué validar: se usa la sigla tal cual
+        return institution_key(value)
+    key = facet_index.resolve_institution(value)
+    if key is None:
+        raise HTTPException(status_code=400, detail=f"Institución desconocida: '{value}'. Disponibles (nombres en "
+                            f"/facets): {', '.join(sorted(facet_index.institutions))}.")
+    return key
+
+class ChatBatchQuery(BaseModel):
+    # Una pregunta vacía o solo con espacios se rechaza (422) antes de tocar el LLM
+    queries: List[constr(strip_whitespace=True, min_length=1)]
 
 # --- 3. Inicialización de FastAPI ---
 app = FastAPI(
@@ -41,87 +180,259 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "Retry-After"],
 )
+# Identificador de petición (cabecera X-Request-ID) y tiempos por etapa para /metrics
+app.add_middleware(RequestTracingMiddleware)
 
 # --- 4. Lógica del Chatbot ---
+# Las plantillas de reescritura y respuesta viven en rag_pipeline.py junto a la cadena.
+
+rag_pipeline = None
+# Limita cuántas consultas recorren la cadena a la vez; el resto espera su turno
+# sin bloquear el event loop.
+chat_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+# Cuota de Groq: las consultas que usarán el LLM reservan cuota antes de entrar a la cadena
+admission = AdmissionController(
+    requests_per_minute=ADMISSION_REQUESTS_PER_MINUTE,
+    tokens_per_minute=ADMISSION_TOKENS_PER_MINUTE,
+    tokens_per_query=ADMISSION_TOKENS_PER_QUERY,
+    max_queue=ADMISSION_MAX_QUEUE,
+    max_wait=ADMISSION_MAX_WAIT,
+    batch_max_wait=ADMISSION_BATCH_MAX_WAIT,
+)
 
-# --- NUEVO: Plantilla para reescribir la pregunta del usuario ---
-REWRITE_PROMPT_TEMPLATE = """
-Tu tarea es tomar la siguiente pregunta de un usuario y reescribirla como una consulta de búsqueda optimizada y formal, como si fuera el título de un documento oficial del gobierno de Ecuador.
-Concéntrate en las palabras clave y el objetivo del trámite. No respondas la pregunta, solo reescríbela.
+# Contadores de las cachés del pipeline, leídos en cada raspado de /metrics
+REGISTRY.register(PipelineCollector(lambda: rag_pipeline))
 
-Pregunta Original: "{question}"
-Consulta Optimizada:
-"""
+# Estado del arranque que expone /health/ready
+startup_state = {"status": "starting", "mode": STARTUP_MODE, "phases": {}, "error": None}
+startup_task = None  # referencia a la carga en segundo plano para que no la recolecte el GC
 
-# --- PROMPT FINAL MEJORADO ---
-RESPONSE_PROMPT_TEMPLATE = """
-Eres un asistente virtual experto en trámites del gobierno de Ecuador. Tu misión es dar respuestas claras y directas basadas ÚNICAMENTE en la información de los siguientes documentos.
+@contextmanager
+def startup_phase(name):
+    """Mide el tiempo de una fase del arranque y lo registra en `startup_state`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        startup_state["phases"][name] = round(elapsed, 3)
+        print(f"[arranque] {name}: {elapsed:.2f}s")
+
+def embedding_model_key():
+    """
+    Identifica los vectores que produce el modelo configurado, para las cachés de embeddings:
+    el mismo modelo con otro backend o con un ONNX cuantizado da vectores distintos. Con
+    torch es solo el nombre, el mismo que usan los scripts de ingesta.
+    """
+    key = EMBEDDING_MODEL_PATH or EMBEDDING_MODEL
+    if EMBEDDING_BACKEND != "torch":
+        key += f"@{EMBEDDING_BACKEND}" + (f":{EMBEDDING_ONNX_FILE}" if EMBEDDING_ONNX_FILE else "")
+    return key
 
-**Contexto (Documentos Encontrados):**
-{context}
+def load_embeddings():
+    """Modelo de embeddings: el de HuggingFace o un artefacto local ONNX/OpenVINO ya exportado."""
+    model_kwargs = {}
+    if EMBEDDING_BACKEND != "torch":
+        model_kwargs["backend"] = EMBEDDING_BACKEND
+        if EMBEDDING_ONNX_FILE:
+            model_kwargs["model_kwargs"] = {"file_name": EMBEDDING_ONNX_FILE}
+    model_name = EMBEDDING_MODEL_PATH or EMBEDDING_MODEL
+    print(f"Cargando modelo de embeddings '{model_name}' (backend: {EMBEDDING_BACKEND})...")
+    return HuggingFaceEmbeddings(model_name=model_name, model_kwargs=model_kwargs)
 
-**Instrucciones:**
-1.  Analiza el contexto para responder a la **Pregunta Original del Ciudadano**.
-2.  Si encuentras la respuesta, sintetiza la información clave: requisitos, pasos y costos.
-3.  Si la pregunta pide un enlace (link) y está en el contexto, inclúyelo de forma clara.
-4.  Si el contexto no contiene la respuesta, di amablemente: "Disculpa, no encontré información precisa sobre tu consulta en la base de datos. Te recomiendo visitar el portal oficial de gob.ec para más detalles."
-5.  Siempre finaliza tu respuesta con la frase: "Recuerda verificar la información en la fuente oficial."
+def build_llm(chain, timeout):
+    """
+    ChatGroq envuelto en la capa de resiliencia. Los reintentos los gestiona la capa, así
+    que el cliente de Groq no reintenta por su cuenta (max_retries=0).
+    """
+    primary_kwargs = {"model": GROQ_MODEL, "timeout": timeout, "max_retries": 0}
+    if GROQ_BASE_URL:
+        primary_kwargs["base_url"] = GROQ_BASE_URL
+    models = [ChatGroq(**primary_kwargs)]
+    if LLM_FALLBACK_MODEL or LLM_FALLBACK_BASE_URL:
+        fallback_kwargs = {"model": LLM_FALLBACK_MODEL or GROQ_MODEL, "timeout": timeout, "max_retries": 0}
+        if LLM_FALLBACK_BASE_URL:
+            fallback_kwargs["base_url"] = LLM_FALLBACK_BASE_URL
+        if LLM_FALLBACK_API_KEY:
+            fallback_kwargs["api_key"] = LLM_FALLBACK_API_KEY
+        models.append(ChatGroq(**fallback_kwargs))
+    return ResilientChatModel(
+        models=models,
+        name_prefix=chain,
+        timeout=timeout,
+        max_retries=LLM_MAX_RETRIES,
+        backoff=LLM_RETRY_BACKOFF,
+        hedge_after=LLM_HEDGE_AFTER or None,
+    )
+
+def build_search_stack():
+    """
+    Embeddings, base vectorial e índices de búsqueda. Es lo que carga cada worker en modo
+    de un solo proceso, o una sola vez el servicio de búsqueda compartido (servicio_busqueda.py).
+    """
+    with startup_phase("embeddings"):
+        # --- CAMBIO: Usamos las clases modernas ---
+        embeddings = load_embeddings()
+        disk_cache = open_disk_cache(EMBEDDING_DISK_CACHE_PATH, embedding_model_key(), EMBEDDING_DISK_CACHE_MB)
+        if disk_cache:
+            # Sobrevive a reinicios y la comparten los workers y la ingesta
+            embeddings = DiskCachedEmbeddings(embeddings, disk_cache)
+        if EMBEDDING_CACHE_SIZE > 0:
+            # Consultas repetidas o reescrituras ya vistas no vuelven a pasar por el modelo
+            embeddings = CachedEmbeddings(embeddings, model_name=embedding_model_key(),
+                                          max_entries=EMBEDDING_CACHE_SIZE)
 
-**Pregunta Original del Ciudadano:**
-{question}
+    with startup_phase("vectores"):
+        db = None
+        if VECTOR_BACKEND == "numpy":
+            print("Abriendo la matriz de embeddings (backend numpy, mmap)...")
+            db = NumpyVectorStore.load(CHROMA_DB_PATH, embeddings)
+            if db is None:
+                print("Aviso: no existe vectors.npy (vuelve a ejecutar la ingesta). Se usará ChromaDB.")
+        if db is None:
+            print("Cargando la base de datos ChromaDB...")
+            db = Chroma(persist_directory=CHROMA_DB_PATH, embedding_function=embeddings)
 
-**Tu Respuesta Detallada:**
-"""
+    with startup_phase("indices"):
+        # --- Búsqueda híbrida: Chroma + índice BM25 construido en la ingesta ---
+        lexical_index = BM25Index.load(CHROMA_DB_PATH)
+        if lexical_index:
+            print(f"Índice léxico BM25 cargado: {len(lexical_index.documents)} documentos.")
+        else:
+            print("Aviso: no se encontró el índice BM25. Se usará solo la búsqueda semántica.")
+        # Trámites padre: los fragmentos encontrados se traducen a sus secciones completas
+        parent_store = ParentStore.load(CHROMA_DB_PATH)
+        if parent_store:
+            print(f"Trámites padre cargados: {len(parent_store)}.")
+        searcher = HybridSearcher(db, lexical_index, k=SEARCH_K, candidates=HYBRID_CANDIDATES,
+                                  parent_store=parent_store)
+    return embeddings, db, searcher
 
-rag_chain = None
+def tramite_titles(db):
+    """Nombres de trámites conocidos, para los atajos de la reescritura."""
+    return {m.get("nombre_tramite") for m in db.get(include=["metadatas"])["metadatas"] if m.get("nombre_tramite")}
+
+def connect_search_sidecar():
+    """Embeddings y búsqueda delegados al servicio compartido: el worker no carga PyTorch ni Chroma."""
+    with startup_phase("servicio_busqueda"):
+        print(f"Conectando con el servicio de búsqueda en '{SEARCH_SIDECAR_SOCKET}'...")
+        client = SearchClient(SEARCH_SIDECAR_SOCKET, SEARCH_SIDECAR_AUTHKEY)
+        embeddings = RemoteEmbeddings(client)
+        if EMBEDDING_CACHE_SIZE > 0:
+            # Evita la ida y vuelta al servicio para preguntas repetidas (caché semántica)
+            embeddings = CachedEmbeddings(embeddings, model_name=embedding_model_key(),
+                                          max_entries=EMBEDDING_CACHE_SIZE)
+        searcher = RemoteSearcher(client)
+        titles = searcher.titles()
+    return embeddings, searcher, titles
+
+def build_pipeline():
+    """Carga modelos, índices y la cadena RAG midiendo cada fase. Es bloqueante."""
+    # Versión de la base que se va a cargar; /health/ready pide reiniciar si cambia
+    startup_state["index_version"] = read_index_version(CHROMA_DB_PATH)
+    if SEARCH_SIDECAR_SOCKET:
+        embeddings, searcher, titles = connect_search_sidecar()
+        parent_store = ParentStore.load(CHROMA_DB_PATH) if DIRECT_ANSWER_THRESHOLD > 0 else None
+    else:
+        embeddings, db, searcher = build_search_stack()
+        titles = tramite_titles(db)
+        parent_store = searcher.parent_store
+
+    with startup_phase("cadena"):
+        llm = build_llm("response", LLM_RESPONSE_TIMEOUT)
+
+        # --- Caché de respuestas (exacta + semántica), se invalida al re-ingestar ---
+        response_cache = None
+        if RESPONSE_CACHE_SIZE > 0:
+            response_cache = ResponseCache(
+                max_entries=RESPONSE_CACHE_SIZE,
+                ttl_seconds=RESPONSE_CACHE_TTL,
+                embed_fn=embeddings.embed_query,
+                semantic_threshold=SEMANTIC_CACHE_THRESHOLD,
+                db_path=CHROMA_DB_PATH,
+            )
+
+        # Facetas: instituciones conocidas para detectar filtros en las preguntas
+        facet_index = FacetIndex.load(CHROMA_DB_PATH)
+        if facet_index:
+            print(f"Índice de facetas cargado: {len(facet_index.institutions)} instituciones.")
+        else:
+            print("Aviso: no se encontró el índice de facetas. No se detectarán filtros en las preguntas.")
+
+        # Índice de títulos para responder con plantilla las consultas que nombran un trámite
+        title_index = None
+        if DIRECT_ANSWER_THRESHOLD > 0 and parent_store:
+            title_index = TitleIndex(parent_store, threshold=DIRECT_ANSWER_THRESHOLD)
+            print(f"Índice de títulos cargado: {len(title_index)} trámites.")
+
+        # --- Reescritura: caché persistente + atajos locales antes de llamar a Groq ---
+        rewriter = QueryRewriter(
+            build_llm("rewrite", LLM_REWRITE_TIMEOUT),
+            titles=titles,
+            cache_path=REWRITE_CACHE_PATH,
+            max_entries=REWRITE_CACHE_SIZE,
+            max_keyword_tokens=REWRITE_MAX_KEYWORDS,
+            model_name=GROQ_MODEL,
+            facet_index=facet_index,
+        )
+
+        # --- CADENA RAG ASÍNCRONA: reescritura -> búsqueda (pool de hilos) -> respuesta ---
+        pipeline = RagPipeline(llm, searcher, retrieval_workers=RETRIEVAL_WORKERS,
+                               response_cache=response_cache, rewriter=rewriter,
+                               context_packer=ContextPacker(token_budget=CONTEXT_TOKEN_BUDGET),
+                               embeddings=embeddings, coalesce=COALESCE_REQUESTS,
+                               title_index=title_index, concurrency=chat_semaphore)
+    return pipeline
+
+def warmup_searcher(searcher):
+    """Un embedding y una búsqueda reales para que la primera consulta no pague la carga perezosa."""
+    with startup_phase("warmup"):
+        searcher.search("emisión de duplicado de cédula de identidad")
+
+def warmup(pipeline):
+    warmup_searcher(pipeline.searcher)
+
+async def initialize():
+    global rag_pipeline
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        # La carga corre en un hilo: en modo "background" el servidor sigue atendiendo /health
+        pipeline = await loop.run_in_executor(None, build_pipeline)
+        if WARMUP_ON_STARTUP:
+            await loop.run_in_executor(None, warmup, pipeline)
+        rag_pipeline = pipeline
+        startup_state["status"] = "ready"
+        startup_state["phases"]["total"] = round(time.perf_counter() - start, 3)
+        print(f"¡Servicio de Chatbot listo en {startup_state['phases']['total']:.2f}s! "
+              f"(máx. {MAX_CONCURRENT_REQUESTS} consultas simultáneas, {RETRIEVAL_WORKERS} hilos de búsqueda)")
+    except Exception as e:
+        print(f"Error fatal durante la inicialización: {e}")
+        startup_state["status"] = "failed"
+        startup_state["error"] = str(e)
+        rag_pipeline = None
 
 @app.on_event("startup")
 async def startup_event():
-    global rag_chain
-    
-    print("Cargando la base de datos ChromaDB...")
     if not os.path.exists(CHROMA_DB_PATH):
         print(f"Error Crítico: El directorio '{CHROMA_DB_PATH}' no existe. Ejecuta el script de ingesta primero.")
+        startup_state["status"] = "failed"
+        startup_state["error"] = f"No existe '{CHROMA_DB_PATH}'."
         return
 
-    try:
-        # --- CAMBIO: Usamos las clases modernas ---
-        embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
-        db = Chroma(persist_directory=CHROMA_DB_PATH, embedding_function=embeddings)
-        # --- Fin del Cambio ---
-        
-        retriever = db.as_retriever(search_kwargs={'k': 4}) # Aumentamos a 4 para más contexto
-        
-        llm = ChatGroq(model=GROQ_MODEL)
-        
-        # --- NUEVO: Cadena de Reescritura ---
-        rewrite_prompt = ChatPromptTemplate.from_template(REWRITE_PROMPT_TEMPLATE)
-        query_rewriter = rewrite_prompt | llm | StrOutputParser()
-        
-        # --- CADENA RAG COMPLETA Y MEJORADA ---
-        def retrieve_docs(query):
-            """Función que reescribe la pregunta y luego busca en la DB."""
-            print(f"Pregunta original: '{query}'")
-            rewritten_query = query_rewriter.invoke({"question": query})
-            print(f"Pregunta reescrita: '{rewritten_query}'")
-            return retriever.invoke(rewritten_query)
-
-        response_prompt = ChatPromptTemplate.from_template(RESPONSE_PROMPT_TEMPLATE)
-
-        rag_chain = (
-            {
-                "context": RunnablePassthrough() | retrieve_docs,
-                "question": RunnablePassthrough()
-            }
-            | response_prompt
-            | llm
-            | StrOutputParser()
-        )
-        print("¡Servicio de Chatbot listo y optimizado con Reescritura de Consultas!")
-    except Exception as e:
-        print(f"Error fatal durante la inicialización: {e}")
-        rag_chain = None
+    if STARTUP_MODE == "background":
+        print("Arranque en segundo plano: el servidor acepta tráfico mientras se cargan los modelos.")
+        global startup_task
+        startup_task = asyncio.create_task(initialize())
+    else:
+        await initialize()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if rag_pipeline:
+        rag_pipeline.shutdown()
 
 # --- 5. Endpoints ---
 
@@ -129,15 +440,197 @@ async def startup_event():
 def read_root():
     return {"message": "Bienvenido al Asistente Inteligente de Trámites. Usa el endpoint /chat."}
 
+@app.get("/health/ready")
+def health_ready():
+    """
+    Listo cuando la cadena está cargada (y precalentada). Responde 503 mientras tanto y
+    también si la base fue reingestada después de arrancar: los índices no se recargan en
+    caliente, así que el servicio necesita reiniciarse para responder con la base nueva.
+    """
+    if not rag_pipeline:
+        return JSONResponse(status_code=503, content=startup_state)
+    version = read_index_version(CHROMA_DB_PATH)
+    if version != startup_state["index_version"]:
+        if startup_state["status"] != "restart_required":
+            print(f"Índice reconstruido (versión {version}) después del arranque: se requiere reiniciar el servicio.")
+        startup_state["status"] = "restart_required"
+        startup_state["error"] = (f"La base cambió a la versión {version} después del arranque "
+                                  f"({startup_state['index_version']}); reinicia el servicio.")
+        return JSONResponse(status_code=503, content=startup_state)
+    return startup_state
+
+async def admit(priority, queries=1):
+    """Reserva cuota de Groq o rechaza la petición con 429 y Retry-After antes de gastar en ella."""
+    if not admission.enabled or queries == 0:
+        return None
+    try:
+        return await admission.acquire(priority, queries)
+    except AdmissionRejected as e:
+        print(f"[admision] Petición rechazada ({e.reason}); Retry-After={e.retry_after}s")
+        raise HTTPException(status_code=429, detail=f"El servicio está saturado ({e.reason}). "
+                            f"Intenta de nuevo en {e.retry_after} segundos.",
+                            headers={"Retry-After": str(e.retry_after)})
+
+def release(ticket):
+    if ticket:
+        admission.settle(ticket)
+
 @app.post("/chat")
 async def handle_chat(query: ChatQuery):
-    if not rag_chain:
+    if not rag_pipeline:
         raise HTTPException(status_code=503, detail="El servicio de Chatbot no está inicializado.")
 
-    response = rag_chain.invoke(query.query_text)
-    
+    filters = query_filters(query)
+    # Una pregunta igual a otra en curso se une a ella (coalescencia) sin reservar cuota
+    ticket = await admit(INTERACTIVE, int(await rag_pipeline.needs_llm(query.query_text, filters)))
+    try:
+        # El límite de MAX_CONCURRENT_REQUESTS lo aplica la cadena a cada ejecución real
+        response = await rag_pipeline.ainvoke(query.query_text, filters)
+    finally:
+        release(ticket)
+
     return {"response": response}
 
+@app.post("/chat/batch")
+async def handle_chat_batch(batch: ChatBatchQuery):
+    """
+    Responde varias preguntas en una sola petición (procesos nocturnos, centro de contacto).
+    Los resultados vuelven en el mismo orden; cada uno trae `response` o `error`.
+    """
+    if not rag_pipeline:
+        raise HTTPException(status_code=503, detail="El servicio de Chatbot no está inicializado.")
+    if len(batch.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"El lote supera el máximo de {BATCH_MAX_QUERIES} preguntas.")
+
+    # Cada llamada del lote al LLM reserva su cuota justo antes de hacerse, detrás de las
+    # interactivas: el lote no deja la cuota en deuda y /chat sigue entrando entre llamadas.
+    # Si una se rechaza, esa pregunta vuelve con `error` y `retry_after` y el resto del lote
+    # continúa; si se rechazan todas, el lote responde 429.
+    ticket = Ticket(BATCH, 0, 0) if admission.enabled else None
+
+    async def admit_call():
+        ticket.absorb(await admission.acquire(BATCH, calls=1))
+
+    try:
+        results = await rag_pipeline.abatch(batch.queries, max_concurrency=BATCH_LLM_CONCURRENCY,
+                                            admit=admit_call if ticket else None)
+    finally:
+        release(ticket)
+    retry_after = [result.get("retry_after") for result in results]
+    if results and all(retry_after):
+        # Ninguna pregunta pasó la admisión: es un problema de cuota, no un lote procesado
+        print(f"[admision] Lote rechazado completo; Retry-After={max(retry_after)}s")
+        raise HTTPException(status_code=429, detail=f"El servicio está saturado. "
+                            f"Intenta de nuevo en {max(retry_after)} segundos.",
+                            headers={"Retry-After": str(max(retry_after))})
+    return {
+        "results": [{"query_text": question, **result} for question, result in zip(batch.queries, results)]
+    }
+
+@app.post("/search")
+async def handle_search(query: SearchQuery):
+    """
+    Solo recuperación, sin LLM: trámites ordenados por relevancia (búsqueda híbrida) con su
+    puntaje, los campos pedidos y paginación. Para el buscador web y el centro de contacto.
+    """
+    if not rag_pipeline:
+        raise HTTPException(status_code=503, detail="El servicio de Chatbot no está inicializado.")
+    if query.page_size > SEARCH_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"page_size no puede superar {SEARCH_MAX_PAGE_SIZE}.")
+    offset = (query.page - 1) * query.page_size
+    if offset + query.page_size > SEARCH_MAX_RESULTS:
+        raise HTTPException(status_code=400, detail=f"Solo se pueden paginar los primeros {SEARCH_MAX_RESULTS} resultados.")
+    fields = query.fields or list(DEFAULT_RESULT_FIELDS)
+    unknown = [field for field in fields if field not in RESULT_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Campos desconocidos: {unknown}. Disponibles: {list(RESULT_FIELDS)}.")
+
+    found = await rag_pipeline.run_in_executor(
+        rag_pipeline.searcher.search_tramites, query.query_text, query_filters(query), offset, query.page_size, fields,
+        SEARCH_MAX_RESULTS,
+    )
+    return {
+        "query_text": query.query_text,
+        "page": query.page,
+        "page_size": query.page_size,
+        "total": found["total"],
+        "has_more": found["total"] > offset + query.page_size,
+        "results": found["results"],
+    }
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Contadores de la caché de respuestas, de las cachés de embeddings y de la coalescencia."""
+    stats = {"responses": {"enabled": False}, "embeddings": {"enabled": False},
+             "embeddings_disk": {"enabled": False}, "coalescing": {"enabled": False}}
+    if rag_pipeline and rag_pipeline.response_cache:
+        stats["responses"] = {"enabled": True, **rag_pipeline.response_cache.stats()}
+    embeddings = rag_pipeline.embeddings if rag_pipeline else None
+    if isinstance(embeddings, CachedEmbeddings):
+        stats["embeddings"] = {"enabled": True, **embeddings.stats()}
+        embeddings = embeddings.embeddings
+    if isinstance(embeddings, DiskCachedEmbeddings):
+        stats["embeddings_disk"] = {"enabled": True, **embeddings.cache.stats()}
+    if rag_pipeline and rag_pipeline.single_flight:
+        stats["coalescing"] = {"enabled": True, **rag_pipeline.single_flight.stats()}
+    return stats
+
+@app.get("/metrics")
+def metrics():
+    """Histogramas por etapa, tokens y cachés en formato de texto de Prometheus."""
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/facets")
+def facets():
+    """Instituciones disponibles para el filtro `institucion` y número de trámites gratuitos."""
+    facet_index = rag_pipeline.query_rewriter.facet_index if rag_pipeline else None
+    if not facet_index:
+        raise HTTPException(status_code=503, detail="El índice de facetas no está disponible.")
+    return {
+        "instituciones": [
+            {"clave": key, "nombre": info["nombre"], "tramites": info["tramites"]}
+            for key, info in sorted(facet_index.institutions.items(), key=lambda item: -item[1]["tramites"])
+        ],
+        "gratuitos": facet_index.free_count,
+    }
+
+def sse_event(event, data):
+    """Formatea un evento Server-Sent Events con datos JSON."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def handle_chat_stream(query: ChatQuery):
+    """
+    Igual que /chat pero emite la respuesta como Server-Sent Events:
+    `sources` (trámites encontrados), varios `token` y al final `done`.
+    """
+    if not rag_pipeline:
+        raise HTTPException(status_code=503, detail="El servicio de Chatbot no está inicializado.")
+
+    # La admisión se decide antes de abrir el stream, para poder responder 429
+    filters = query_filters(query)
+    # El streaming no pasa por la coalescencia: cada petición reserva su propia cuota
+    ticket = await admit(INTERACTIVE, int(await rag_pipeline.needs_llm(query.query_text, filters, coalesced=False)))
+
+    async def event_generator():
+        try:
+            async with chat_semaphore:
+                async for event, data in rag_pipeline.astream(query.query_text, filters):
+                    yield sse_event(event, data)
+                yield sse_event("done", {})
+        except Exception as e:
+            # La respuesta ya empezó (status 200); el error se comunica como evento
+            print(f"Error durante el streaming: {e}")
+            yield sse_event("error", {"detail": "Error al generar la respuesta."})
+        finally:
+            release(ticket)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # --- 6. Ejecución ---
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,221 @@
+# metricas.py
+# Instrumentación del servidor: cada petición lleva un identificador (cabecera X-Request-ID)
+# y una traza con el tiempo de cada etapa del pipeline (cache, rewrite, embed, search,
+# prompt, generate). Los tiempos, los tokens del LLM y los contadores de las cachés se
+# exponen en formato Prometheus en /metrics.
+# Con varios workers de uvicorn cada proceso tiene sus propios contadores: hay que usar el
+# modo multiproceso de prometheus_client (PROMETHEUS_MULTIPROC_DIR) o raspar cada worker.
+
+import contextvars
+import time
+import uuid
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+REQUEST_ID_HEADER = "x-request-id"
+# Solo estas rutas registran latencia de petición (evita series por cada URL inválida)
+TRACED_PATHS = {"/chat", "/chat/stream", "/chat/batch", "/search"}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REQUEST_SECONDS = Histogram(
+    "asistente_request_seconds", "Duración total de la petición.", ["endpoint", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "asistente_stage_seconds", "Duración de cada etapa del pipeline RAG.", ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "asistente_llm_tokens", "Tokens consumidos en Groq.", ["chain", "kind"],
+)
+CONTEXT_TOKENS = Histogram(
+    "asistente_context_tokens", "Tokens estimados del contexto enviado al LLM.",
+    buckets=(250, 500, 1000, 1500, 2000, 3000, 4000, 6000),
+)
+REWRITES = Counter(
+    "asistente_rewrites", "Reescrituras de consultas por ruta (cache, titulo, local, llm, original).", ["path"],
+)
+LLM_CALLS = Counter(
+    "asistente_llm_calls", "Intentos de llamada al LLM por cadena y resultado "
+    "(ok, fallback, timeout, error, hedge).", ["chain", "outcome"],
+)
+DIRECT_ANSWERS = Counter(
+    "asistente_direct_answers", "Consultas que coincidieron con un título de trámite (hit) o no (miss).", ["outcome"],
+)
+COALESCED_REQUESTS = Counter(
+    "asistente_coalesced_requests", "Peticiones que esperaron una ejecución idéntica ya en curso.",
+)
+SINGLE_FLIGHT_EXECUTIONS = Counter(
+    "asistente_single_flight_executions", "Ejecuciones reales de la cadena bajo coalescencia.",
+)
+
+ADMISSION_DECISIONS = Counter(
+    "asistente_admission_decisions", "Decisiones del control de admisión por prioridad "
+    "(admitted, queued, rejected, timeout).", ["priority", "outcome"],
+)
+ADMISSION_WAIT_SECONDS = Histogram(
+    "asistente_admission_wait_seconds", "Espera en la cola de admisión de las peticiones admitidas.", ["priority"],
+    buckets=LATENCY_BUCKETS,
+)
+ADMISSION_QUEUE = Gauge(
+    "asistente_admission_queue", "Peticiones esperando cuota de Groq.",
+)
+
+# Traza de la petición en curso; asyncio la propaga a las tareas y RagPipeline a su pool de hilos
+current_trace = contextvars.ContextVar("current_trace", default=None)
+# Funciones (traza, estado, segundos) llamadas al cerrar cada traza, p. ej. por bench_carga.py
+TRACE_LISTENERS = []
+
+
+class RequestTrace:
+    """Tiempos por etapa y anotaciones (caché, tokens...) de una petición."""
+
+    def __init__(self, request_id, endpoint):
+        self.request_id = request_id
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.notes = {}
+        # Consumo de Groq de la petición, para ajustar la reserva del control de admisión
+        self.llm_calls = 0
+        self.llm_tokens = 0
+        self.finished = False
+
+    def add(self, stage, seconds):
+        # Un lote puede pasar varias veces por la misma etapa: se acumula
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def note(self, key, value):
+        self.notes[key] = value
+
+    def finish(self, status):
+        if self.finished:
+            return
+        self.finished = True
+        elapsed = time.perf_counter() - self.start
+        if self.endpoint not in TRACED_PATHS:
+            return
+        REQUEST_SECONDS.labels(self.endpoint, str(status)).observe(elapsed)
+        for listener in TRACE_LISTENERS:
+            listener(self, status, elapsed)
+        parts = [f"id={self.request_id}", f"ruta={self.endpoint}", f"estado={status}", f"total={elapsed * 1000:.1f}ms"]
+        parts += [f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.stages.items()]
+        parts += [f"{key}={value}" for key, value in self.notes.items()]
+        print("[traza] " + " ".join(parts))
+
+
+@contextmanager
+def stage(name):
+    """Mide una etapa: la observa en el histograma y la suma a la traza de la petición."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        trace = current_trace.get()
+        if trace:
+            trace.add(name, elapsed)
+
+
+def note(key, value):
+    """Anota un dato (p. ej. cache_respuestas=hit) en la traza de la petición en curso, si la hay."""
+    trace = current_trace.get()
+    if trace:
+        trace.note(key, value)
+
+
+def record_llm_usage(chain, message):
+    """Suma los tokens que informa Groq en `usage_metadata` (si el modelo los devuelve)."""
+    usage = getattr(message, "usage_metadata", None)
+    if not usage:
+        return
+    LLM_TOKENS.labels(chain, "input").inc(usage.get("input_tokens", 0))
+    LLM_TOKENS.labels(chain, "output").inc(usage.get("output_tokens", 0))
+    trace = current_trace.get()
+    if trace:
+        trace.llm_tokens += usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+    note(f"tokens_{chain}", f"{usage.get('input_tokens', 0)}+{usage.get('output_tokens', 0)}")
+
+
+def count_llm_call(chain, outcome):
+    """Una petición HTTP a Groq (intento, reintento o hedge) en /metrics y en la traza."""
+    LLM_CALLS.labels(chain, outcome).inc()
+    trace = current_trace.get()
+    if trace:
+        trace.llm_calls += 1
+
+
+class RequestTracingMiddleware:
+    """
+    Middleware ASGI: asigna el identificador de la petición (respeta el X-Request-ID entrante),
+    lo devuelve en la respuesta y cierra la traza cuando se envía el último byte, de modo
+    que las respuestas en streaming miden también la generación.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(REQUEST_ID_HEADER.encode(), b"").decode("latin-1")[:64] or uuid.uuid4().hex[:16]
+        trace = RequestTrace(request_id, scope["path"])
+        token = current_trace.set(trace)
+        status = 500
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (REQUEST_ID_HEADER.encode(), request_id.encode("latin-1"))
+                ]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                trace.finish(status)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            trace.finish(status)
+            current_trace.reset(token)
+
+
+class PipelineCollector:
+    """Publica en /metrics los contadores que ya llevan las cachés del pipeline."""
+
+    def __init__(self, get_pipeline):
+        self.get_pipeline = get_pipeline
+
+    def collect(self):
+        pipeline = self.get_pipeline()
+        if not pipeline:
+            return
+        if pipeline.response_cache:
+            stats = pipeline.response_cache.stats()
+            hits = CounterMetricFamily("asistente_response_cache_hits", "Aciertos de la caché de respuestas.",
+                                       labels=["tier"])
+            hits.add_metric(["exact"], stats["hits_exact"])
+            hits.add_metric(["semantic"], stats["hits_semantic"])
+            yield hits
+            yield CounterMetricFamily("asistente_response_cache_misses", "Fallos de la caché de respuestas.",
+                                      value=stats["misses"])
+            yield CounterMetricFamily("asistente_response_cache_evictions", "Entradas desalojadas por tamaño.",
+                                      value=stats["evictions"])
+            yield GaugeMetricFamily("asistente_response_cache_entries", "Respuestas en caché.",
+                                    value=stats["entries"])
+        embeddings_stats = getattr(pipeline.embeddings, "stats", None)
+        if embeddings_stats:
+            stats = embeddings_stats()
+            yield CounterMetricFamily("asistente_embedding_cache_hits", "Aciertos de la caché de embeddings.",
+                                      value=stats["hits"])
+            yield CounterMetricFamily("asistente_embedding_cache_misses", "Fallos de la caché de embeddings.",
+                                      value=stats["misses"])
+            yield GaugeMetricFamily("asistente_embedding_cache_entries", "Embeddings en caché.",
+                                    value=stats["entries"])
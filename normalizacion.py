@@ -0,0 +1,32 @@
+# normalizacion.py
+# Utilidades de normalización de texto compartidas por las cachés y los índices:
+# minúsculas, sin tildes, sin signos de puntuación y con espacios colapsados.
+
+import re
+import unicodedata
+
+PUNCTUATION_RE = re.compile(r"[^\w\s]", re.UNICODE)
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def fold_accents(text):
+    """Quita tildes y diéresis ('Cédula' -> 'Cedula'). La 'ñ' se conserva como 'n'."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def split_words(text):
+    """Separa el texto en palabras sin cambiar mayúsculas ni tildes."""
+    return PUNCTUATION_RE.sub(" ", text).split()
+
+
+def normalize_text(text):
+    """
+    Normaliza una consulta para usarla como clave:
+    '¿Cómo saco el DUPLICADO de cédula?' -> 'como saco el duplicado de cedula'
+    """
+    if not text:
+        return ""
+    text = fold_accents(text.lower())
+    text = PUNCTUATION_RE.sub(" ", text)
+    return WHITESPACE_RE.sub(" ", text).strip()
@@ -0,0 +1,358 @@
+# rag_pipeline.py
+# Pipeline RAG asíncrono: reescritura de la consulta (reescritura.py), búsqueda en ChromaDB
+# dentro de un pool de hilos acotado y generación de la respuesta final con Groq.
+# Ninguna etapa bloquea el event loop de uvicorn. Las consultas que nombran un trámite
+# se responden antes, con plantilla (respuesta_directa.py).
+
+import asyncio
+import contextvars
+import functools
+import json
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain.prompts import ChatPromptTemplate
+
+from reescritura import QueryRewriter
+from contexto import ContextPacker
+from metricas import CONTEXT_TOKENS, DIRECT_ANSWERS, note, record_llm_usage, stage
+from coalescencia import SingleFlight
+from normalizacion import normalize_text
+from facetas import to_where
+from admision import AdmissionRejected
+
+# --- PROMPT FINAL MEJORADO ---
+RESPONSE_PROMPT_TEMPLATE = """
+Eres un asistente virtual experto en trámites del gobierno de Ecuador. Tu misión es dar respuestas claras y directas basadas ÚNICAMENTE en la información de los siguientes documentos.
+
+**Contexto (Documentos Encontrados):**
+{context}
+
+**Instrucciones:**
+1.  Analiza el contexto para responder a la **Pregunta Original del Ciudadano**.
+2.  Si encuentras la respuesta, sintetiza la información clave: requisitos, pasos y costos.
+3.  Si la pregunta pide un enlace (link) y está en el contexto, inclúyelo de forma clara.
+4.  Si el contexto no contiene la respuesta, di amablemente: "Disculpa, no encontré información precisa sobre tu consulta en la base de datos. Te recomiendo visitar el portal oficial de gob.ec para más detalles."
+5.  Siempre finaliza tu respuesta con la frase: "Recuerda verificar la información en la fuente oficial."
+
+**Pregunta Original del Ciudadano:**
+{question}
+
+**Tu Respuesta Detallada:**
+"""
+
+TRAMITE_TITLE_RE = re.compile(r"^\*\*Trámite:\*\*\s*(.+)$", re.MULTILINE)
+# Resultados recientes del índice de títulos: la admisión y la respuesta consultan la misma
+# pregunta una detrás de otra, y la búsqueda por trigramas solo debe hacerse una vez
+TITLE_MATCH_MEMO_SIZE = 2048
+
+
+def document_source(doc):
+    """Devuelve la URL y el nombre del trámite de un documento recuperado."""
+    nombre = doc.metadata.get("nombre_tramite")
+    if not nombre:
+        # Bases creadas antes de guardar el nombre en metadata: se lee del page_content
+        match = TRAMITE_TITLE_RE.search(doc.page_content)
+        nombre = match.group(1).strip() if match else "No disponible"
+    return {"URL_Fuente": doc.metadata.get("source", "No disponible"), "Nombre_Tramite": nombre}
+
+
+class RagPipeline:
+    """
+    Cadena RAG completa (reescritura -> búsqueda -> respuesta) en versión asíncrona.
+    Las llamadas a Groq usan `ainvoke`; la búsqueda (embedding en CPU + Chroma + BM25)
+    es síncrona, por eso se ejecuta en un ThreadPoolExecutor de tamaño fijo.
+    """
+
+    def __init__(self, llm, searcher, retrieval_workers=4, response_cache=None, rewriter=None,
+                 context_packer=None, embeddings=None, coalesce=True, title_index=None, concurrency=None):
+        self.searcher = searcher
+        self.title_index = title_index
+        self._title_matches = OrderedDict()   # (pregunta, filtros) -> URL | None
+        self.embeddings = embeddings
+        self.context_packer = context_packer or ContextPacker()
+        self.response_cache = response_cache
+        self.query_rewriter = rewriter or QueryRewriter(llm)
+        # Sin StrOutputParser: el mensaje completo trae `usage_metadata` con los tokens
+        self.response_chain = ChatPromptTemplate.from_template(RESPONSE_PROMPT_TEMPLATE) | llm
+        self.executor = ThreadPoolExecutor(max_workers=retrieval_workers, thread_name_prefix="retrieval")
+        # Preguntas idénticas simultáneas comparten una sola ejecución de la cadena
+        self.single_flight = SingleFlight() if coalesce else None
+        # Semáforo (asyncio) que limita las ejecuciones simultáneas de la cadena, o None
+        self.concurrency = concurrency
+
+    async def run_in_executor(self, func, *args):
+        """Ejecuta una función bloqueante en el pool de búsqueda sin frenar el event loop."""
+        loop = asyncio.get_running_loop()
+        # Se copia el contexto para que la traza de la petición siga disponible en el hilo
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, func, *args))
+
+    async def rewrite_query(self, question):
+        with stage("rewrite"):
+            return await self.query_rewriter.rewrite(question)
+
+    def search_filters(self, question, filters=None):
+        """Filtros detectados en la pregunta combinados con los explícitos (estos mandan)."""
+        return {**self.query_rewriter.detect_filters(question), **(filters or {})}
+
+    async def retrieve_docs(self, question, filters=None):
+        """Reescribe la pregunta y luego busca en la DB, acotada por los filtros de facetas."""
+        print(f"Pregunta original: '{question}'")
+        rewritten_query = await self.rewrite_query(question)
+        print(f"Pregunta reescrita: '{rewritten_query}'")
+        search_filters = self.search_filters(question, filters)
+        docs = await self.run_in_executor(self.searcher.search, rewritten_query, search_filters)
+        if not docs and search_filters != (filters or {}):
+            # Un filtro detectado puede ser un falso positivo: se repite solo con los explícitos
+            print("[filtros] Sin resultados con los filtros detectados; se busca sin ellos.")
+            docs = await self.run_in_executor(self.searcher.search, rewritten_query, filters)
+        return docs
+
+    async def match_title(self, question, filters=None):
+        """
+        URL del trámite nombrado en la pregunta, o None. La búsqueda por trigramas (~0.5 ms)
+        corre en el pool de hilos y su resultado se recuerda, así que cada pregunta se
+        busca una sola vez aunque la consulten la admisión y luego la respuesta.
+        """
+        key = (question, json.dumps(filters or {}, sort_keys=True))
+        if key in self._title_matches:
+            self._title_matches.move_to_end(key)
+            return self._title_matches[key]
+        with stage("direct"):
+            url = await self.run_in_executor(self.title_index.match, question, to_where(filters or {}))
+        self._title_matches[key] = url
+        while len(self._title_matches) > TITLE_MATCH_MEMO_SIZE:
+            self._title_matches.popitem(last=False)
+        return url
+
+    async def direct_answer(self, question, filters=None):
+        """
+        Respuesta con plantilla si la pregunta es el nombre de un trámite (respetando los
+        filtros explícitos). Devuelve (respuesta, fuentes) o (None, None).
+        """
+        if not self.title_index:
+            return None, None
+        url = await self.match_title(question, filters)
+        DIRECT_ANSWERS.labels("hit" if url else "miss").inc()
+        note("respuesta_directa", "hit" if url else "miss")
+        if not url:
+            return None, None
+        parent = self.title_index.parent_store.parents[url]
+        print(f"Respuesta directa para '{question}': {parent['Nombre_Tramite']}")
+        return self.title_index.render(url), [{"URL_Fuente": url, "Nombre_Tramite": parent["Nombre_Tramite"]}]
+
+    async def needs_llm(self, question, filters=None, coalesced=True):
+        """
+        False si la pregunta se responderá sin Groq (título de trámite o caché exacta) o, con
+        `coalesced`, si ya hay una ejecución igual en curso a la que `ainvoke` se unirá.
+        No toca contadores: lo usa el control de admisión antes de reservar cuota.
+        """
+        if self.title_index and await self.match_title(question, filters):
+            return False
+        # Sin `await` entre esta consulta y `ainvoke`: la ejecución no puede terminar antes
+        if coalesced and self.single_flight and self.coalescing_key(question, filters) in self.single_flight:
+            return False
+        return not (self.response_cache and not filters and self.response_cache.contains(question))
+
+    async def lookup_cache(self, question, filters=None):
+        """Consulta la caché de respuestas. Devuelve (respuesta | None, embedding de la pregunta)."""
+        # Con filtros explícitos la respuesta depende de algo más que la pregunta: sin caché
+        if not self.response_cache or filters:
+            return None, None
+        # El nivel semántico calcula un embedding (CPU), por eso va al pool de hilos
+        with stage("cache"):
+            cached, embedding = await self.run_in_executor(self.response_cache.lookup, question)
+        note("cache_respuestas", "hit" if cached else "miss")
+        if cached:
+            print(f"Respuesta servida desde la caché para: '{question}'")
+        return cached, embedding
+
+    def store_in_cache(self, question, answer, docs, embedding, filters=None):
+        if self.response_cache and answer and not filters:
+            self.response_cache.store(question, answer, [document_source(doc) for doc in docs], embedding)
+
+    def build_context(self, question, docs):
+        """Empaqueta los documentos recuperados dentro del presupuesto de tokens del prompt."""
+        with stage("prompt"):
+            context, stats = self.context_packer.pack(question, docs)
+        CONTEXT_TOKENS.observe(stats["context_tokens"])
+        print(f"[contexto] tokens={stats['context_tokens']} (sin empaquetar {stats['raw_tokens']}, "
+              f"ahorrados {stats['tokens_saved']}) secciones={stats['sections_packed']}/{stats['sections_total']}")
+        return context
+
+    async def generate(self, question, docs):
+        """Arma el contexto y genera la respuesta completa con Groq."""
+        context = self.build_context(question, docs)
+        with stage("generate"):
+            message = await self.response_chain.ainvoke({"context": context, "question": question})
+        record_llm_usage("response", message)
+        return getattr(message, "content", message)
+
+    def coalescing_key(self, question, filters=None):
+        return normalize_text(question), json.dumps(filters or {}, sort_keys=True)
+
+    async def ainvoke(self, question, filters=None):
+        if not self.single_flight:
+            return await self.limited_answer(question, filters)
+        key = self.coalescing_key(question, filters)
+        return await self.single_flight.run(key, self.limited_answer, question, filters)
+
+    async def limited_answer(self, question, filters=None):
+        """
+        `answer` dentro del límite de concurrencia. Lo toma la ejecución compartida, no cada
+        petición coalescida: las que solo esperan el resultado no ocupan un lugar.
+        """
+        if self.concurrency is None:
+            return await self.answer(question, filters)
+        async with self.concurrency:
+            return await self.answer(question, filters)
+
+    async def answer(self, question, filters=None):
+        """Título -> caché -> búsqueda -> generación para una pregunta (sin coalescencia)."""
+        direct, _ = await self.direct_answer(question, filters)
+        if direct:
+            return direct
+        cached, embedding = await self.lookup_cache(question, filters)
+        if cached:
+            return cached.answer
+        docs = await self.retrieve_docs(question, filters)
+        answer = await self.generate(question, docs)
+        self.store_in_cache(question, answer, docs, embedding, filters)
+        return answer
+
+    async def astream(self, question, filters=None):
+        """
+        Versión en streaming de `ainvoke`. Produce tuplas (evento, datos):
+        primero ("sources", [...]) con los trámites recuperados, luego un ("token", texto)
+        por cada fragmento que devuelve Groq.
+        """
+        direct, sources = await self.direct_answer(question, filters)
+        if direct:
+            yield "sources", sources
+            yield "token", direct
+            return
+        cached, embedding = await self.lookup_cache(question, filters)
+        if cached:
+            yield "sources", cached.sources
+            yield "token", cached.answer
+            return
+
+        docs = await self.retrieve_docs(question, filters)
+        # Las fuentes se envían antes de generar para que la UI muestre algo de inmediato
+        yield "sources", [document_source(doc) for doc in docs]
+        chunks = []
+        context = self.build_context(question, docs)
+        with stage("generate"):
+            async for chunk in self.response_chain.astream({"context": context, "question": question}):
+                # Groq informa los tokens en el último fragmento (si el modelo los devuelve)
+                record_llm_usage("response", chunk)
+                text = getattr(chunk, "content", chunk)
+                if text:
+                    chunks.append(text)
+                    yield "token", text
+        self.store_in_cache(question, "".join(chunks), docs, embedding, filters)
+
+    async def abatch(self, questions, max_concurrency=4, admit=None):
+        """
+        Responde una lista de preguntas. Devuelve, en el mismo orden, un dict por pregunta
+        con `response` o `error`; un fallo en una pregunta no afecta a las demás, y una
+        pregunta vacía vuelve con `error` sin llamar a Groq.
+        Las reescrituras y respuestas del LLM se lanzan con concurrencia acotada y, si se
+        pasa `admit` (corrutina sin argumentos), cada llamada real a Groq espera antes su
+        turno de cuota; una pregunta rechazada trae además `retry_after`.
+        """
+        results = [None] * len(questions)
+        llm_semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def limited(coro_fn, *args):
+            async with llm_semaphore:
+                return await coro_fn(*args)
+
+        async def admitted(coro_fn, *args):
+            # Se llama dentro del semáforo: a lo sumo `max_concurrency` llamadas esperan cuota
+            if admit:
+                await admit()
+            return await coro_fn(*args)
+
+        async def rewrite(question):
+            # Las reescrituras locales (caché, título, palabras clave) no llaman a Groq
+            if self.query_rewriter.local_rewrite(question)[0] is None:
+                return await admitted(self.rewrite_query, question)
+            return await self.rewrite_query(question)
+
+        def fail(index, error):
+            print(f"Error en la pregunta {index} del lote: {error}")
+            results[index] = {"response": None, "error": f"{type(error).__name__}: {error}"}
+            if isinstance(error, AdmissionRejected):
+                results[index]["retry_after"] = error.retry_after
+
+        # 1. Títulos de trámites y caché de respuestas (solo nivel exacto: el semántico
+        #    requeriría un embedding por pregunta)
+        pending = []
+        directs = await asyncio.gather(*(self.direct_answer(question) for question in questions
+                                         if question.strip()))
+        directs = iter(directs)
+        for i, question in enumerate(questions):
+            if not question.strip():
+                # Sin pregunta no hay nada que reescribir, buscar ni generar
+                results[i] = {"response": None, "error": "Pregunta vacía"}
+                continue
+            direct, _ = next(directs)
+            if direct:
+                results[i] = {"response": direct, "error": None}
+                continue
+            cached = self.response_cache.lookup_exact(question) if self.response_cache else None
+            if cached:
+                results[i] = {"response": cached.answer, "error": None}
+            else:
+                pending.append(i)
+
+        # 2. Reescrituras en paralelo
+        rewrites = await asyncio.gather(
+            *(limited(rewrite, questions[i]) for i in pending), return_exceptions=True
+        )
+        to_search = []
+        for i, rewritten in zip(pending, rewrites):
+            if isinstance(rewritten, Exception):
+                fail(i, rewritten)
+            else:
+                to_search.append((i, rewritten))
+
+        # 3. Embeddings en lote y búsquedas vectoriales juntas en el pool de hilos,
+        #    acotadas por los filtros detectados en cada pregunta
+        docs_by_index = {}
+        if to_search:
+            filters = [self.search_filters(questions[i]) for i, _ in to_search]
+            try:
+                docs_lists = await self.run_in_executor(
+                    self.searcher.search_many, [q for _, q in to_search], filters
+                )
+                docs_by_index = {i: docs for (i, _), docs in zip(to_search, docs_lists)}
+                # Sin resultados con filtros detectados: se repiten esas búsquedas sin filtro
+                retry = [(i, q) for (i, q), f in zip(to_search, filters) if f and not docs_by_index[i]]
+                if retry:
+                    docs_lists = await self.run_in_executor(self.searcher.search_many, [q for _, q in retry])
+                    docs_by_index.update({i: docs for (i, _), docs in zip(retry, docs_lists)})
+            except Exception as e:
+                for i, _ in to_search:
+                    fail(i, e)
+
+        # 4. Generación de respuestas en paralelo
+        indices = list(docs_by_index)
+        answers = await asyncio.gather(
+            *(limited(admitted, self.generate, questions[i], docs_by_index[i]) for i in indices),
+            return_exceptions=True,
+        )
+        for i, answer in zip(indices, answers):
+            if isinstance(answer, Exception):
+                fail(i, answer)
+            else:
+                results[i] = {"response": answer, "error": None}
+                self.store_in_cache(questions[i], answer, docs_by_index[i], None)
+        return results
+
+    def shutdown(self):
+        self.query_rewriter.save()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,203 @@
+# reescritura.py
+# Reescritura de consultas (Query Rewriting) con atajos locales para ahorrar la llamada a Groq.
+# Orden de decisión para cada pregunta:
+#   1. "cache":  la pregunta normalizada ya fue reescrita por el LLM antes (caché persistente).
+#   2. "titulo": la pregunta coincide con (o contiene) el nombre de un trámite conocido.
+#   3. "local":  consulta corta de palabras clave; se expanden siglas (IESS, SRI, ANT...).
+#   4. "llm":    pregunta en lenguaje natural; se reescribe con Groq y se guarda en caché.
+#      Si Groq falla o vence su plazo ("original"), se busca con la pregunta tal cual.
+# Además detecta filtros de facetas en la pregunta (institución mencionada, "gratuitos").
+
+import json
+import os
+import time
+from collections import OrderedDict
+
+from langchain.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+
+from metricas import REWRITES
+from normalizacion import normalize_text, split_words
+
+# --- Plantilla para reescribir la pregunta del usuario ---
+REWRITE_PROMPT_TEMPLATE = """
+Tu tarea es tomar la siguiente pregunta de un usuario y reescribirla como una consulta de búsqueda optimizada y formal, como si fuera el título de un documento oficial del gobierno de Ecuador.
+Concéntrate en las palabras clave y el objetivo del trámite. No respondas la pregunta, solo reescríbela.
+
+Pregunta Original: "{question}"
+Consulta Optimizada:
+"""
+
+# Siglas y términos abreviados frecuentes en las consultas (claves ya normalizadas)
+ABBREVIATIONS = {
+    "iess": "Instituto Ecuatoriano de Seguridad Social (IESS)",
+    "biess": "Banco del Instituto Ecuatoriano de Seguridad Social (BIESS)",
+    "sri": "Servicio de Rentas Internas (SRI)",
+    "ruc": "Registro Único de Contribuyentes (RUC)",
+    "rise": "Régimen Impositivo Simplificado (RISE)",
+    "ant": "Agencia Nacional de Tránsito (ANT)",
+    "cne": "Consejo Nacional Electoral (CNE)",
+    "msp": "Ministerio de Salud Pública (MSP)",
+    "mies": "Ministerio de Inclusión Económica y Social (MIES)",
+    "mdi": "Ministerio del Interior (MDI)",
+    "mag": "Ministerio de Agricultura y Ganadería (MAG)",
+    "mtop": "Ministerio de Transporte y Obras Públicas (MTOP)",
+    "mpceip": "Ministerio de Producción, Comercio Exterior, Inversiones y Pesca (MPCEIP)",
+    "maae": "Ministerio del Ambiente, Agua y Transición Ecológica (MAAE)",
+    "arcfz": "Agencia de Regulación y Control Fito y Zoosanitario (ARCFZ)",
+    "agrocalidad": "Agencia de Regulación y Control Fito y Zoosanitario (ARCFZ)",
+    "arcsa": "Agencia Nacional de Regulación, Control y Vigilancia Sanitaria (ARCSA)",
+    "senescyt": "Secretaría de Educación Superior, Ciencia, Tecnología e Innovación (SENESCYT)",
+    "senadi": "Servicio Nacional de Derechos Intelectuales (SENADI)",
+    "seps": "Superintendencia de Economía Popular y Solidaria (SEPS)",
+    "inec": "Instituto Nacional de Estadística y Censos (INEC)",
+    "iniap": "Instituto Nacional de Investigaciones Agropecuarias (INIAP)",
+    "dgac": "Dirección General de Aviación Civil (DGAC)",
+    "gad": "Gobierno Autónomo Descentralizado (GAD)",
+    "cedula": "cédula de identidad",
+    "licencia": "licencia de conducir",
+}
+
+# Palabras que delatan una pregunta en lenguaje natural (se deja al LLM)
+QUESTION_WORDS = {
+    "como", "que", "cual", "cuales", "donde", "cuando", "cuanto", "cuanta", "cuantos",
+    "quien", "puedo", "quiero", "necesito", "debo", "tengo", "hago", "saco", "obtengo",
+    "porque", "para", "si", "mi", "me",
+}
+
+
+class QueryRewriter:
+    """
+    Decide cómo convertir la pregunta del ciudadano en la consulta de búsqueda.
+    Las reescrituras del LLM se guardan en una caché LRU acotada que se persiste en disco
+    (`cache_path`) para sobrevivir a reinicios del servidor.
+    """
+
+    def __init__(self, llm, titles=(), cache_path=None, max_entries=5000,
+                 max_keyword_tokens=4, model_name="", save_every=25, facet_index=None):
+        self.chain = ChatPromptTemplate.from_template(REWRITE_PROMPT_TEMPLATE) | llm | StrOutputParser()
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.max_keyword_tokens = max_keyword_tokens
+        self.model_name = model_name
+        self.save_every = save_every
+        self.facet_index = facet_index
+        self._cache = OrderedDict()
+        self._unsaved = 0
+        self.set_titles(titles)
+        self.load()
+
+    def set_titles(self, titles):
+        """Registra los nombres de trámites conocidos (normalizado -> título original)."""
+        self.titles = {}
+        for title in titles:
+            key = normalize_text(title)
+            if key and title != "No disponible":
+                self.titles.setdefault(key, title)
+        # Títulos largos primero: ante varias coincidencias se prefiere la más específica
+        self._titles_by_length = sorted(
+            (key for key in self.titles if len(key.split()) >= 3), key=len, reverse=True
+        )
+
+    # --- Persistencia de la caché ---
+
+    def load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Advertencia: no se pudo leer la caché de reescritura '{self.cache_path}': {e}")
+            return
+        if data.get("model") != self.model_name:
+            print("La caché de reescritura pertenece a otro modelo. Se descarta.")
+            return
+        for key, value in list(data.get("entries", {}).items())[-self.max_entries:]:
+            self._cache[key] = value
+        print(f"Caché de reescritura cargada: {len(self._cache)} consultas.")
+
+    def save(self):
+        if not self.cache_path or not self._unsaved:
+            return
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"model": self.model_name, "entries": self._cache}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_path)
+        self._unsaved = 0
+
+    def _remember(self, key, rewritten):
+        self._cache[key] = rewritten
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        self._unsaved += 1
+        if self._unsaved >= self.save_every:
+            self.save()
+
+    # --- Reglas locales ---
+
+    def match_title(self, key):
+        if key in self.titles:
+            return self.titles[key]
+        padded = f" {key} "
+        for title_key in self._titles_by_length:
+            if f" {title_key} " in padded:
+                return self.titles[title_key]
+        return None
+
+    def expand_keywords(self, question, key):
+        """Consulta corta de palabras clave: se expanden siglas sin llamar al LLM."""
+        tokens = key.split()
+        if not tokens or len(tokens) > self.max_keyword_tokens or '?' in question:
+            return None
+        if any(token in QUESTION_WORDS for token in tokens):
+            return None
+        # Se conservan las palabras originales (con tildes) salvo las siglas conocidas
+        originals = split_words(question)
+        if len(originals) != len(tokens):
+            originals = tokens
+        return " ".join(ABBREVIATIONS.get(token, original) for token, original in zip(tokens, originals))
+
+    def local_rewrite(self, question):
+        """Devuelve (ruta, consulta) si una regla local basta, o (None, None)."""
+        key = normalize_text(question)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return "cache", self._cache[key]
+        title = self.match_title(key)
+        if title:
+            return "titulo", title
+        expanded = self.expand_keywords(question, key)
+        if expanded:
+            return "local", expanded
+        return None, None
+
+    def detect_filters(self, question):
+        """Filtros de facetas implícitos en la pregunta ("del MAG", "gratuitos"...)."""
+        if not self.facet_index:
+            return {}
+        filters = self.facet_index.detect(question)
+        if filters:
+            print(f"[reescritura] filtros detectados={filters}")
+        return filters
+
+    # --- Punto de entrada ---
+
+    async def rewrite(self, question):
+        start = time.perf_counter()
+        path, rewritten = self.local_rewrite(question)
+        if path is None:
+            try:
+                rewritten = (await self.chain.ainvoke({"question": question})).strip().strip('"')
+                path = "llm"
+                self._remember(normalize_text(question), rewritten)
+            except Exception as e:
+                # Sin reescritura la búsqueda sigue funcionando con la pregunta original
+                print(f"[reescritura] El LLM falló ({type(e).__name__}: {e}); se busca con la pregunta original.")
+                path, rewritten = "original", question
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        REWRITES.labels(path).inc()
+        print(f"[reescritura] ruta={path} tiempo={elapsed_ms:.1f}ms consulta='{rewritten}'")
+        return rewritten
+
@@ -0,0 +1,166 @@
+# resiliencia.py
+# Capa de resiliencia para las llamadas al LLM. Envuelve uno o varios modelos de chat
+# (Groq principal y, opcionalmente, un modelo o endpoint de respaldo) y añade:
+#   - plazo máximo por intento (una respuesta lenta ya no retiene la petición indefinidamente),
+#   - reintentos con espera exponencial y "full jitter" ante errores transitorios,
+#   - peticiones cubiertas ("hedging"): si el primer intento tarda más que `hedge_after`,
+#     se lanza un segundo en paralelo y gana el primero que termine,
+#   - respaldo: si el modelo principal agota sus intentos, se prueba el siguiente.
+# Es un modelo de chat de LangChain más, así que se compone igual en las cadenas
+# `prompt | llm` de reescritura y de respuesta.
+
+import asyncio
+import random
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from metricas import count_llm_call
+
+
+class LLMUnavailableError(RuntimeError):
+    """Ningún modelo (principal ni de respaldo) respondió dentro de los plazos."""
+
+
+def is_retryable(error):
+    """Errores HTTP 4xx del cliente (clave inválida, petición mal formada) no se reintentan."""
+    status = getattr(error, "status_code", None)
+    return not (isinstance(status, int) and 400 <= status < 500 and status not in (408, 409, 429))
+
+
+class ResilientChatModel(BaseChatModel):
+    """
+    `models` es la lista ordenada [principal, respaldo...]. `timeout` es el plazo de cada
+    intento (en streaming, el plazo hasta el primer fragmento y entre fragmentos).
+    `hedge_after` en segundos activa el hedging (0 o None lo desactiva; no aplica al streaming).
+    """
+
+    models: List[Any]
+    name_prefix: str = "llm"
+    timeout: float = 30.0
+    max_retries: int = 2
+    backoff: float = 0.5
+    max_backoff: float = 8.0
+    hedge_after: Optional[float] = None
+
+    @property
+    def _llm_type(self):
+        return "resilient"
+
+    def model_label(self, index):
+        return f"{self.name_prefix}-{'principal' if index == 0 else f'respaldo{index}'}"
+
+    def retry_delay(self, attempt):
+        # Full jitter: espera aleatoria en [0, min(max_backoff, backoff * 2^intento)]
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    # --- Llamada completa (ainvoke) ---
+
+    async def _hedged(self, model, messages):
+        """Un intento, con una segunda petición en paralelo si la primera se demora."""
+        if not self.hedge_after:
+            return await model.ainvoke(messages)
+        tasks = [asyncio.ensure_future(model.ainvoke(messages))]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if not done:
+                count_llm_call(self.name_prefix, "hedge")
+                tasks.append(asyncio.ensure_future(model.ainvoke(messages)))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+            # Todas fallaron: se propaga el error de la primera
+            return tasks[0].result()
+        finally:
+            # Al ganar una, o si vence el plazo del intento, se cancelan las que sigan en curso
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        last_error = None
+        for index, model in enumerate(self.models):
+            label = self.model_label(index)
+            for attempt in range(self.max_retries + 1):
+                start = time.perf_counter()
+                try:
+                    message = await asyncio.wait_for(self._hedged(model, messages), timeout=self.timeout)
+                    count_llm_call(self.name_prefix, "ok" if index == 0 else "fallback")
+                    return ChatResult(generations=[ChatGeneration(message=message)])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    last_error = e
+                    outcome = "timeout" if isinstance(e, asyncio.TimeoutError) else "error"
+                    count_llm_call(self.name_prefix, outcome)
+                    print(f"[llm] {label} intento {attempt + 1}/{self.max_retries + 1} falló tras "
+                          f"{(time.perf_counter() - start) * 1000:.0f}ms: {type(e).__name__}: {e}")
+                    if not is_retryable(e):
+                        break
+                    if attempt < self.max_retries:
+                        await asyncio.sleep(self.retry_delay(attempt))
+        raise LLMUnavailableError(f"El LLM no respondió: {type(last_error).__name__}: {last_error}") from last_error
+
+    # --- Streaming ---
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        """
+        Los reintentos y el respaldo solo son posibles antes del primer fragmento: una vez
+        que el cliente empezó a recibir texto, un fallo se propaga.
+        """
+        last_error = None
+        for index, model in enumerate(self.models):
+            label = self.model_label(index)
+            for attempt in range(self.max_retries + 1):
+                stream = model.astream(messages).__aiter__()
+                try:
+                    try:
+                        first = await asyncio.wait_for(stream.__anext__(), timeout=self.timeout)
+                    except asyncio.CancelledError:
+                        raise
+                    except StopAsyncIteration:
+                        return
+                    except Exception as e:
+                        last_error = e
+                        count_llm_call(self.name_prefix, "timeout" if isinstance(e, asyncio.TimeoutError) else "error")
+                        print(f"[llm] {label} (streaming) intento {attempt + 1}/{self.max_retries + 1} falló: "
+                              f"{type(e).__name__}: {e}")
+                        if not is_retryable(e):
+                            break
+                        if attempt < self.max_retries:
+                            await asyncio.sleep(self.retry_delay(attempt))
+                        continue
+                    count_llm_call(self.name_prefix, "ok" if index == 0 else "fallback")
+                    yield ChatGenerationChunk(message=first)
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(stream.__anext__(), timeout=self.timeout)
+                        except StopAsyncIteration:
+                            return
+                        yield ChatGenerationChunk(message=chunk)
+                finally:
+                    # Siempre, también si un fragmento vence el plazo a mitad del stream o el
+                    # cliente se va: cerrar el generador libera la conexión HTTP con Groq
+                    await stream.aclose()
+        raise LLMUnavailableError(f"El LLM no respondió: {type(last_error).__name__}: {last_error}") from last_error
+
+    # --- Versión síncrona (scripts); sin hedging ---
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        last_error = None
+        for model in self.models:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    return ChatResult(generations=[ChatGeneration(message=model.invoke(messages))])
+                except Exception as e:
+                    last_error = e
+                    if not is_retryable(e):
+                        break
+                    if attempt < self.max_retries:
+                        time.sleep(self.retry_delay(attempt))
+        raise LLMUnavailableError(f"El LLM no respondió: {type(last_error).__name__}: {last_error}") from last_error
@@ -0,0 +1,102 @@
+# respuesta_directa.py
+# Atajo para las consultas que son, en la práctica, el nombre de un trámite
+# ("Emisión de duplicado de cédula de identidad"): un índice difuso de títulos por
+# trigramas de caracteres (sin tildes, tolerante a erratas) y una respuesta armada con
+# plantilla a partir de los campos guardados del trámite, sin reescritura, búsqueda ni LLM.
+
+import re
+from collections import Counter
+
+from facetas import matches_where
+from fragmentacion import SECTION_TITLES
+from normalizacion import normalize_text
+
+# Campos del trámite que forman la respuesta directa, en este orden
+ANSWER_SECTIONS = ("Requisitos", "Como_Hacer_Tramite", "Costo")
+
+# Frases iniciales que no cambian el trámite pedido ("requisitos para ...") (ya normalizadas)
+INTENT_PREFIXES = (
+    "cuales son los requisitos para", "cuales son los requisitos de", "requisitos para", "requisitos de",
+    "como hago el tramite de", "como hago", "como saco", "como obtengo", "como solicito",
+    "quiero hacer", "quiero", "necesito", "informacion sobre", "informacion de", "tramite de", "tramite para",
+)
+INTENT_PREFIX_RE = re.compile(r"^(?:" + "|".join(re.escape(p) for p in INTENT_PREFIXES) + r")\s+(?:el |la |los |las |un |una )?")
+
+# Con 0.9 se toleran erratas de una letra pero no preguntas que añaden condiciones al título
+DEFAULT_THRESHOLD = 0.9
+# Diferencia mínima con el segundo candidato: títulos casi iguales van por la cadena RAG
+DEFAULT_MARGIN = 0.05
+
+
+def trigrams(text):
+    """Trigramas de caracteres del texto normalizado, con los bordes marcados por espacios."""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def title_key(question):
+    """Pregunta -> texto comparable con los títulos: normalizada y sin la frase de intención."""
+    return INTENT_PREFIX_RE.sub("", normalize_text(question), count=1)
+
+
+class TitleIndex:
+    """
+    Índice invertido trigrama -> títulos de trámites. `match` devuelve la URL del trámite
+    cuando la similitud de Dice con un título supera `threshold` con margen suficiente.
+    """
+
+    def __init__(self, parent_store, threshold=DEFAULT_THRESHOLD, margin=DEFAULT_MARGIN):
+        self.parent_store = parent_store
+        self.threshold = threshold
+        self.margin = margin
+        self.urls = []
+        self.grams = []
+        self.postings = {}
+        for url, parent in parent_store.parents.items():
+            grams = trigrams(normalize_text(parent.get("Nombre_Tramite", "")))
+            if not grams:
+                continue
+            n = len(self.urls)
+            self.urls.append(url)
+            self.grams.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(n)
+
+    def __len__(self):
+        return len(self.urls)
+
+    def ranked(self, question, where=None, limit=2):
+        """Mejores (puntaje, url) para la pregunta entre los trámites que cumplen `where`."""
+        grams = trigrams(title_key(question))
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        scored = []
+        for n, count in shared.items():
+            url = self.urls[n]
+            if where and not matches_where(self.parent_store.parents[url].get("facets", {}), where):
+                continue
+            scored.append((2 * count / (len(grams) + self.grams[n]), url))
+        scored.sort(reverse=True)
+        return scored[:limit]
+
+    def match(self, question, where=None):
+        """URL del trámite nombrado en la pregunta, o None si no hay una coincidencia segura."""
+        ranked = self.ranked(question, where)
+        if not ranked or ranked[0][0] < self.threshold:
+            return None
+        if len(ranked) > 1 and ranked[0][0] - ranked[1][0] < self.margin:
+            return None
+        return ranked[0][1]
+
+    def render(self, url):
+        """Respuesta con plantilla a partir de los campos guardados del trámite."""
+        parent = self.parent_store.parents[url]
+        sections = parent["sections"]
+        parts = [f"**{parent['Nombre_Tramite']}** ({parent['Institucion_Responsable']})"]
+        for field in ANSWER_SECTIONS:
+            parts.append(f"**{SECTION_TITLES[field]}:**\n{sections.get(field, 'No disponible')}")
+        parts.append(f"**Fuente oficial:** {url}\n"
+                     f"**Última actualización:** {parent.get('Fecha_Actualizacion', 'No disponible')}")
+        parts.append("Recuerda verificar la información en la fuente oficial.")
+        return "\n\n".join(parts)
@@ -0,0 +1,16 @@
+# respuesta_simulada.py
+# Respuesta determinista de los LLM simulados (bench_carga.py y servidor_llm_simulado.py).
+# Solo usa la biblioteca estándar: el servidor simulado no debe cargar httpx, numpy ni LangChain.
+
+import re
+
+# Pregunta dentro de la plantilla de reescritura (reescritura.py)
+REWRITE_QUESTION_RE = re.compile(r'Pregunta Original: "(.*)"', re.DOTALL)
+
+
+def simulated_words(prompt, answer_tokens):
+    """A la plantilla de reescritura responde con la misma pregunta; al resto, `answer_tokens` palabras fijas."""
+    match = REWRITE_QUESTION_RE.search(prompt)
+    if match:
+        return match.group(1).split()
+    return [f"palabra{i % 50}" for i in range(answer_tokens)]
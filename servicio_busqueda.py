@@ -0,0 +1,217 @@
+# servicio_busqueda.py
+# Servicio local ("sidecar") de embeddings y búsqueda compartido por todos los workers de
+# uvicorn. Cada worker cargaba su propia copia de sentence-transformers/PyTorch, de Chroma
+# y de los índices, y la memoria crecía linealmente con el número de workers. Con este
+# servicio el modelo y los índices se cargan una sola vez; los workers (SEARCH_SIDECAR_SOCKET)
+# le piden embeddings y búsquedas por un socket Unix y no importan PyTorch.
+# Uso (la clave es obligatoria y debe ser la misma en el servicio y en los workers):
+#   export SEARCH_SIDECAR_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(32))")
+#   python servicio_busqueda.py        # imprime la ruta del socket
+#   SEARCH_SIDECAR_SOCKET=$XDG_RUNTIME_DIR/asistente_busqueda.sock uvicorn main:app --workers 4
+
+import argparse
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+from langchain_core.embeddings import Embeddings
+
+from busqueda import DEFAULT_RESULT_FIELDS
+from metricas import stage
+
+SOCKET_NAME = "asistente_busqueda.sock"
+# Los mensajes viajan serializados con pickle, así que quien conteste por el socket puede
+# ejecutar código en el worker. Por eso el socket vive en un directorio privado (0700) del
+# usuario, el cliente solo se conecta a un socket de su mismo usuario y cada conexión se
+# autentica con una clave secreta que no tiene valor por defecto (SEARCH_SIDECAR_AUTHKEY).
+
+
+def default_socket_path():
+    """$XDG_RUNTIME_DIR (privado por usuario) o, si no existe, un directorio 0700 en el temporal."""
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if not runtime_dir:
+        runtime_dir = os.path.join(tempfile.gettempdir(), f"asistente-{os.getuid()}")
+    return os.path.join(runtime_dir, SOCKET_NAME)
+
+
+def ensure_private_dir(path):
+    """Crea el directorio con permisos 0700 o verifica que ya sea privado y del usuario actual."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f"'{path}' debe ser un directorio del usuario actual con permisos 0700.")
+
+
+def check_socket_owner(socket_path):
+    """Rechaza un socket creado por otro usuario (podría suplantar al servicio)."""
+    info = os.lstat(socket_path)
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"'{socket_path}' no es un socket del usuario actual.")
+
+
+def require_authkey(authkey):
+    if not authkey:
+        raise RuntimeError("Define SEARCH_SIDECAR_AUTHKEY (la misma clave secreta en el servicio y los workers).")
+    return authkey
+
+
+class SearchClient:
+    """
+    Cliente bloqueante del servicio. Cada hilo del pool de búsqueda del worker usa su propia
+    conexión, así que las llamadas concurrentes no se serializan en el cliente.
+    """
+
+    def __init__(self, socket_path, authkey, connect_timeout=60.0):
+        self.socket_path = socket_path
+        self.authkey = require_authkey(authkey).encode()
+        self.connect_timeout = connect_timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        # El servicio puede estar arrancando todavía (carga del modelo): se reintenta
+        deadline = time.monotonic() + self.connect_timeout
+        while True:
+            try:
+                check_socket_owner(self.socket_path)
+                return Client(self.socket_path, family="AF_UNIX", authkey=self.authkey)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.5)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def call(self, op, *args):
+        try:
+            conn = self._connection()
+            conn.send((op, args))
+            ok, result = conn.recv()
+        except (EOFError, OSError):
+            # El servicio se reinició: se reconecta una vez
+            self._local.conn = None
+            conn = self._connection()
+            conn.send((op, args))
+            ok, result = conn.recv()
+        if not ok:
+            raise RuntimeError(f"Error en el servicio de búsqueda: {result}")
+        return result
+
+
+class RemoteEmbeddings(Embeddings):
+    """Embeddings calculados por el servicio (interfaz `Embeddings` de LangChain)."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def embed_query(self, text):
+        return self.client.call("embed_query", text)
+
+    def embed_documents(self, texts):
+        return self.client.call("embed_documents", list(texts))
+
+
+class RemoteSearcher:
+    """Misma interfaz que HybridSearcher (`search`, `search_many`) ejecutada en el servicio."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def search(self, query, filters=None):
+        # Embedding y búsqueda ocurren en el servicio: aquí se mide el total con la ida y vuelta
+        with stage("search"):
+            return self.client.call("search", query, filters)
+
+    def search_many(self, queries, filters=None):
+        with stage("search"):
+            return self.client.call("search_many", list(queries), filters)
+
+    def search_tramites(self, query, filters=None, offset=0, limit=10, fields=DEFAULT_RESULT_FIELDS,
+                        max_results=100):
+        with stage("search"):
+            return self.client.call("search_tramites", query, filters, offset, limit, fields, max_results)
+
+    def titles(self):
+        return self.client.call("titles")
+
+
+# --- Lado del servicio ---
+
+def handle_connection(conn, handlers):
+    """Atiende las peticiones de una conexión (un hilo de un worker) hasta que se cierre."""
+    with conn:
+        while True:
+            try:
+                op, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                conn.send((True, handlers[op](*args)))
+            except Exception as e:
+                conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+def serve(socket_path, authkey):
+    require_authkey(authkey)
+    ensure_private_dir(os.path.dirname(os.path.abspath(socket_path)))
+    # Se reutiliza la misma carga que el servidor en modo de un solo proceso
+    import main
+
+    embeddings, db, searcher = main.build_search_stack()
+    titles = main.tramite_titles(db)
+    if main.WARMUP_ON_STARTUP:
+        main.warmup_searcher(searcher)
+    handlers = {
+        "ping": lambda: "pong",
+        "embed_query": embeddings.embed_query,
+        "embed_documents": embeddings.embed_documents,
+        "search": searcher.search,
+        "search_many": searcher.search_many,
+        "search_tramites": searcher.search_tramites,
+        "titles": lambda: titles,
+    }
+
+    if os.path.lexists(socket_path):
+        # Un socket de una ejecución anterior; el directorio es privado, así que es nuestro
+        check_socket_owner(socket_path)
+        os.remove(socket_path)
+    old_umask = os.umask(0o177)   # socket creado directamente con permisos 0600
+    try:
+        listener = Listener(socket_path, family="AF_UNIX", authkey=authkey.encode())
+    finally:
+        os.umask(old_umask)
+    print(f"Servicio de búsqueda escuchando en '{socket_path}' (PID {os.getpid()}).")
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                # Un cliente con clave incorrecta no debe tumbar el servicio
+                print(f"Conexión rechazada: {type(e).__name__}: {e}")
+                continue
+            threading.Thread(target=handle_connection, args=(conn, handlers), daemon=True).start()
+    finally:
+        listener.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio compartido de embeddings y búsqueda para los workers.")
+    parser.add_argument("--socket", default=os.getenv("SEARCH_SIDECAR_SOCKET") or default_socket_path(),
+                        help="Ruta del socket Unix (su directorio debe ser privado, 0700).")
+    args = parser.parse_args()
+    try:
+        serve(args.socket, os.getenv("SEARCH_SIDECAR_AUTHKEY", ""))
+    except (RuntimeError, PermissionError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# servidor_llm_simulado.py
+# Servidor local que imita la API de chat de Groq (compatible con OpenAI) para probar la
+# capa de resiliencia (resiliencia.py) sin red ni cuota: latencia y velocidad de tokens
+# configurables, y una fracción de peticiones lentas o con error 503.
+# Uso:
+#   python servidor_llm_simulado.py --port 8100 --latency 0.3 --slow-rate 0.1 --error-rate 0.05
+#   GROQ_BASE_URL=http://127.0.0.1:8100 GROQ_API_KEY=simulado uvicorn main:app
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from respuesta_simulada import simulated_words
+
+config = {
+    "latency": 0.3,
+    "tokens_per_second": 400.0,
+    "answer_tokens": 150,
+    "slow_rate": 0.0,
+    "slow_latency": 10.0,
+    "error_rate": 0.0,
+}
+stats = {"requests": 0, "slow": 0, "errors": 0}
+
+app = FastAPI(title="LLM simulado (API compatible con Groq)")
+
+
+def reply_words(messages):
+    """A la plantilla de reescritura responde con la misma pregunta; al resto, texto fijo."""
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    return prompt, simulated_words(prompt, config["answer_tokens"])
+
+
+def usage(prompt, words):
+    prompt_tokens = len(prompt) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+            "total_tokens": prompt_tokens + len(words)}
+
+
+@app.get("/stats")
+def get_stats():
+    return {**stats, "config": config}
+
+
+@app.post("/openai/v1/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    if random.random() < config["error_rate"]:
+        stats["errors"] += 1
+        return JSONResponse(status_code=503, content={"error": {"message": "Servicio simulado no disponible."}})
+    delay = config["latency"]
+    if random.random() < config["slow_rate"]:
+        stats["slow"] += 1
+        delay = config["slow_latency"]
+
+    prompt, words = reply_words(body.get("messages", []))
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    created = int(time.time())
+    model = body.get("model", "simulado")
+
+    if not body.get("stream"):
+        await asyncio.sleep(delay + len(words) / config["tokens_per_second"])
+        return {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)},
+                         "finish_reason": "stop"}],
+            "usage": usage(prompt, words),
+        }
+
+    async def events():
+        await asyncio.sleep(delay)
+        for i, word in enumerate(words):
+            await asyncio.sleep(1 / config["tokens_per_second"])
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"content": word if i == len(words) - 1 else f"{word} "},
+                             "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        final = {
+            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "x_groq": {"id": completion_id, "usage": usage(prompt, words)},
+        }
+        yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM simulado compatible con la API de Groq.")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.3, help="Segundos hasta el primer token.")
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--answer-tokens", type=int, default=150)
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Fracción de peticiones lentas.")
+    parser.add_argument("--slow-latency", type=float, default=10.0, help="Latencia de las peticiones lentas.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de peticiones con error 503.")
+    args = parser.parse_args()
+    config.update({
+        "latency": args.latency, "tokens_per_second": args.tokens_per_second,
+        "answer_tokens": args.answer_tokens, "slow_rate": args.slow_rate,
+        "slow_latency": args.slow_latency, "error_rate": args.error_rate,
+    })
+
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
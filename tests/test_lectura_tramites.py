@@ -0,0 +1,29 @@
+import io
+import json
+
+import pytest
+
+import lectura_tramites
+from lectura_tramites import iter_json_array
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    # Bloques más chicos que los valores: cada uno cruza al menos un borde de lectura
+    monkeypatch.setattr(lectura_tramites, "READ_BLOCK_SIZE", 7)
+
+
+@pytest.mark.parametrize("values", [
+    [12345678901234],
+    [1, 22, 333, 4444, 55555, 666666, 7777777, 1.5e-300, -0.25, True, False, None],
+    ["cadena que no cabe en un bloque", {"Nombre_Tramite": "Duplicado de cédula", "Costo": "5.00"}],
+    [],
+])
+def test_small_blocks_decode_only_complete_values(small_blocks, values):
+    text = json.dumps(values, ensure_ascii=False, indent=2)
+    assert list(iter_json_array(io.StringIO(text))) == values
+
+
+def test_unclosed_array_is_an_error(small_blocks):
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(io.StringIO("[1, 2, 3")))
@@ -0,0 +1,26 @@
+# version_indice.py
+# Marca de versión del índice vectorial. Los scripts de ingesta la escriben al terminar
+# de reconstruir `tramites_chroma_db`; el servidor la consulta para invalidar sus cachés.
+
+import os
+import time
+import uuid
+
+INDEX_VERSION_FILE = "index_version.txt"
+
+
+def write_index_version(db_path):
+    """Genera una versión nueva para el índice en `db_path` y la devuelve."""
+    version = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    with open(os.path.join(db_path, INDEX_VERSION_FILE), 'w', encoding='utf-8') as f:
+        f.write(version)
+    return version
+
+
+def read_index_version(db_path):
+    """Devuelve la versión actual del índice o None si no existe la marca."""
+    try:
+        with open(os.path.join(db_path, INDEX_VERSION_FILE), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None